@@ -11,16 +11,55 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import re
+import threading
 
+from oslo_config import cfg
 from oslo_log import log
 
 from delfin import context
 from delfin import db
 from delfin import exception
+from delfin.common import constants
 from delfin.drivers import api as driver_manager
+from delfin.task_manager import rpcapi as task_rpcapi
+from delfin.task_manager.tasks import task
 
 LOG = log.getLogger(__name__)
 
+alert_resync_opts = [
+    cfg.IntOpt('alert_resync_delay',
+               default=30,
+               min=0,
+               help='Seconds to wait after an alert about a resource before '
+                    'resyncing it, the alerts about the same type of '
+                    'resource of a storage received meanwhile are served by '
+                    'the same resync. 0 disables the resync on alerts.'),
+    cfg.DictOpt('alert_resync_rules',
+                default={'Symmetrix': 'storage_device',
+                         'Device': 'storage_volume',
+                         'Thin Device Data Pool': 'storage_pool',
+                         'Snap Save Device Pool': 'storage_pool',
+                         'SRDF/A DSE Device Pool': 'storage_pool'},
+                help='Type of resource to resync on an alert about a type of '
+                     'component, as reported in the location of the alert '
+                     'model. Values are storage_device, storage_pool or '
+                     'storage_volume.'),
+    cfg.IntOpt('alert_resync_max_attempts',
+               default=10,
+               min=1,
+               help='Number of times the resync on alerts of a resource is '
+                    'attempted, while the resource is already syncing or '
+                    'the resync cannot be sent, before it is given up.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(alert_resync_opts)
+
+# Location filled by drivers, see the VMAX alert handler
+_LOCATION_PATTERN = re.compile(
+    r'^Component type: (?P<type>.*),Component name: (?P<name>.*)$')
+
 
 class AlertProcessor(object):
     """Alert model translation and export functions"""
@@ -30,7 +69,8 @@ class AlertProcessor(object):
 
     def process_alert_info(self, alert):
         """Fills alert model using driver manager interface."""
-        storage = db.storage_get(context, alert['storage_id'])
+        ctxt = context.get_admin_context()
+        storage = db.storage_get(ctxt, alert['storage_id'])
 
         # Fill storage specific info
         alert['storage_name'] = storage['name']
@@ -38,7 +78,7 @@ class AlertProcessor(object):
         alert['model'] = storage['model']
 
         try:
-            alert_model = self.driver_manager.parse_alert(context,
+            alert_model = self.driver_manager.parse_alert(ctxt,
                                                           alert['storage_id'],
                                                           alert)
         except Exception as e:
@@ -48,6 +88,159 @@ class AlertProcessor(object):
 
         self._export_alert_model(alert_model)
 
+        if CONF.alert_resync_delay > 0 and alert_model:
+            try:
+                ALERT_RESYNC.add(ctxt, alert['storage_id'], alert_model)
+            except Exception as e:
+                LOG.warning('Failed to resync on alert: {0}'.format(e))
+
     def _export_alert_model(self, alert_model):
         """Exports the filled alert model to the export manager."""
         LOG.info('Alert model to be exported: %s.', alert_model)
+
+
+class AlertResync(object):
+    """Debounced resync of the resources alerts are about.
+
+    An alert is mapped to a type of resource by CONF.alert_resync_rules.
+    When the resource itself is known in database, only its pool is
+    resynced, otherwise all the resources of its type. The resync of a
+    type of resource of a storage is started CONF.alert_resync_delay
+    seconds after the first alert about it, and covers the alerts received
+    meanwhile. It is retried after the same delay while the resource is
+    already syncing or the resync cannot be sent, up to
+    CONF.alert_resync_max_attempts times.
+    """
+
+    def __init__(self):
+        self._task_rpcapi = None
+        self._lock = threading.Lock()
+        # (storage_id, task class) to the original ids of the pools to
+        # resync, or None to resync all of them
+        self._pending = {}
+
+    @property
+    def task_rpcapi(self):
+        if self._task_rpcapi is None:
+            self._task_rpcapi = task_rpcapi.TaskAPI()
+        return self._task_rpcapi
+
+    def add(self, ctxt, storage_id, alert_model):
+        target = self._get_target(ctxt, storage_id, alert_model)
+        if target is None:
+            return
+        task_cls, pool_ids = target
+        key = (storage_id, task_cls)
+        if not self._add_pending(key, pool_ids):
+            return
+        LOG.info('Resync {0} of storage {1} in {2} seconds on alert {3}'
+                 .format(task_cls.__name__, storage_id,
+                         CONF.alert_resync_delay, alert_model.get('alarm_id')))
+        self._schedule(ctxt, key)
+
+    def _add_pending(self, key, pool_ids):
+        """Add pools to resync, return whether no resync was pending."""
+        with self._lock:
+            if key in self._pending:
+                pending = self._pending[key]
+                if pending is None or pool_ids is None:
+                    self._pending[key] = None
+                else:
+                    pending.update(pool_ids)
+                return False
+            self._pending[key] = pool_ids
+            return True
+
+    @staticmethod
+    def _get_target(ctxt, storage_id, alert_model):
+        """Return the task class and the pools to resync for an alert."""
+        match = _LOCATION_PATTERN.match(alert_model.get('location') or '')
+        if not match:
+            return None
+        resource_type = CONF.alert_resync_rules.get(match.group('type'))
+        if not resource_type:
+            return None
+        for task_cls in task.StorageResourceTask.__subclasses__():
+            if task_cls.resource_type.name.lower() == resource_type:
+                break
+        else:
+            LOG.warning('Unknown resource type {0} in alert_resync_rules'
+                        .format(resource_type))
+            return None
+
+        name = match.group('name')
+        pool_id = None
+        if task_cls.resource_type == constants.ResourceType.STORAGE_POOL:
+            pool_id = name
+        elif task_cls.resource_type == constants.ResourceType.STORAGE_VOLUME:
+            volumes = db.volume_get_all(
+                ctxt, limit=1,
+                filters={'storage_id': storage_id, 'original_id': name})
+            if volumes:
+                pool_id = volumes[0]['original_pool_id']
+        if pool_id and db.storage_pool_get_fingerprints(
+                ctxt, storage_id, original_ids=[pool_id]):
+            return task_cls, set([pool_id])
+        # The pool is unknown, all the resources of the type are resynced
+        return task_cls, None
+
+    def _schedule(self, ctxt, key, attempt=1):
+        timer = threading.Timer(CONF.alert_resync_delay, self._resync,
+                                (ctxt, key, attempt))
+        timer.daemon = True
+        timer.start()
+
+    def _resync(self, ctxt, key, attempt=1):
+        storage_id, task_cls = key
+        try:
+            started = db.storage_update_sync_status(
+                ctxt, storage_id, 1 << task_cls.resource_type,
+                constants.SyncStatus.SYNCING,
+                expected=constants.SyncStatus.SYNCED)
+            if not started:
+                # Raises if the storage was removed
+                db.storage_get(ctxt, storage_id)
+        except Exception as e:
+            LOG.warning('Give up the resync of {0} of storage {1}: {2}'
+                        .format(task_cls.__name__, storage_id, e))
+            with self._lock:
+                self._pending.pop(key, None)
+            return
+
+        if not started:
+            LOG.info('{0} of storage {1} is syncing, retry its resync later'
+                     .format(task_cls.__name__, storage_id))
+            self._retry(ctxt, key, attempt)
+            return
+
+        with self._lock:
+            pool_ids = self._pending.pop(key, None)
+        try:
+            self.task_rpcapi.sync_storage_resource(
+                ctxt, storage_id,
+                task_cls.__module__ + '.' + task_cls.__name__,
+                original_pool_ids=sorted(pool_ids) if pool_ids else None)
+        except Exception as e:
+            LOG.warning('Failed to send the resync of {0} of storage {1}: '
+                        '{2}'.format(task_cls.__name__, storage_id, e))
+            # Nothing will sync the resource, it must not stay syncing
+            db.storage_update_sync_status(
+                ctxt, storage_id, 1 << task_cls.resource_type,
+                constants.SyncStatus.SYNCED)
+            # Unless alerts received meanwhile already scheduled a resync
+            if self._add_pending(key, pool_ids):
+                self._retry(ctxt, key, attempt)
+
+    def _retry(self, ctxt, key, attempt):
+        storage_id, task_cls = key
+        if attempt >= CONF.alert_resync_max_attempts:
+            LOG.warning('Give up the resync of {0} of storage {1} after {2} '
+                        'attempts'.format(task_cls.__name__, storage_id,
+                                          attempt))
+            with self._lock:
+                self._pending.pop(key, None)
+            return
+        self._schedule(ctxt, key, attempt + 1)
+
+
+ALERT_RESYNC = AlertResync()
@@ -36,3 +36,24 @@ create = {
     'required': ['host', 'port', 'username', 'password', 'vendor', 'model'],
     'additionalProperties': False
 }
+
+sync = {
+    'type': ['object', 'null'],
+    'properties': {
+        'resource_types': {
+            'type': 'array',
+            'items': {'type': 'string',
+                      'enum': ['storage_device', 'storage_pool',
+                               'storage_volume']},
+            'minItems': 1,
+            'uniqueItems': True
+        },
+        'storage_pool_ids': {
+            'type': 'array',
+            'items': {'type': 'string', 'minLength': 1, 'maxLength': 36},
+            'minItems': 1,
+            'uniqueItems': True
+        }
+    },
+    'additionalProperties': False
+}
@@ -18,6 +18,7 @@ from delfin.api.v1 import access_info
 from delfin.api.v1 import alert
 from delfin.api.v1 import storage_pools
 from delfin.api.v1 import storages
+from delfin.api.v1 import sync_jobs
 from delfin.api.v1 import volumes
 
 
@@ -38,6 +39,12 @@ class APIRouter(common.APIRouter):
                        action="sync_all",
                        conditions={"method": ["POST"]})
 
+        self.resources['sync_jobs'] = sync_jobs.create_resource()
+        mapper.connect("storages", "/storages/{id}/sync-jobs",
+                       controller=self.resources['sync_jobs'],
+                       action="index",
+                       conditions={"method": ["GET"]})
+
         self.resources['access_info'] = access_info.create_resource()
         mapper.connect("storages", "/storages/{id}/access-info",
                        controller=self.resources['access_info'],
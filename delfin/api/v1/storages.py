@@ -18,7 +18,6 @@ from oslo_log import log
 
 from delfin import coordination
 from delfin import db
-from delfin import utils
 from delfin import exception
 from delfin.api import api_utils
 from delfin.api import validation
@@ -111,40 +110,68 @@ class StorageController(wsgi.Controller):
          volume etc. tasks on each registered storage device.
         """
         ctxt = req.environ['delfin.context']
-
-        storages = db.storage_get_all(ctxt)
-        LOG.debug("Total {0} registered storages found in database".
-                  format(len(storages)))
-
-        for storage in storages:
-            try:
-                _set_synced_if_ok(ctxt, storage['id'])
-            except exception.InvalidInput as e:
-                LOG.warn('Can not set SYNCING for %s, reason is %s'
-                         % (storage['id'], e.msg))
-                continue
-            else:
-                for subclass in task.StorageResourceTask.__subclasses__():
-                    self.task_rpcapi.sync_storage_resource(
-                        ctxt,
-                        storage['id'],
-                        subclass.__module__ + '.' + subclass.__name__)
+        # The storages are marked as syncing and their syncs are dispatched
+        # by the task manager
+        self.task_rpcapi.sync_all_storages(ctxt)
 
     @wsgi.response(202)
-    def sync(self, req, id):
+    @validation.schema(schema_storages.sync)
+    def sync(self, req, id, body=None):
         """
         :param req:
         :param id:
+        :param body: optional, resource_types limits the sync to these
+        types of resources, storage_pool_ids limits the sync of pools and
+        volumes to these pools. If only storage_pool_ids is given, pools
+        and volumes are synced.
         :return:
         """
         ctxt = req.environ['delfin.context']
         storage = db.storage_get(ctxt, id)
-        _set_synced_if_ok(ctxt, storage['id'])
-        for subclass in task.StorageResourceTask.__subclasses__():
+        body = body or {}
+
+        subclasses = task.StorageResourceTask.__subclasses__()
+        original_pool_ids = None
+        if 'storage_pool_ids' in body:
+            original_pool_ids = self._get_original_pool_ids(
+                ctxt, storage['id'], body['storage_pool_ids'])
+            subclasses = [subclass for subclass in subclasses
+                          if subclass.resource_type !=
+                          constants.ResourceType.STORAGE_DEVICE]
+        if 'resource_types' in body:
+            subclasses = [subclass for subclass in
+                          task.StorageResourceTask.__subclasses__()
+                          if subclass.resource_type.name.lower() in
+                          body['resource_types']]
+
+        # Only the bits of the resources to sync are set
+        mask = 0
+        for subclass in subclasses:
+            mask |= 1 << subclass.resource_type
+        _set_synced_if_ok(ctxt, storage['id'], mask)
+        for subclass in subclasses:
+            if subclass.resource_type == \
+                    constants.ResourceType.STORAGE_DEVICE:
+                pool_ids = None
+            else:
+                pool_ids = original_pool_ids
             self.task_rpcapi.sync_storage_resource(
                 ctxt,
                 storage['id'],
-                subclass.__module__ + '.' + subclass.__name__)
+                subclass.__module__ + '.' + subclass.__name__,
+                original_pool_ids=pool_ids)
+
+    @staticmethod
+    def _get_original_pool_ids(context, storage_id, storage_pool_ids):
+        original_pool_ids = []
+        for storage_pool_id in storage_pool_ids:
+            storage_pool = db.storage_pool_get(context, storage_pool_id)
+            if storage_pool['storage_id'] != storage_id:
+                msg = 'Storage pool %s does not belong to storage %s' \
+                      % (storage_pool_id, storage_id)
+                raise exception.InvalidInput(message=msg)
+            original_pool_ids.append(storage_pool['original_id'])
+        return original_pool_ids
 
     def _storage_exist(self, context, access_info):
         access_info_dict = copy.deepcopy(access_info)
@@ -179,23 +206,23 @@ def create_resource():
     return wsgi.Resource(StorageController())
 
 
-@coordination.synchronized('{storage_id}')
-def _set_synced_if_ok(context, storage_id):
+def _set_synced_if_ok(context, storage_id, mask=None):
+    # Set the bits of mask, all bits by default, of sync_status to SYNCING
+    # if none of their sync tasks is running
+    if mask is None:
+        mask = (1 << len(constants.ResourceType)) - 1
+    if db.storage_update_sync_status(
+            context, storage_id, mask,
+            constants.SyncStatus.SYNCING,
+            expected=constants.SyncStatus.SYNCED):
+        return
+
     try:
-        storage = db.storage_get(context, storage_id)
+        db.storage_get(context, storage_id)
     except exception.StorageNotFound:
         msg = 'Storage %s not found when try to set sync_status' \
               % storage_id
         raise exception.InvalidInput(message=msg)
     else:
-        if storage[constants.DB.DEVICE_SYNC_STATUS] != \
-                constants.SyncStatus.SYNCED:
-            msg = 'Sync task is running for %s' % storage['id']
-            raise exception.InvalidInput(message=msg)
-        # Set all bits of sync_status to SYNCING and start sync tasks
-        storage[constants.DB.DEVICE_SYNC_STATUS] = utils.set_bits(
-            storage[constants.DB.DEVICE_SYNC_STATUS],
-            0,
-            len(constants.ResourceType) - 1,
-            constants.SyncStatus.SYNCING)
-        db.storage_update(context, storage['id'], storage)
+        msg = 'Sync task is running for %s' % storage_id
+        raise exception.InvalidInput(message=msg)
@@ -38,7 +38,7 @@ def schema(request_body_schema):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             schema_validator = validators._SchemaValidator(request_body_schema)
-            schema_validator.validate(kwargs['body'])
+            schema_validator.validate(kwargs.get('body'))
             return func(*args, **kwargs)
         return wrapper
 
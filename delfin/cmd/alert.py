@@ -42,8 +42,10 @@ def main():
     log.setup(CONF, "delfin")
     utils.monkey_patch()
 
-    # Launch alert manager service
-    alert_manager = service.AlertService.create(binary='delfin-alert')
+    # Launch alert manager service, with coordination to send the syncs
+    # triggered by alerts to the task host owning the storage
+    alert_manager = service.AlertService.create(binary='delfin-alert',
+                                                coordination=True)
     service.serve(alert_manager)
     service.wait()
 
@@ -62,6 +62,22 @@ class SyncStatus(IntEnum):
     SYNCING = 1
 
 
+class SyncJobStatus(object):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+
+    ACTIVE = (QUEUED, RUNNING)
+
+
+class CircuitState(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
 class DB(object):
     DEVICE_SYNC_STATUS = 'sync_status'
 
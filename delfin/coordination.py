@@ -17,9 +17,12 @@ import inspect
 import decorator
 from oslo_config import cfg
 from oslo_log import log
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import six
+import tooz
 from tooz import coordination
+from tooz import hashring
 from tooz import locking
 
 from delfin import cryptor
@@ -45,7 +48,11 @@ coordination_opts = [
                help='The backend server for distributed coordination.'),
     cfg.IntOpt('expiration',
                default=100,
-               help='The expiration(in second) of the lock.')
+               help='The expiration(in second) of the lock.'),
+    cfg.IntOpt('ring_refresh_interval',
+               default=10,
+               help='Seconds between two refreshes of a hash ring from the '
+                    'members of its coordination group.'),
 ]
 
 CONF = cfg.CONF
@@ -68,6 +75,7 @@ class Coordinator(object):
         self.agent_id = agent_id or uuidutils.generate_uuid()
         self.started = False
         self.prefix = prefix
+        self._leader_locks = {}
 
     def start(self):
         """Connect to coordination back end."""
@@ -92,6 +100,7 @@ class Coordinator(object):
             self.coordinator.stop()
             self.coordinator = None
             self.started = False
+            self._leader_locks = {}
 
         LOG.info(msg, msg_args)
 
@@ -108,10 +117,133 @@ class Coordinator(object):
         else:
             raise exception.LockCreationFailed(_('Coordinator uninitialized.'))
 
+    def elect_leader(self, name):
+        """Try to become, or check if this node is, the leader for name.
+
+        Leadership is a lock which is acquired without blocking and never
+        released. The heartbeat of the back end keeps it while this node is
+        alive, another node takes the lead once it expired. A leader checks
+        that it still owns the lock at every call, so that it stops leading
+        once its lock expired, e.g. when its heartbeats were lost.
+
+        :param str name: The name of the election, shared by all nodes.
+        :return: True if this node is the leader
+        """
+        if name in self._leader_locks:
+            if self._is_still_leader(name):
+                return True
+            LOG.warning('Lost the leadership for %s', name)
+            lock = self._leader_locks.pop(name)
+            try:
+                lock.release()
+            except Exception:
+                pass
+        lock = self.get_lock('leader-' + name)
+        if not lock.acquire(blocking=False):
+            return False
+        LOG.info('Elected as leader for %s', name)
+        self._leader_locks[name] = lock
+        return True
+
+    def _is_still_leader(self, name):
+        try:
+            return self._leader_locks[name].is_still_owner()
+        except tooz.NotImplemented:
+            # The back end cannot tell, its heartbeat keeps the lock
+            return True
+        except Exception as e:
+            LOG.warning('Failed to check the leadership for %(name)s: '
+                        '%(err)s', {'name': name, 'err': e})
+            return False
+
+    def join_group(self, group, capabilities=b''):
+        """Join a group, creating it if needed.
+
+        :param str group: The group name, shared by all nodes.
+        :param bytes capabilities: Data other members can get about this one.
+        """
+        group_id = (self.prefix + group).encode('ascii')
+        if not self.started:
+            raise exception.LockCreationFailed(_('Coordinator uninitialized.'))
+        try:
+            self.coordinator.create_group(group_id).get()
+        except coordination.GroupAlreadyExist:
+            pass
+        try:
+            self.coordinator.join_group(group_id, capabilities).get()
+        except coordination.MemberAlreadyExist:
+            pass
+
+    def get_members(self, group):
+        """Return the capabilities of the living members of a group.
+
+        :param str group: The group name, shared by all nodes.
+        :return: dict of member id to capabilities
+        """
+        group_id = (self.prefix + group).encode('ascii')
+        if not self.started:
+            raise exception.LockCreationFailed(_('Coordinator uninitialized.'))
+        try:
+            members = self.coordinator.get_members(group_id).get()
+        except coordination.GroupNotCreated:
+            return {}
+        futures = dict((member, self.coordinator.get_member_capabilities(
+            group_id, member)) for member in members)
+        return dict((member, future.get())
+                    for member, future in futures.items())
+
 
 LOCK_COORDINATOR = Coordinator(prefix='delfin-')
 
 
+class GroupHashRing(object):
+    """Consistent hash ring over the members of a coordination group.
+
+    Every member joins the group with its name, typically its host, and
+    keys are mapped to the names with a hash ring. The ring is rebuilt from
+    the group at most every CONF.coordination.ring_refresh_interval seconds,
+    so that keys move to other members when members join or leave, and
+    only the keys of these members move.
+
+    :param str group: The group name, shared by all nodes.
+    :param coordinator: Coordinator object to use. Defaults to the global
+        coordinator.
+    """
+
+    def __init__(self, group, coordinator=None):
+        self.group = group
+        self.coordinator = coordinator or LOCK_COORDINATOR
+        self._ring = None
+        self._refreshed_at = None
+
+    def join(self, name):
+        self.coordinator.join_group(self.group, name.encode('utf-8'))
+        self._refreshed_at = None
+
+    def get_node(self, key):
+        """Return the name of the member owning key, or None if unknown."""
+        if self._refreshed_at is None or timeutils.is_older_than(
+                self._refreshed_at, CONF.coordination.ring_refresh_interval):
+            self._refresh()
+        if not self._ring:
+            return None
+        return next(iter(self._ring.get_nodes(key.encode('utf-8'))))
+
+    def _refresh(self):
+        try:
+            members = self.coordinator.get_members(self.group)
+        except Exception as e:
+            LOG.warning('Failed to get the members of %(group)s: %(err)s',
+                        {'group': self.group, 'err': e})
+            self._ring = None
+        else:
+            names = set(capabilities.decode('utf-8')
+                        for capabilities in members.values()
+                        if capabilities)
+            self._ring = hashring.HashRing(names) if names else None
+        self._refreshed_at = timeutils.utcnow()
+
+
 class Lock(locking.Lock):
     """Lock with dynamic name.
 
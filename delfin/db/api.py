@@ -48,6 +48,12 @@ db_opts = [
     cfg.StrOpt('db_backend',
                default='sqlalchemy',
                help='The backend to use for database.'),
+    cfg.IntOpt('bulk_chunk_size',
+               default=1000,
+               min=1,
+               help='Maximum number of rows written by one statement of a '
+                    'bulk operation. Every chunk is committed in its own '
+                    'transaction.'),
 ]
 
 CONF = cfg.CONF
@@ -63,6 +69,36 @@ def register_db():
     IMPL.register_db()
 
 
+def storage_update_sync_status(context, storage_id, mask, status,
+                               expected=None):
+    """Atomically set the bits of mask in the sync_status of a storage.
+
+    The bits are set for SyncStatus.SYNCING and cleared for
+    SyncStatus.SYNCED. No lock is needed, the database computes the new
+    value from the current one.
+
+    :param mask: bits of sync_status to set or clear
+    :param status: a SyncStatus
+    :param expected: if given, a SyncStatus the bits of mask must all be in
+                     for sync_status to be updated
+    :returns: False if the storage does not exist, is deleted or, when
+              expected is given, has bits of mask in another status
+    """
+    return IMPL.storage_update_sync_status(context, storage_id, mask, status,
+                                           expected)
+
+
+def storages_update_sync_status(context, mask, status, expected=None):
+    """Atomically set the bits of mask in the sync_status of all storages.
+
+    See storage_update_sync_status, the storages are updated with set
+    based statements.
+
+    :returns: list of the ids of the updated storages
+    """
+    return IMPL.storages_update_sync_status(context, mask, status, expected)
+
+
 def storage_get(context, storage_id):
     """Retrieve a storage device."""
     return IMPL.storage_get(context, storage_id)
@@ -128,11 +164,30 @@ def volumes_update(context, values):
     return IMPL.volumes_update(context, values)
 
 
+def volumes_upsert(context, values):
+    """Create or update multiple volumes keyed on storage_id and original_id.
+    """
+    return IMPL.volumes_upsert(context, values)
+
+
 def volumes_delete(context, values):
     """Delete multiple volumes."""
     return IMPL.volumes_delete(context, values)
 
 
+def volumes_reconcile(context, storage_id, volumes):
+    """Make the volumes of a storage in DB match the volumes given.
+
+    The volumes are compared with the database in SQL, see
+    resource_sync_mode 'staging'. volumes can be any iterable of volumes
+    with unique original_ids.
+
+    :returns: dict with the number of added, updated, unchanged and
+              deleted volumes
+    """
+    return IMPL.volumes_reconcile(context, storage_id, volumes)
+
+
 def volume_get(context, volume_id):
     """Get a volume or raise an exception if it does not exist."""
     return IMPL.volume_get(context, volume_id)
@@ -163,11 +218,55 @@ def volume_get_all(context, marker=None, limit=None, sort_keys=None,
                                sort_dirs, filters, offset)
 
 
+def volume_get_fingerprints(context, storage_id, original_ids=None,
+                            original_pool_ids=None):
+    """Get id, original_id and fingerprint of the volumes of a device.
+
+    If original_ids is given, only the volumes with these original_ids are
+    returned. If original_pool_ids is given, only the volumes in the pools
+    with these original_ids are returned.
+    """
+    return IMPL.volume_get_fingerprints(context, storage_id, original_ids,
+                                        original_pool_ids)
+
+
+def volume_iter_fingerprints(context, storage_id):
+    """Iterate id, original_id and fingerprint of the volumes of a device.
+
+    The volumes are loaded from the database chunk by chunk, so that
+    memory does not grow with their number.
+    """
+    return IMPL.volume_iter_fingerprints(context, storage_id)
+
+
 def volume_delete_by_storage(context, storage_id):
     """Delete all the volumes of a device."""
     return IMPL.volume_delete_by_storage(context, storage_id)
 
 
+def volume_delete_hidden_generations(context, storage_id):
+    """Delete the volumes of a device loaded under a generation which was
+    never made visible, see storage_set_volume_generation.
+
+    :returns: number of deleted volumes
+    """
+    return IMPL.volume_delete_hidden_generations(context, storage_id)
+
+
+def storage_set_volume_generation(context, storage_id, generation):
+    """Make the volumes of a generation visible in one statement.
+
+    Volumes are only returned by volume_get and volume_get_all once the
+    storage volume_generation has reached their generation. The generation
+    must directly follow the current one of the storage.
+
+    :returns: True if the generation was set, False if the storage was
+              deleted or its generation changed meanwhile
+    """
+    return IMPL.storage_set_volume_generation(context, storage_id,
+                                              generation)
+
+
 def storage_pool_create(context, storage_pool):
     """Add a storage_storage_pool."""
     return IMPL.storage_pool_create(context, storage_pool)
@@ -188,11 +287,25 @@ def storage_pools_update(context, storage_pools):
     return IMPL.storage_pools_update(context, storage_pools)
 
 
+def storage_pools_upsert(context, storage_pools):
+    """Create or update multiple storage_pools keyed on storage_id and
+    original_id.
+    """
+    return IMPL.storage_pools_upsert(context, storage_pools)
+
+
 def storage_pools_delete(context, storage_pools):
     """Delete storage_pools."""
     return IMPL.storage_pools_delete(context, storage_pools)
 
 
+def storage_pools_reconcile(context, storage_id, storage_pools):
+    """Make the storage_pools of a storage in DB match the storage_pools
+    given, see volumes_reconcile.
+    """
+    return IMPL.storage_pools_reconcile(context, storage_id, storage_pools)
+
+
 def storage_pool_get(context, storage_pool_id):
     """Get a storage_pool or raise an exception if it does not exist."""
     return IMPL.storage_pool_get(context, storage_pool_id)
@@ -223,6 +336,16 @@ def storage_pool_get_all(context, marker=None, limit=None, sort_keys=None,
                                      sort_keys, sort_dirs, filters, offset)
 
 
+def storage_pool_get_fingerprints(context, storage_id, original_ids=None):
+    """Get id, original_id and fingerprint of all storage_pools of a device.
+
+    If original_ids is given, only the pools with these original_ids are
+    returned.
+    """
+    return IMPL.storage_pool_get_fingerprints(context, storage_id,
+                                              original_ids)
+
+
 def storage_pool_delete_by_storage(context, storage_id):
     """Delete all the storage_pool of a device."""
     return IMPL.storage_pool_delete_by_storage(context, storage_id)
@@ -362,3 +485,88 @@ def alert_source_get_all(context, marker=None, limit=None, sort_keys=None,
     """
     return IMPL.alert_source_get_all(context, marker, limit, sort_keys,
                                      sort_dirs, filters, offset)
+
+
+def sync_job_create(context, values):
+    """Create a sync job."""
+    return IMPL.sync_job_create(context, values)
+
+
+def sync_job_update(context, sync_job_id, values):
+    """Update a sync job."""
+    return IMPL.sync_job_update(context, sync_job_id, values)
+
+
+def sync_job_claim(context, sync_job_id, host, lease_expires_at):
+    """Take a queued sync job for a host and renew its lease.
+
+    :returns: False if the job is not queued anymore, e.g. it expired
+        before its task manager got it
+    """
+    return IMPL.sync_job_claim(context, sync_job_id, host, lease_expires_at)
+
+
+def sync_job_get(context, sync_job_id):
+    """Get a sync job."""
+    return IMPL.sync_job_get(context, sync_job_id)
+
+
+def sync_job_get_all(context, marker=None, limit=None, sort_keys=None,
+                     sort_dirs=None, filters=None, offset=None):
+    """Retrieves all sync jobs.
+
+    If no sort parameters are specified then the returned sync jobs are
+    sorted first by the 'created_at' key in descending order.
+
+    :param context: context of this request, it's helpful to trace the request
+    :param marker: the last item of the previous page, used to determine the
+                   next page of results to return
+    :param limit: maximum number of items to return
+    :param sort_keys: list of attributes by which results should be sorted,
+                      paired with corresponding item in sort_dirs
+    :param sort_dirs: list of directions in which results should be sorted,
+                      paired with corresponding item in sort_keys, for example
+                      'desc' for descending order
+    :param filters: dictionary of filters
+    :param offset: number of items to skip
+    :returns: list of sync jobs
+    """
+    return IMPL.sync_job_get_all(context, marker, limit, sort_keys,
+                                 sort_dirs, filters, offset)
+
+
+def sync_jobs_get_succeeded(context, storage_id, resource_type,
+                            started_after):
+    """Get the succeeded sync jobs of a resource started after a time.
+
+    :returns: list of sync jobs, in the order they started
+    """
+    return IMPL.sync_jobs_get_succeeded(context, storage_id, resource_type,
+                                        started_after)
+
+
+def sync_jobs_renew(context, sync_job_ids, lease_expires_at):
+    """Extend the lease of the sync jobs which are still active.
+
+    :returns: number of renewed sync jobs
+    """
+    return IMPL.sync_jobs_renew(context, sync_job_ids, lease_expires_at)
+
+
+def sync_jobs_expire(context):
+    """Mark the active sync jobs whose lease expired as expired.
+
+    A job is left active when the task manager running it dies, its lease
+    is not renewed anymore.
+
+    :returns: list of the expired sync jobs
+    """
+    return IMPL.sync_jobs_expire(context)
+
+
+def sync_jobs_purge(context, before):
+    """Delete the sync jobs which ended before a time.
+
+    :returns: number of deleted sync jobs
+    """
+    return IMPL.sync_jobs_purge(context, before)
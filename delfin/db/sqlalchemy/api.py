@@ -19,6 +19,7 @@
 
 """Implementation of SQLAlchemy backend."""
 
+import itertools
 import sys
 
 import six
@@ -28,10 +29,15 @@ from oslo_db import options as db_options
 from oslo_db.sqlalchemy import session
 from oslo_db.sqlalchemy import utils as db_utils
 from oslo_log import log
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
 
 from delfin import exception
+from delfin.common import constants
 from delfin.common import sqlalchemyutils
 from delfin.db.sqlalchemy import models
 from delfin.db.sqlalchemy.models import Storage, AccessInfo
@@ -88,6 +94,64 @@ def register_db():
     engine = create_engine(CONF.database.connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
+    _upgrade_schema(engine, Storage.metadata)
+
+
+def _upgrade_schema(engine, metadata):
+    """Bring the tables of an existing deployment up to the models.
+
+    create_all() only creates missing tables, so columns, indexes and
+    unique constraints which were added to existing models are created
+    here. Unique constraints are created as unique indexes, which every
+    supported database can add to an existing table. Duplicated rows are
+    removed first, they would be written back by the next sync anyway.
+    """
+    inspector = sqlalchemy.inspect(engine)
+    for table in metadata.sorted_tables:
+        columns = set(column['name']
+                      for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in columns:
+                LOG.info('Adding column {0}.{1}'.format(table.name,
+                                                        column.name))
+                ddl = sqlalchemy.schema.CreateColumn(column).compile(
+                    dialect=engine.dialect)
+                engine.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+                    table.name, ddl))
+
+        indexes = set(index['name']
+                      for index in inspector.get_indexes(table.name))
+        indexes.update(constraint['name'] for constraint in
+                       inspector.get_unique_constraints(table.name))
+        for index in table.indexes:
+            if index.name not in indexes:
+                LOG.info('Creating index {0}'.format(index.name))
+                index.create(engine)
+
+        for constraint in table.constraints:
+            if isinstance(constraint, sqlalchemy.UniqueConstraint) and \
+                    constraint.name not in indexes:
+                LOG.info('Creating unique index {0}'.format(constraint.name))
+                columns = [column.name for column in constraint.columns]
+                _delete_duplicates(engine, table, columns)
+                sqlalchemy.Index(constraint.name,
+                                 *[table.c[name] for name in columns],
+                                 unique=True).create(engine)
+
+
+def _delete_duplicates(engine, table, columns):
+    """Keep the row with the lowest id of each group of duplicated rows.
+
+    The rows to keep are selected from a derived table, MySQL does not
+    let a DELETE select from its own table otherwise.
+    """
+    keep = sqlalchemy.select([sqlalchemy.func.min(table.c.id).label('id')]) \
+        .group_by(*[table.c[name] for name in columns]).alias('keep')
+    deleted = engine.execute(table.delete().where(
+        ~table.c.id.in_(sqlalchemy.select([keep.c.id])))).rowcount
+    if deleted:
+        LOG.warning('Deleted {0} duplicated rows from {1}'
+                    .format(deleted, table.name))
 
 
 def _process_model_like_filter(model, query, filters):
@@ -257,6 +321,52 @@ def storage_update(context, storage_id, values):
     return result
 
 
+def _sync_status_query(context, mask, expected, session):
+    query = model_query(context, models.Storage, session=session) \
+        .filter_by(deleted=False)
+    if expected is not None:
+        query = query.filter(models.Storage.sync_status.op('&')(mask) ==
+                             (mask if expected else 0))
+    return query
+
+
+def _sync_status_value(mask, status):
+    sync_status = models.Storage.sync_status
+    if status:
+        return sync_status.op('|')(mask)
+    return sync_status.op('&')(~mask)
+
+
+def storage_update_sync_status(context, storage_id, mask, status,
+                               expected=None):
+    """Set the bits of mask in sync_status with a single UPDATE."""
+    session = get_session()
+    with session.begin():
+        query = _sync_status_query(context, mask, expected, session) \
+            .filter_by(id=storage_id)
+        result = query.update({'sync_status': _sync_status_value(mask,
+                                                                 status)},
+                              synchronize_session=False)
+    return bool(result)
+
+
+def storages_update_sync_status(context, mask, status, expected=None):
+    """Set the bits of mask in sync_status of all storages at once."""
+    session = get_session()
+    with session.begin():
+        # The rows are locked until they are updated, so that the ids
+        # returned are exactly the updated ones
+        query = _sync_status_query(context, mask, expected, session) \
+            .with_entities(models.Storage.id).with_for_update()
+        storage_ids = [storage_id for storage_id, in query]
+        for chunk in _chunks(storage_ids):
+            _sync_status_query(context, mask, expected, session) \
+                .filter(models.Storage.id.in_(chunk)) \
+                .update({'sync_status': _sync_status_value(mask, status)},
+                        synchronize_session=False)
+    return storage_ids
+
+
 def storage_get(context, storage_id):
     """Retrieve a storage device."""
     return _storage_get(context, storage_id)
@@ -316,7 +426,29 @@ def storage_delete(context, storage_id):
 
 
 def _volume_get_query(context, session=None):
-    return model_query(context, models.Volume, session=session)
+    # Volumes of a generation which is still being loaded are hidden. The
+    # storage is joined once, rather than queried for every volume.
+    return model_query(context, models.Volume, session=session) \
+        .outerjoin(models.Storage,
+                   models.Storage.id == models.Volume.storage_id) \
+        .reset_joinpoint() \
+        .filter(models.Volume.generation <=
+                sqlalchemy.func.coalesce(models.Storage.volume_generation, 0))
+
+
+def _volume_generation(storage_id):
+    """The visible volume generation of a storage, as a scalar subquery."""
+    generation = sqlalchemy.select([models.Storage.volume_generation]) \
+        .where(models.Storage.id == storage_id).as_scalar()
+    return sqlalchemy.func.coalesce(generation, 0)
+
+
+def _filter_visible(query, model, storage_id):
+    # Only volumes have generations
+    if model is not models.Volume:
+        return query
+    return query.filter(models.Volume.generation <=
+                        _volume_generation(storage_id))
 
 
 def _volume_get(context, volume_id, session=None):
@@ -349,37 +481,12 @@ def volume_create(context, values):
 
 def volumes_create(context, volumes):
     """Create multiple volumes."""
-    session = get_session()
-    vol_refs = []
-    with session.begin():
-
-        for vol in volumes:
-            LOG.debug('adding new volume for original_id {0}:'
-                      .format(vol.get('original_id')))
-            if not vol.get('id'):
-                vol['id'] = uuidutils.generate_uuid()
-
-            vol_ref = models.Volume()
-            vol_ref.update(vol)
-            vol_refs.append(vol_ref)
-
-        session.add_all(vol_refs)
-
-    return vol_refs
+    return _bulk_insert(context, models.Volume, volumes)
 
 
 def volumes_delete(context, volumes_id_list):
     """Delete multiple volumes."""
-    session = get_session()
-    with session.begin():
-        for vol_id in volumes_id_list:
-            LOG.debug('deleting volume {0}:'.format(vol_id))
-            query = _volume_get_query(context, session)
-            result = query.filter_by(id=vol_id).delete()
-
-            if not result:
-                LOG.error(exception.VolumeNotFound(vol_id))
-    return
+    _bulk_delete(context, models.Volume, volumes_id_list)
 
 
 def volume_update(context, vol_id, values):
@@ -392,16 +499,17 @@ def volume_update(context, vol_id, values):
 
 def volumes_update(context, volumes):
     """Update multiple volumes."""
-    session = get_session()
-    with session.begin():
-        for vol in volumes:
-            LOG.debug('updating volume {0}:'.format(vol.get('id')))
-            query = _volume_get_query(context, session)
-            result = query.filter_by(id=vol.get('id')
-                                     ).update(vol)
+    _bulk_update(context, models.Volume, volumes)
+
+
+def volumes_upsert(context, volumes):
+    """Create or update multiple volumes."""
+    _bulk_upsert(context, models.Volume, volumes)
 
-            if not result:
-                LOG.error(exception.VolumeNotFound(vol.get('id')))
+
+def volumes_reconcile(context, storage_id, volumes):
+    """Make the volumes of a storage match the volumes given."""
+    return _reconcile(context, models.Volume, storage_id, volumes)
 
 
 def volume_get(context, volume_id):
@@ -435,9 +543,47 @@ def _process_volume_info_filters(query, filters):
     return query
 
 
+def volume_get_fingerprints(context, storage_id, original_ids=None,
+                            original_pool_ids=None):
+    """Get id, original_id and fingerprint of the volumes of a device."""
+    return _get_fingerprints(context, models.Volume, storage_id,
+                             original_ids, original_pool_ids)
+
+
+def volume_iter_fingerprints(context, storage_id):
+    """Iterate id, original_id and fingerprint of the volumes of a device.
+    """
+    return _iter_fingerprints(context, models.Volume, storage_id)
+
+
 def volume_delete_by_storage(context, storage_id):
     """Delete all the volumes of a device"""
-    _volume_get_query(context).filter_by(storage_id=storage_id).delete()
+    model_query(context, models.Volume, session=None) \
+        .filter_by(storage_id=storage_id).delete()
+
+
+def volume_delete_hidden_generations(context, storage_id):
+    """Delete the volumes of generations which were never made visible."""
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Volume, session=session) \
+            .filter_by(storage_id=storage_id) \
+            .filter(models.Volume.generation >
+                    _volume_generation(storage_id))
+        return int(query.delete(synchronize_session=False))
+
+
+def storage_set_volume_generation(context, storage_id, generation):
+    """Make a generation of volumes visible, if it follows the current one.
+    """
+    session = get_session()
+    with session.begin():
+        query = model_query(context, models.Storage, session=session) \
+            .filter_by(id=storage_id, deleted=False) \
+            .filter(sqlalchemy.func.coalesce(
+                models.Storage.volume_generation, 0) == generation - 1)
+        return bool(query.update({'volume_generation': generation},
+                                 synchronize_session=False))
 
 
 def _storage_pool_get_query(context, session=None):
@@ -473,39 +619,13 @@ def storage_pool_create(context, values):
 
 
 def storage_pools_create(context, storage_pools):
-    """Create a storage_pool from the values dictionary."""
-    session = get_session()
-    storage_pool_refs = []
-    with session.begin():
-
-        for storage_pool in storage_pools:
-            LOG.debug('adding new storage_pool for original_id {0}:'
-                      .format(storage_pool.get('original_id')))
-            if not storage_pool.get('id'):
-                storage_pool['id'] = uuidutils.generate_uuid()
-
-            storage_pool_ref = models.StoragePool()
-            storage_pool_ref.update(storage_pool)
-            storage_pool_refs.append(storage_pool_ref)
-
-        session.add_all(storage_pool_refs)
-
-    return storage_pool_refs
+    """Create multiple storage_pools."""
+    return _bulk_insert(context, models.StoragePool, storage_pools)
 
 
 def storage_pools_delete(context, storage_pools_id_list):
-    """Delete multiple storage_pools with the storage_pools dictionary."""
-    session = get_session()
-    with session.begin():
-        for storage_pool_id in storage_pools_id_list:
-            LOG.debug('deleting storage_pool {0}:'.format(storage_pool_id))
-            query = _storage_pool_get_query(context, session)
-            result = query.filter_by(id=storage_pool_id).delete()
-
-            if not result:
-                LOG.error(exception.StoragePoolNotFound(storage_pool_id))
-
-    return
+    """Delete multiple storage_pools."""
+    _bulk_delete(context, models.StoragePool, storage_pools_id_list)
 
 
 def storage_pool_update(context, storage_pool_id, values):
@@ -524,25 +644,18 @@ def storage_pool_update(context, storage_pool_id, values):
 
 def storage_pools_update(context, storage_pools):
     """Update multiple storage_pools withe the storage_pools dictionary."""
-    session = get_session()
+    _bulk_update(context, models.StoragePool, storage_pools)
+    return storage_pools
 
-    with session.begin():
-        storage_pool_refs = []
 
-        for storage_pool in storage_pools:
-            LOG.debug('updating storage_pool {0}:'.format(
-                storage_pool.get('id')))
-            query = _storage_pool_get_query(context, session)
-            result = query.filter_by(id=storage_pool.get('id')
-                                     ).update(storage_pool)
+def storage_pools_upsert(context, storage_pools):
+    """Create or update multiple storage_pools."""
+    _bulk_upsert(context, models.StoragePool, storage_pools)
 
-            if not result:
-                LOG.error(exception.StoragePoolNotFound(storage_pool.get(
-                    'id')))
-            else:
-                storage_pool_refs.append(result)
 
-    return storage_pool_refs
+def storage_pools_reconcile(context, storage_id, storage_pools):
+    """Make the storage_pools of a storage match the storage_pools given."""
+    return _reconcile(context, models.StoragePool, storage_id, storage_pools)
 
 
 def storage_pool_get(context, storage_pool_id):
@@ -566,6 +679,13 @@ def storage_pool_get_all(context, marker=None, limit=None, sort_keys=None,
         return query.all()
 
 
+def storage_pool_get_fingerprints(context, storage_id, original_ids=None):
+    """Get id, original_id and fingerprint of all storage_pools of a device.
+    """
+    return _get_fingerprints(context, models.StoragePool, storage_id,
+                             original_ids)
+
+
 def storage_pool_delete_by_storage(context, storage_id):
     """Delete all the storage_pools of a storage device"""
     _storage_pool_get_query(context).filter_by(storage_id=storage_id).delete()
@@ -603,6 +723,356 @@ def disk_get_all(context, marker=None, limit=None, sort_keys=None,
     return NotImplemented
 
 
+def _chunks(items, chunk_size=None):
+    chunk_size = chunk_size or CONF.database.bulk_chunk_size
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _bulk_insert(context, model, resources):
+    """Insert resources with executemany INSERT statements.
+
+    Rows are written in chunks of CONF.database.bulk_chunk_size and every
+    chunk is committed in its own transaction. Primary keys are generated
+    here when they are not given, and keys which are not columns of the
+    model are ignored.
+
+    :returns: list of the inserted rows
+    """
+    table = model.__table__
+    columns = set(table.columns.keys())
+    rows = []
+    for resource in resources:
+        if not resource.get('id'):
+            resource['id'] = uuidutils.generate_uuid()
+        rows.append({key: value for key, value in resource.items()
+                     if key in columns})
+
+    for chunk in _chunks(rows):
+        # executemany needs the same keys in every row of a statement
+        groups = {}
+        for row in chunk:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        LOG.debug('inserting {0} rows into {1}'.format(len(chunk),
+                                                       table.name))
+        session = get_session()
+        with session.begin():
+            for group in groups.values():
+                session.execute(table.insert(), group)
+
+    return rows
+
+
+def _bulk_update(context, model, resources):
+    """Update resources by id with executemany UPDATE statements.
+
+    Resources with the same set of keys share one statement, which is
+    executed in chunks of CONF.database.bulk_chunk_size. Rows which could
+    not be found are reported once for the whole call.
+    """
+    table = model.__table__
+    columns = set(table.columns.keys()) - {'id'}
+    groups = {}
+    for resource in resources:
+        # Bind parameters must not be named after the updated columns
+        row = {'b_' + key: value for key, value in resource.items()
+               if key in columns}
+        row['b_id'] = resource['id']
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    updated = 0
+    for keys, rows in groups.items():
+        values = {key[2:]: sqlalchemy.bindparam(key)
+                  for key in keys if key != 'b_id'}
+        statement = table.update() \
+            .where(table.c.id == sqlalchemy.bindparam('b_id')) \
+            .values(values)
+        for chunk in _chunks(rows):
+            session = get_session()
+            with session.begin():
+                result = session.execute(statement, chunk)
+                updated += int(result.rowcount)
+
+    _report_missing(table.name, 'update', len(resources), updated)
+
+
+def _bulk_delete(context, model, id_list):
+    """Delete resources with chunked 'DELETE ... WHERE id IN' statements."""
+    id_list = list(id_list)
+    deleted = 0
+    for chunk in _chunks(id_list):
+        session = get_session()
+        with session.begin():
+            query = model_query(context, model, session=session)
+            deleted += int(query.filter(model.id.in_(chunk))
+                           .delete(synchronize_session=False))
+
+    _report_missing(model.__tablename__, 'delete', len(id_list), deleted)
+
+
+_UPSERT_KEYS = ('storage_id', 'original_id')
+
+
+def _bulk_upsert(context, model, resources):
+    """Insert resources, or update them if (storage_id, original_id) exists.
+
+    The reconciliation is done by the database with INSERT ... ON CONFLICT
+    DO UPDATE (PostgreSQL, SQLite) or INSERT ... ON DUPLICATE KEY UPDATE
+    (MySQL), one statement per chunk. Existing rows whose fingerprint did
+    not change are left untouched. Other dialects, and SQLite with a
+    SQLAlchemy which lacks its insert construct, fall back to looking up
+    the existing rows of every chunk.
+    """
+    table = model.__table__
+    columns = set(table.columns.keys())
+    groups = {}
+    for resource in resources:
+        row = {key: value for key, value in resource.items()
+               if key in columns}
+        row['id'] = uuidutils.generate_uuid()
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    dialect = get_engine().dialect.name
+    for keys, rows in groups.items():
+        statement = _upsert_statement(table, dialect, keys)
+        for chunk in _chunks(rows):
+            if statement is None:
+                _upsert_by_lookup(context, model, chunk)
+                continue
+            session = get_session()
+            with session.begin():
+                session.execute(statement, chunk)
+
+
+def _upsert_statement(table, dialect, keys):
+    update_keys = [key for key in keys
+                   if key not in ('id', 'created_at') + _UPSERT_KEYS]
+    now = timeutils.utcnow()
+
+    if dialect == 'mysql':
+        statement = mysql.insert(table)
+        # MySQL assigns from left to right, so updated_at has to be
+        # compared with the fingerprint before the fingerprint is updated
+        values = [('updated_at', sqlalchemy.func.IF(
+            table.c.fingerprint.op('<=>')(
+                sqlalchemy.literal_column('VALUES(fingerprint)')),
+            table.c.updated_at, now))]
+        values.extend((key, statement.inserted[key])
+                      for key in update_keys if key != 'fingerprint')
+        values.append(('fingerprint', statement.inserted.fingerprint))
+        return statement.on_duplicate_key_update(values)
+
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite' and hasattr(sqlite, 'insert'):
+        insert = sqlite.insert
+    else:
+        return None
+
+    statement = insert(table)
+    values = {key: statement.excluded[key] for key in update_keys}
+    values['updated_at'] = now
+    return statement.on_conflict_do_update(
+        index_elements=_UPSERT_KEYS,
+        set_=values,
+        where=table.c.fingerprint.is_distinct_from(
+            statement.excluded.fingerprint))
+
+
+def _upsert_by_lookup(context, model, rows):
+    session = get_session()
+    with session.begin():
+        existing = {}
+        for storage_id in set(row['storage_id'] for row in rows):
+            original_ids = [row['original_id'] for row in rows
+                            if row['storage_id'] == storage_id]
+            query = model_query(context, model, model.id, model.original_id,
+                                model.fingerprint, session=session) \
+                .filter_by(storage_id=storage_id) \
+                .filter(model.original_id.in_(original_ids))
+            for resource_id, original_id, fingerprint in query:
+                existing[(storage_id, original_id)] = (resource_id,
+                                                       fingerprint)
+
+    add_list = []
+    update_list = []
+    for row in rows:
+        found = existing.get((row['storage_id'], row['original_id']))
+        if found is None:
+            add_list.append(row)
+        elif row.get('fingerprint') is None or row['fingerprint'] != found[1]:
+            row['id'] = found[0]
+            update_list.append(row)
+
+    if add_list:
+        _bulk_insert(context, model, add_list)
+    if update_list:
+        _bulk_update(context, model, update_list)
+
+
+def _reconcile(context, model, storage_id, resources):
+    """Make the resources of a storage in DB match the given snapshot.
+
+    The snapshot is bulk loaded into a temporary staging table, then the
+    rows which are absent from it are deleted with an anti-join, the rows
+    whose fingerprint changed are updated from it and the new ones are
+    copied from it with INSERT ... SELECT. No row is loaded into Python.
+    Each chunk is staged in its own transaction, the differences are
+    applied in a last one. Unknown resources are staged so that their
+    rows are not deleted, but their rows are neither updated nor added.
+
+    :param resources: iterable of resources with unique original_ids, it
+                      is consumed in chunks of CONF.database.bulk_chunk_size
+    :returns: a dict with the number of added, updated, unchanged and
+              deleted resources
+    """
+    table = model.__table__
+    staging = sqlalchemy.Table(
+        table.name + '_staging', sqlalchemy.MetaData(),
+        *[sqlalchemy.Column(column.name, column.type,
+                            primary_key=column.name == 'original_id')
+          for column in table.columns],
+        sqlalchemy.Column('unknown', sqlalchemy.Boolean, nullable=False),
+        prefixes=['TEMPORARY'])
+    columns = set(table.columns.keys())
+    now = timeutils.utcnow()
+
+    # The staging table only lives on this connection. The snapshot is
+    # loaded with a short transaction per chunk, so that no transaction
+    # is left open while the driver is queried, and the tables are only
+    # locked by the final transaction which applies the differences.
+    connection = get_engine().connect()
+    try:
+        # A failed sync may leave the table behind on a pooled connection
+        staging.drop(connection, checkfirst=True)
+        staging.create(connection)
+
+        total = 0
+        keys = set()
+        resources = iter(resources)
+        while True:
+            chunk = list(itertools.islice(resources,
+                                          CONF.database.bulk_chunk_size))
+            if not chunk:
+                break
+            groups = {}
+            for resource in chunk:
+                row = {key: value for key, value in resource.items()
+                       if key in columns}
+                row.update(id=uuidutils.generate_uuid(),
+                           storage_id=storage_id, created_at=now,
+                           unknown=bool(resource.get('unknown')))
+                keys.update(row)
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            with connection.begin():
+                for group in groups.values():
+                    connection.execute(staging.insert(), group)
+            total += len(chunk)
+
+        with connection.begin():
+            deleted, updated, added = _reconcile_staged(
+                connection, table, staging, storage_id, keys, now)
+
+        staging.drop(connection)
+    finally:
+        connection.close()
+
+    LOG.debug('reconciled {0} rows of {1} for storage {2}'
+              .format(total, table.name, storage_id))
+    return {'added': added,
+            'updated': updated,
+            'unchanged': total - added - updated,
+            'deleted': deleted}
+
+
+def _reconcile_staged(connection, table, staging, storage_id, keys, now):
+    """Apply the differences between the staging table and the table.
+
+    :returns: the numbers of deleted, updated and added rows
+    """
+    matched = sqlalchemy.and_(
+        table.c.storage_id == storage_id,
+        staging.c.original_id == table.c.original_id)
+
+    deleted = connection.execute(table.delete().where(
+        table.c.storage_id == storage_id).where(
+        ~sqlalchemy.exists().where(matched))).rowcount
+
+    keys = keys - {'id', 'created_at', 'storage_id', 'original_id',
+                   'unknown'}
+    changed = sqlalchemy.and_(
+        ~staging.c.unknown,
+        staging.c.fingerprint.is_distinct_from(table.c.fingerprint))
+    if connection.dialect.name in ('mysql', 'postgresql'):
+        # UPDATE ... FROM, or UPDATE ... JOIN on MySQL
+        values = {key: staging.c[key] for key in keys}
+        statement = table.update().where(matched).where(changed)
+    else:
+        values = {key: sqlalchemy.select([staging.c[key]])
+                  .where(matched).as_scalar() for key in keys}
+        statement = table.update().where(
+            sqlalchemy.exists().where(matched).where(changed))
+    values['updated_at'] = now
+    updated = connection.execute(statement.values(values)).rowcount
+
+    keys = sorted(keys | {'id', 'created_at', 'storage_id',
+                          'original_id'})
+    select = sqlalchemy.select([staging.c[key] for key in keys]).where(
+        ~staging.c.unknown).where(~sqlalchemy.exists().where(matched))
+    added = connection.execute(table.insert().from_select(
+        keys, select)).rowcount
+    return deleted, updated, added
+
+
+def _report_missing(table_name, action, expected, found):
+    # Some DBAPIs report -1 as the rows affected by executemany
+    if 0 <= found < expected:
+        LOG.error('{0} of {1} {2} could not be found to {3}.'
+                  .format(expected - found, expected, table_name, action))
+
+
+def _get_fingerprints(context, model, storage_id, original_ids=None,
+                      original_pool_ids=None):
+    """Only load the columns needed to compare a resource with the storage.
+    """
+    query = model_query(context, model, model.id, model.original_id,
+                        model.fingerprint, session=None) \
+        .filter_by(storage_id=storage_id)
+    query = _filter_visible(query, model, storage_id)
+    if original_ids is not None:
+        query = query.filter(model.original_id.in_(original_ids))
+    if original_pool_ids is not None:
+        query = query.filter(model.original_pool_id.in_(original_pool_ids))
+    return [{'id': resource_id, 'original_id': original_id,
+             'fingerprint': fingerprint}
+            for resource_id, original_id, fingerprint in query]
+
+
+def _iter_fingerprints(context, model, storage_id):
+    """Load the fingerprints of a device chunk by chunk, in order of id.
+
+    Only a chunk is held at a time, and the resources of a chunk may be
+    deleted before the next chunk is loaded.
+    """
+    chunk_size = CONF.database.bulk_chunk_size
+    last_id = None
+    while True:
+        query = model_query(context, model, model.id, model.original_id,
+                            model.fingerprint, session=None) \
+            .filter_by(storage_id=storage_id)
+        query = _filter_visible(query, model, storage_id)
+        if last_id is not None:
+            query = query.filter(model.id > last_id)
+        rows = query.order_by(model.id).limit(chunk_size).all()
+        for resource_id, original_id, fingerprint in rows:
+            yield {'id': resource_id, 'original_id': original_id,
+                   'fingerprint': fingerprint}
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
 def is_orm_value(obj):
     """Check if object is an ORM field or expression."""
     return isinstance(obj, (sqlalchemy.orm.attributes.InstrumentedAttribute,
@@ -700,6 +1170,150 @@ def alert_source_get_all(context, marker=None, limit=None, sort_keys=None,
         return query.all()
 
 
+def _sync_job_get_query(context, session=None):
+    return model_query(context, models.SyncJob, session=session)
+
+
+def _sync_job_get(context, sync_job_id, session=None):
+    result = (_sync_job_get_query(context, session=session)
+              .filter_by(id=sync_job_id)
+              .first())
+
+    if not result:
+        raise exception.SyncJobNotFound(sync_job_id)
+
+    return result
+
+
+@apply_like_filters(model=models.SyncJob)
+def _process_sync_job_filters(query, filters):
+    """Common filter processing for sync job queries."""
+    if filters:
+        if not is_valid_model_filters(models.SyncJob, filters):
+            return
+        query = query.filter_by(**filters)
+
+    return query
+
+
+def sync_job_create(context, values):
+    """Create a sync job."""
+    if not values.get('id'):
+        values['id'] = uuidutils.generate_uuid()
+
+    sync_job_ref = models.SyncJob()
+    sync_job_ref.update(values)
+
+    session = get_session()
+    with session.begin():
+        session.add(sync_job_ref)
+
+    return _sync_job_get(context, sync_job_ref['id'], session=session)
+
+
+def sync_job_update(context, sync_job_id, values):
+    """Update a sync job."""
+    session = get_session()
+    with session.begin():
+        query = _sync_job_get_query(context, session) \
+            .filter_by(id=sync_job_id)
+        result = query.update(values, synchronize_session=False)
+        if not result:
+            raise exception.SyncJobNotFound(sync_job_id)
+        return _sync_job_get(context, sync_job_id, session)
+
+
+def sync_job_claim(context, sync_job_id, host, lease_expires_at):
+    """Take a queued sync job for a host, unless it is not queued anymore.
+    """
+    session = get_session()
+    with session.begin():
+        return bool(_sync_job_get_query(context, session)
+                    .filter_by(id=sync_job_id,
+                               status=constants.SyncJobStatus.QUEUED)
+                    .update({'host': host,
+                             'lease_expires_at': lease_expires_at},
+                            synchronize_session=False))
+
+
+def sync_job_get(context, sync_job_id):
+    """Get a sync job."""
+    return _sync_job_get(context, sync_job_id)
+
+
+def sync_job_get_all(context, marker=None, limit=None, sort_keys=None,
+                     sort_dirs=None, filters=None, offset=None):
+    session = get_session()
+    with session.begin():
+        query = _generate_paginate_query(context, session, models.SyncJob,
+                                         marker, limit, sort_keys, sort_dirs,
+                                         filters, offset)
+        if query is None:
+            return []
+        return query.all()
+
+
+def sync_jobs_get_succeeded(context, storage_id, resource_type,
+                            started_after):
+    """Get the succeeded sync jobs of a resource started after a time."""
+    session = get_session()
+    with session.begin():
+        return _sync_job_get_query(context, session) \
+            .filter_by(storage_id=storage_id, resource_type=resource_type,
+                       status=constants.SyncJobStatus.SUCCEEDED) \
+            .filter(models.SyncJob.started_at > started_after) \
+            .order_by(models.SyncJob.started_at).all()
+
+
+def sync_jobs_renew(context, sync_job_ids, lease_expires_at):
+    """Extend the lease of the sync jobs which are still active."""
+    renewed = 0
+    session = get_session()
+    with session.begin():
+        for chunk in _chunks(list(sync_job_ids)):
+            renewed += _sync_job_get_query(context, session) \
+                .filter(models.SyncJob.id.in_(chunk)) \
+                .filter(models.SyncJob.status.in_(
+                    constants.SyncJobStatus.ACTIVE)) \
+                .update({'lease_expires_at': lease_expires_at},
+                        synchronize_session=False)
+    return renewed
+
+
+def sync_jobs_expire(context):
+    """Mark the active sync jobs whose lease expired as expired."""
+    now = timeutils.utcnow()
+    session = get_session()
+    with session.begin():
+        # The rows are locked until they are updated, so that each expired
+        # job is returned to exactly one caller
+        query = _sync_job_get_query(context, session) \
+            .filter(models.SyncJob.status.in_(
+                constants.SyncJobStatus.ACTIVE)) \
+            .filter(models.SyncJob.lease_expires_at < now) \
+            .with_for_update()
+        sync_jobs = query.all()
+        for chunk in _chunks([sync_job.id for sync_job in sync_jobs]):
+            _sync_job_get_query(context, session) \
+                .filter(models.SyncJob.id.in_(chunk)) \
+                .update({'status': constants.SyncJobStatus.EXPIRED,
+                         'ended_at': now,
+                         'error': 'Lease expired'},
+                        synchronize_session=False)
+    return sync_jobs
+
+
+def sync_jobs_purge(context, before):
+    """Delete the sync jobs which ended before a time."""
+    session = get_session()
+    with session.begin():
+        return _sync_job_get_query(context, session) \
+            .filter(~models.SyncJob.status.in_(
+                constants.SyncJobStatus.ACTIVE)) \
+            .filter(models.SyncJob.ended_at < before) \
+            .delete(synchronize_session=False)
+
+
 PAGINATION_HELPERS = {
     models.AccessInfo: (_access_info_get_query, _process_access_info_filters,
                         _access_info_get),
@@ -713,6 +1327,8 @@ PAGINATION_HELPERS = {
                          _alert_source_get),
     models.Volume: (_volume_get_query, _process_volume_info_filters,
                     _volume_get),
+    models.SyncJob: (_sync_job_get_query, _process_sync_job_filters,
+                     _sync_job_get),
 }
 
 
@@ -23,7 +23,8 @@ SQLAlchemy models for Delfin  data.
 from oslo_config import cfg
 from oslo_db.sqlalchemy import models
 from oslo_db.sqlalchemy.types import JsonEncodedDict
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, Index, \
+    UniqueConstraint, DateTime, Float, Text
 from sqlalchemy.ext.declarative import declarative_base
 
 from delfin.common import constants
@@ -63,6 +64,11 @@ class Storage(BASE, DelfinBase, models.SoftDeleteMixin):
     """Represents a storage object."""
 
     __tablename__ = 'storages'
+    __table_args__ = (
+        Index('storages_deleted_serial_number_idx',
+              'deleted', 'serial_number'),
+        DelfinBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(255))
     vendor = Column(String(255))
@@ -76,11 +82,21 @@ class Storage(BASE, DelfinBase, models.SoftDeleteMixin):
     used_capacity = Column(Integer)
     free_capacity = Column(Integer)
     sync_status = Column(Integer, default=constants.SyncStatus.SYNCED)
+    volume_generation = Column(Integer, default=0, server_default='0')
+    circuit_state = Column(String(255), default=constants.CircuitState.CLOSED)
+    circuit_failures = Column(Integer, default=0)
+    circuit_retry_at = Column(DateTime)
 
 
 class Volume(BASE, DelfinBase):
     """Represents a volume object."""
     __tablename__ = 'volumes'
+    __table_args__ = (
+        UniqueConstraint('storage_id', 'original_id',
+                         name='uniq_volumes0storage_id0original_id'),
+        Index('volumes_wwn_idx', 'wwn'),
+        DelfinBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(255))
     storage_id = Column(String(36))
@@ -95,11 +111,18 @@ class Volume(BASE, DelfinBase):
     free_capacity = Column(Integer)
     compressed = Column(Boolean)
     deduplicated = Column(Boolean)
+    fingerprint = Column(String(64))
+    generation = Column(Integer, default=0, server_default='0')
 
 
 class StoragePool(BASE, DelfinBase):
     """Represents a storage_pool object."""
     __tablename__ = 'storage_pools'
+    __table_args__ = (
+        UniqueConstraint('storage_id', 'original_id',
+                         name='uniq_storage_pools0storage_id0original_id'),
+        DelfinBase.__table_args__,
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(255))
     storage_id = Column(String(36))
@@ -110,6 +133,7 @@ class StoragePool(BASE, DelfinBase):
     total_capacity = Column(Integer)
     used_capacity = Column(Integer)
     free_capacity = Column(Integer)
+    fingerprint = Column(String(64))
 
 
 class Disk(BASE, DelfinBase):
@@ -129,6 +153,10 @@ class Disk(BASE, DelfinBase):
 class AlertSource(BASE, DelfinBase):
     """Represents an alert source configuration."""
     __tablename__ = 'alert_source'
+    __table_args__ = (
+        Index('alert_source_host_idx', 'host'),
+        DelfinBase.__table_args__,
+    )
     storage_id = Column(String(36), primary_key=True)
     host = Column(String(255))
     version = Column(String(255))
@@ -140,3 +168,29 @@ class AlertSource(BASE, DelfinBase):
     privacy_protocol = Column(String(255))
     privacy_key = Column(String(255))
     engine_id = Column(String(255))
+
+
+class SyncJob(BASE, DelfinBase):
+    """Represents the sync of a type of resource of a storage."""
+    __tablename__ = 'sync_jobs'
+    __table_args__ = (
+        Index('sync_jobs_storage_id_idx', 'storage_id'),
+        Index('sync_jobs_status_lease_idx', 'status', 'lease_expires_at'),
+        Index('sync_jobs_ended_at_idx', 'ended_at'),
+        DelfinBase.__table_args__,
+    )
+    id = Column(String(36), primary_key=True)
+    storage_id = Column(String(36))
+    resource_type = Column(String(255))
+    status = Column(String(255))
+    host = Column(String(255))
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime)
+    lease_expires_at = Column(DateTime)
+    # Only the resources of some pools are synced
+    scoped = Column(Boolean, default=False)
+    duration = Column(Float)
+    driver_time = Column(Float)
+    db_time = Column(Float)
+    counts = Column(JsonEncodedDict)
+    error = Column(Text)
@@ -17,6 +17,7 @@ import six
 from oslo_log import log
 from oslo_utils import uuidutils
 
+from delfin.drivers import circuit_breaker
 from delfin.drivers import helper
 from delfin.drivers import manager
 
@@ -26,6 +27,8 @@ LOG = log.getLogger(__name__)
 class API(object):
     def __init__(self):
         self.driver_manager = manager.DriverManager()
+        # The calls to the backend of a registered storage go through it
+        self.circuit_breaker = circuit_breaker.CIRCUIT_BREAKER
 
     def discover_storage(self, context, access_info):
         """Discover a storage system with access information."""
@@ -62,6 +65,8 @@ class API(object):
                                                 storage_id, access_info)
         helper.update_storage(context, storage_id, storage_new)
         self.driver_manager.update_driver(storage_id, driver)
+        # The backend may have failed because of the old access information
+        self.circuit_breaker.remove(storage_id)
 
         LOG.info("Access information updated successfully.")
         return access_info
@@ -69,21 +74,43 @@ class API(object):
     def remove_storage(self, context, storage_id):
         """Clear driver instance from driver factory."""
         self.driver_manager.remove_driver(storage_id)
+        self.circuit_breaker.remove(storage_id)
 
     def get_storage(self, context, storage_id):
         """Get storage device information from storage system"""
-        driver = self.driver_manager.get_driver(context, storage_id=storage_id)
-        return driver.get_storage(context)
+        with self.circuit_breaker.guard(context, storage_id):
+            driver = self.driver_manager.get_driver(context,
+                                                    storage_id=storage_id)
+            return driver.get_storage(context)
 
     def list_storage_pools(self, context, storage_id):
         """List all storage pools from storage system."""
-        driver = self.driver_manager.get_driver(context, storage_id=storage_id)
-        return driver.list_storage_pools(context)
+        with self.circuit_breaker.guard(context, storage_id):
+            driver = self.driver_manager.get_driver(context,
+                                                    storage_id=storage_id)
+            return driver.list_storage_pools(context)
 
     def list_volumes(self, context, storage_id):
         """List all storage volumes from storage system."""
-        driver = self.driver_manager.get_driver(context, storage_id=storage_id)
-        return driver.list_volumes(context)
+        with self.circuit_breaker.guard(context, storage_id):
+            driver = self.driver_manager.get_driver(context,
+                                                    storage_id=storage_id)
+            return driver.list_volumes(context)
+
+    def iter_volumes(self, context, storage_id, page_size):
+        """Iterate storage volumes from storage system page by page."""
+        with self.circuit_breaker.guard(context, storage_id):
+            driver = self.driver_manager.get_driver(context,
+                                                    storage_id=storage_id)
+            for page in driver.iter_volumes(context, page_size):
+                yield page
+
+    def list_volumes_in_pools(self, context, storage_id, pool_ids):
+        """List the storage volumes in some pools from storage system."""
+        with self.circuit_breaker.guard(context, storage_id):
+            driver = self.driver_manager.get_driver(context,
+                                                    storage_id=storage_id)
+            return driver.list_volumes_in_pools(context, pool_ids)
 
     def add_trap_config(self, context, storage_id, trap_config):
         """Config the trap receiver in storage system."""
@@ -0,0 +1,176 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import datetime
+import random
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import timeutils
+
+from delfin import db
+from delfin import exception
+from delfin.common import constants
+
+LOG = log.getLogger(__name__)
+
+circuit_breaker_opts = [
+    cfg.IntOpt('backend_failure_threshold',
+               default=3,
+               min=1,
+               help='Number of consecutive failed calls to a storage backend '
+                    'after which it is not called anymore until its retry '
+                    'interval passed.'),
+    cfg.IntOpt('backend_retry_interval',
+               default=30,
+               min=1,
+               help='Seconds to wait before calling a failing storage '
+                    'backend again. The interval doubles every time the '
+                    'first call after it fails.'),
+    cfg.IntOpt('backend_retry_interval_max',
+               default=1800,
+               min=1,
+               help='Longest interval, in seconds, to wait before calling a '
+                    'failing storage backend again.'),
+    cfg.FloatOpt('backend_retry_jitter',
+                 default=0.2,
+                 min=0,
+                 max=1,
+                 help='Each retry interval is randomly lengthened or '
+                      'shortened by up to this fraction of it.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(circuit_breaker_opts)
+
+
+class _Circuit(object):
+    def __init__(self):
+        self.state = constants.CircuitState.CLOSED
+        self.failures = 0
+        self.retry_interval = 0
+        self.retry_at = None
+        self.saved = False
+
+
+class CircuitBreaker(object):
+    """Stop calling the storage backends which keep failing.
+
+    Each storage has a circuit, which is closed while its backend answers.
+    After CONF.backend_failure_threshold consecutive failures, the circuit
+    opens and calls fail immediately with StorageBackendUnavailable, instead
+    of waiting for the backend to time out, until the retry interval
+    passed. The circuit is then half open: a single call probes the
+    backend, and the circuit closes if it succeeds or opens again for twice
+    the interval if it fails.
+
+    The circuits are kept by the process calling the backends, their state
+    is saved in the storage, so that the storage API can show it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    @contextlib.contextmanager
+    def guard(self, context, storage_id):
+        """Run the block as a call to the backend of a storage."""
+        self._before_call(storage_id)
+        try:
+            yield
+        except exception.NotFound:
+            # Not a failure of the backend
+            self._after_call(context, storage_id, None)
+            raise
+        except Exception:
+            self._after_call(context, storage_id, False)
+            raise
+        except BaseException:
+            # Such as a generator closed by its consumer
+            self._after_call(context, storage_id, None)
+            raise
+        else:
+            self._after_call(context, storage_id, True)
+
+    def remove(self, storage_id):
+        with self._lock:
+            self._circuits.pop(storage_id, None)
+
+    def _before_call(self, storage_id):
+        with self._lock:
+            circuit = self._circuits.setdefault(storage_id, _Circuit())
+            if circuit.state == constants.CircuitState.CLOSED:
+                return
+            if circuit.state == constants.CircuitState.OPEN and \
+                    timeutils.utcnow() >= circuit.retry_at:
+                LOG.info('Probe the backend of storage {0}'
+                         .format(storage_id))
+                circuit.state = constants.CircuitState.HALF_OPEN
+                return
+            # Open, or half open with a probe running
+            raise exception.StorageBackendUnavailable(storage_id,
+                                                      circuit.retry_at)
+
+    def _after_call(self, context, storage_id, succeeded):
+        with self._lock:
+            circuit = self._circuits.setdefault(storage_id, _Circuit())
+            if succeeded is None:
+                if circuit.state == constants.CircuitState.HALF_OPEN:
+                    # Let the next call probe
+                    circuit.state = constants.CircuitState.OPEN
+                return
+            if succeeded:
+                if circuit.saved and circuit.failures == 0:
+                    return
+                if circuit.state != constants.CircuitState.CLOSED:
+                    LOG.info('Backend of storage {0} is available again'
+                             .format(storage_id))
+                circuit.state = constants.CircuitState.CLOSED
+                circuit.failures = 0
+                circuit.retry_interval = 0
+                circuit.retry_at = None
+            else:
+                circuit.failures += 1
+                if circuit.state == constants.CircuitState.HALF_OPEN or \
+                        circuit.failures >= CONF.backend_failure_threshold:
+                    self._open(storage_id, circuit)
+            values = {'circuit_state': circuit.state,
+                      'circuit_failures': circuit.failures,
+                      'circuit_retry_at': circuit.retry_at}
+            circuit.saved = True
+        try:
+            db.storage_update(context, storage_id, values)
+        except Exception as e:
+            LOG.warning('Failed to save the circuit of storage {0}: {1}'
+                        .format(storage_id, e))
+
+    @staticmethod
+    def _open(storage_id, circuit):
+        circuit.retry_interval = min(
+            max(circuit.retry_interval * 2, CONF.backend_retry_interval),
+            CONF.backend_retry_interval_max)
+        jitter = CONF.backend_retry_jitter
+        interval = circuit.retry_interval * (
+            1 + random.uniform(-jitter, jitter))
+        circuit.state = constants.CircuitState.OPEN
+        circuit.retry_at = timeutils.utcnow() + datetime.timedelta(
+            seconds=interval)
+        LOG.warning('Backend of storage {0} failed {1} times, retry it in '
+                    '{2:.0f} seconds'.format(storage_id, circuit.failures,
+                                             interval))
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
@@ -12,18 +12,71 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import PyU4V
+import threading
+from concurrent import futures
 
+import PyU4V
+from oslo_config import cfg
 from oslo_log import log
 from oslo_utils import units
 
 from delfin import exception
 from delfin.common import constants
+from delfin.drivers import request_limiter
 
 LOG = log.getLogger(__name__)
 
+vmax_opts = [
+    cfg.IntOpt('volume_detail_workers',
+               default=16,
+               min=1,
+               help='Number of workers getting the details of VMAX volumes '
+                    'at the same time. The requests they send are also '
+                    'limited per array, see backend_concurrency_max.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(vmax_opts, 'vmax_driver')
+
 SUPPORTED_VERSION = '90'
 
+# Attributes of a volume needed to report it
+VOLUME_DETAILS = ('volumeId', 'cap_mb', 'allocated_percent', 'status',
+                  'type', 'wwn', 'num_of_storage_groups')
+
+
+class LookupCache(object):
+    """Get each object at most once, with counters of hits and misses.
+
+    Workers which look up an object being got wait for it instead of
+    getting it again. A failure is cached too, so that a storage group
+    which cannot be got fails all its volumes with one request.
+    """
+
+    def __init__(self, get):
+        self._get = get
+        self._lock = threading.Lock()
+        self._futures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._futures[key] = futures.Future()
+                self.misses += 1
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if owner:
+            try:
+                future.set_result(self._get(key))
+            except Exception as err:
+                future.set_exception(err)
+        return future.result()
+
 
 class VMAXClient(object):
     """ Client class for communicating with VMAX storage """
@@ -55,6 +108,10 @@ class VMAXClient(object):
                 array_id=self.array_id,
                 username=access_info['username'],
                 password=access_info['password'])
+            # Shared by all the clients of the storage
+            request_limiter.limit_session(self.conn.rest_client.session,
+                                          access_info['host'],
+                                          access_info['port'])
 
         except Exception as err:
             msg = "Failed to connect to VMAX: {}".format(err)
@@ -118,63 +175,148 @@ class VMAXClient(object):
             raise exception.StorageBackendException(msg)
 
     def list_volumes(self, storage_id):
-
+        volume_list = []
+        for volumes in self.iter_volumes(storage_id):
+            volume_list.extend(volumes)
+        return volume_list
+
+    def iter_volumes(self, storage_id, page_size=None):
+        """Iterate the volumes page by page, as Unisphere pages them.
+
+        The list query of Unisphere answers with the first page of results
+        and an iterator to get the others. Results are normalized as they
+        come, and the details of a volume are only got when its result
+        lacks some of them. They are got concurrently. The volumes whose
+        details cannot be got are yielded last, as unknown volumes, so
+        that the sync does not take them as deleted. A volume which is not
+        found anymore is deleted.
+        """
         try:
             # List all volumes except data volumes
-            volumes = self.conn.provisioning.get_volume_list(
-                filters={'data_volume': 'false'})
-
-            # TODO: Update constants.VolumeStatus to make mapping more precise
-            switcher = {
-                'Ready': constants.VolumeStatus.AVAILABLE,
-                'Not Ready': constants.VolumeStatus.ERROR,
-                'Mixed': constants.VolumeStatus.ERROR,
-                'Write Disabled': constants.VolumeStatus.ERROR,
-                'N/A': constants.VolumeStatus.ERROR,
-            }
-
-            volume_list = []
-            for volume in volumes:
-                # Get volume details
-                vol = self.conn.provisioning.get_volume(volume)
-
-                total_cap = vol['cap_mb'] * units.Mi
-                used_cap = (total_cap * vol['allocated_percent']) / 100.0
-                free_cap = total_cap - used_cap
-
-                status = switcher.get(vol['status'],
-                                      constants.VolumeStatus.ERROR)
-
-                description = "Dell EMC VMAX volume"
-                if vol['type'] == 'TDEV':
-                    description = "Dell EMC VMAX 'thin device' volume"
-
-                v = {
-                    "name": volume,
-                    "storage_id": storage_id,
-                    "description": description,
-                    "status": status,
-                    "original_id": vol['volumeId'],
-                    "wwn": vol['wwn'],
-                    "provisioning_policy": constants.ProvisioningPolicy.THIN,
-                    "total_capacity": int(total_cap),
-                    "used_capacity": int(used_cap),
-                    "free_capacity": int(free_cap),
-                }
-
-                if vol['num_of_storage_groups'] == 1:
-                    sg = vol['storageGroupId'][0]
-                    sg_info = self.conn.provisioning.get_storage_group(sg)
-                    v['original_pool_id'] = sg_info['srp']
-                    v['compressed'] = sg_info['compression']
-
-                # TODO: Workaround when SG is, not available/not unique
-
-                volume_list.append(v)
-
-            return volume_list
-
+            response = self.conn.provisioning.get_resource(
+                self.array_id, 'sloprovisioning', 'volume',
+                params={'data_volume': 'false'})
         except Exception as err:
             msg = "Failed to get list volumes from VMAX: {}".format(err)
             LOG.error(msg)
             raise exception.StorageBackendException(msg)
+
+        listed = 0
+        failures = {}
+        # Many volumes share a few storage groups
+        storage_groups = LookupCache(self.conn.provisioning.get_storage_group)
+        with futures.ThreadPoolExecutor(
+                CONF.vmax_driver.volume_detail_workers) as executor:
+            for results in self._iter_volume_pages(response, page_size):
+                volumes = executor.map(self._try_get_volume,
+                                       [storage_id] * len(results), results,
+                                       [storage_groups] * len(results))
+                volume_list = []
+                for result, (v, err) in zip(results, volumes):
+                    if err is not None:
+                        failures[result['volumeId']] = err
+                    elif v is not None:
+                        volume_list.append(v)
+                if volume_list:
+                    listed += len(volume_list)
+                    yield volume_list
+        LOG.debug("Storage groups of VMAX volumes: {0} hits, {1} misses"
+                  .format(storage_groups.hits, storage_groups.misses))
+
+        if failures:
+            msg = "Failed to get details of {0} of {1} volumes from " \
+                  "VMAX: {2}".format(len(failures), len(failures) + listed,
+                                     failures)
+            if not listed:
+                LOG.error(msg)
+                raise exception.StorageBackendException(msg)
+            LOG.warning(msg)
+            yield [{'storage_id': storage_id, 'original_id': volume_id,
+                    'unknown': True} for volume_id in failures]
+
+    def _iter_volume_pages(self, response, page_size):
+        count = int(response.get('count') or 0) if response else 0
+        if not count:
+            return
+        max_page_size = int(response['maxPageSize'])
+        if count <= max_page_size and not page_size:
+            yield response['resultList']['result']
+            return
+
+        page_size = min(page_size or max_page_size, max_page_size)
+        results = response['resultList']['result']
+        for start in range(0, len(results), page_size):
+            yield results[start:start + page_size]
+        for start in range(len(results), count, page_size):
+            end = min(start + page_size, count)
+            try:
+                # Pages of the iterator are numbered from 1
+                yield self.conn.common.get_iterator_page_list(
+                    response['id'], start + 1, end)
+            except Exception as err:
+                msg = "Failed to get list volumes from VMAX: {}".format(err)
+                LOG.error(msg)
+                raise exception.StorageBackendException(msg)
+
+    def _try_get_volume(self, storage_id, result, storage_groups):
+        try:
+            return self._get_volume(storage_id, result, storage_groups), None
+        except Exception as err:
+            return None, err
+
+    def _get_volume(self, storage_id, result, storage_groups):
+        # TODO: Update constants.VolumeStatus to make mapping more precise
+        switcher = {
+            'Ready': constants.VolumeStatus.AVAILABLE,
+            'Not Ready': constants.VolumeStatus.ERROR,
+            'Mixed': constants.VolumeStatus.ERROR,
+            'Write Disabled': constants.VolumeStatus.ERROR,
+            'N/A': constants.VolumeStatus.ERROR,
+        }
+
+        # Get volume details, unless the listing already has them
+        volume = result['volumeId']
+        vol = result
+        if any(key not in vol for key in VOLUME_DETAILS) or \
+                (vol['num_of_storage_groups'] == 1 and
+                 'storageGroupId' not in vol):
+            try:
+                vol = self.conn.provisioning.get_volume(volume)
+            except PyU4V.utils.exception.ResourceNotFoundException:
+                LOG.info("VMAX volume {0} was deleted since it was listed"
+                         .format(volume))
+                return None
+
+        total_cap = vol['cap_mb'] * units.Mi
+        used_cap = (total_cap * vol['allocated_percent']) / 100.0
+        free_cap = total_cap - used_cap
+
+        status = switcher.get(vol['status'],
+                              constants.VolumeStatus.ERROR)
+
+        description = "Dell EMC VMAX volume"
+        if vol['type'] == 'TDEV':
+            description = "Dell EMC VMAX 'thin device' volume"
+
+        v = {
+            "name": volume,
+            "storage_id": storage_id,
+            "description": description,
+            "status": status,
+            "original_id": vol['volumeId'],
+            "wwn": vol['wwn'],
+            "provisioning_policy": constants.ProvisioningPolicy.THIN,
+            "total_capacity": int(total_cap),
+            "used_capacity": int(used_cap),
+            "free_capacity": int(free_cap),
+        }
+
+        if vol['num_of_storage_groups'] == 1:
+            sg = vol['storageGroupId'][0]
+            sg_info = storage_groups.get(sg)
+            v['original_pool_id'] = sg_info['srp']
+            v['compressed'] = sg_info['compression']
+
+        # TODO: Workaround when SG is, not available/not unique
+
+        return v
@@ -40,9 +40,39 @@ class StorageDriver(object):
 
     @abc.abstractmethod
     def list_volumes(self, context):
-        """List all storage volumes from storage system."""
+        """List all storage volumes from storage system.
+
+        A volume which is known to exist but whose details could not be
+        got may be listed as a dict with only its 'original_id' and
+        'unknown' set to True. The sync leaves it as it is in database,
+        where a volume missing from the list is deleted.
+        """
         pass
 
+    def iter_volumes(self, context, page_size):
+        """Iterate storage volumes page by page.
+
+        Each page is a list of at most page_size volumes. Drivers which can
+        query the storage system page by page should override it, so that
+        the whole volume list never needs to be kept in memory.
+        """
+        volumes = self.list_volumes(context)
+        for start in range(0, len(volumes), page_size):
+            yield volumes[start:start + page_size]
+
+    def list_volumes_in_pools(self, context, pool_ids):
+        """List the storage volumes in some storage pools.
+
+        pool_ids are the original ids of the pools. Drivers which can query
+        the volumes of a pool from the storage system should override it,
+        so that syncing a few pools does not list all volumes.
+        """
+        pool_ids = set(pool_ids)
+        # The pool of an unknown volume is not known either
+        return [volume for volume in self.list_volumes(context)
+                if volume.get('unknown') or
+                volume.get('original_pool_id') in pool_ids]
+
     @abc.abstractmethod
     def add_trap_config(self, context, trap_config):
         """Config the trap receiver in storage system."""
@@ -152,6 +152,14 @@ class FakeStorageDriver(driver.StorageDriver):
             volume_list = volume_list + vs
         return volume_list
 
+    def iter_volumes(self, ctx, page_size):
+        rd_volumes_count = random.randint(MIN_VOLUME, MAX_VOLUME)
+        LOG.info("###########fake_volumes number for %s: %d" % (
+            self.storage_id, rd_volumes_count))
+        for start in range(0, rd_volumes_count, page_size):
+            end = min(start + page_size, rd_volumes_count)
+            yield self._get_volume_range(start, end)
+
     def add_trap_config(self, context, trap_config):
         pass
 
@@ -42,6 +42,10 @@ FILE_SYSTEM_POOL_TYPE = '2'
 
 SECTORS_SIZE = 512
 QUERY_PAGE_SIZE = 150
+# Pages of volumes got at the same time
+QUERY_PAGE_WINDOW = 4
+# Seconds the pools listed by a sync are used to map the volumes to pools
+POOLS_MAX_AGE = 300
 
 THICK_LUNTYPE = '0'
 THIN_LUNTYPE = '1'
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
+
 from oslo_log import log
 from delfin.common import constants
 from delfin.drivers.huawei.oceanstor import rest_client, consts
@@ -21,6 +24,29 @@ from delfin import exception
 LOG = log.getLogger(__name__)
 
 
+class PoolIndex(object):
+    """Ids of the pools by name, volumes only know the name of their pool.
+
+    The pools may have been listed before a pool was created, so they are
+    listed again, once, when a name is missing.
+    """
+
+    def __init__(self, get_pools):
+        self._get_pools = get_pools
+        self._index = self._build(get_pools())
+        self._refreshed = False
+
+    @staticmethod
+    def _build(pools):
+        return dict((pool['NAME'], pool['ID']) for pool in pools)
+
+    def get(self, name):
+        if name not in self._index and not self._refreshed:
+            self._refreshed = True
+            self._index = self._build(self._get_pools(max_age=0))
+        return self._index.get(name, '')
+
+
 class OceanStorDriver(driver.StorageDriver):
     """OceanStorDriver implement Huawei OceanStor driver,
     """
@@ -30,6 +56,25 @@ class OceanStorDriver(driver.StorageDriver):
         self.client = rest_client.RestClient(**kwargs)
         self.client.login()
         self.sector_size = consts.SECTORS_SIZE
+        self._pools = None
+        self._pools_at = None
+        self._pools_lock = threading.Lock()
+
+    def _get_pools(self, max_age=consts.POOLS_MAX_AGE):
+        """Get the pools, listed at most max_age seconds ago.
+
+        The pools listed by list_storage_pools are shared with the volume
+        listings of the same sync, which only need their names and ids.
+        """
+        with self._pools_lock:
+            if self._pools is None or \
+                    time.monotonic() - self._pools_at >= max_age:
+                self._pools = self.client.get_all_pools()
+                self._pools_at = time.monotonic()
+            return self._pools
+
+    def _get_pool_index(self):
+        return PoolIndex(self._get_pools)
 
     def get_storage(self, context):
 
@@ -70,7 +115,7 @@ class OceanStorDriver(driver.StorageDriver):
     def list_storage_pools(self, context):
         try:
             # Get list of OceanStor pool details
-            pools = self.client.get_all_pools()
+            pools = self._get_pools(max_age=0)
 
             pool_list = []
             for pool in pools:
@@ -112,57 +157,85 @@ class OceanStorDriver(driver.StorageDriver):
             raise exception.StorageBackendException(
                 reason='Failed to get pool metrics from OceanStor')
 
+    def _get_volume(self, volume, orig_pool_id):
+        compressed = False
+        if volume['ENABLECOMPRESSION'] != 'false':
+            compressed = True
+
+        deduplicated = False
+        if volume['ENABLEDEDUP'] != 'false':
+            deduplicated = True
+
+        status = constants.VolumeStatus.ERROR
+        if volume['RUNNINGSTATUS'] == consts.STATUS_VOLUME_READY:
+            status = constants.VolumeStatus.AVAILABLE
+
+        prov_policy = constants.ProvisioningPolicy.THICK
+        if volume['ALLOCTYPE'] == consts.THIN_LUNTYPE:
+            prov_policy = constants.ProvisioningPolicy.THIN
+
+        sector_size = int(volume['SECTORSIZE'])
+        total_cap = int(volume['CAPACITY']) * sector_size
+        used_cap = int(volume['ALLOCCAPACITY']) * sector_size
+
+        v = {
+            'name': volume['NAME'],
+            'storage_id': self.storage_id,
+            'description': 'Huawei OceanStor volume',
+            'status': status,
+            'original_id': volume['ID'],
+            'original_pool_id': orig_pool_id,
+            'wwn': volume['WWN'],
+            'provisioning_policy': prov_policy,
+            'total_capacity': total_cap,
+            'used_capacity': used_cap,
+            'free_capacity': None,
+            'compressed': compressed,
+            'deduplicated': deduplicated,
+        }
+        return v
+
     def list_volumes(self, context):
         try:
             # Get all volumes in OceanStor
             volumes = self.client.get_all_volumes()
-            pools = self.client.get_all_pools()
+            pool_index = self._get_pool_index()
 
             volume_list = []
             for volume in volumes:
-                # Get pool id of volume
-                orig_pool_id = ''
-                for pool in pools:
-                    if volume['PARENTNAME'] == pool['NAME']:
-                        orig_pool_id = pool['ID']
-
-                compressed = False
-                if volume['ENABLECOMPRESSION'] != 'false':
-                    compressed = True
-
-                deduplicated = False
-                if volume['ENABLEDEDUP'] != 'false':
-                    deduplicated = True
-
-                status = constants.VolumeStatus.ERROR
-                if volume['RUNNINGSTATUS'] == consts.STATUS_VOLUME_READY:
-                    status = constants.VolumeStatus.AVAILABLE
-
-                prov_policy = constants.ProvisioningPolicy.THICK
-                if volume['ALLOCTYPE'] == consts.THIN_LUNTYPE:
-                    prov_policy = constants.ProvisioningPolicy.THIN
-
-                sector_size = int(volume['SECTORSIZE'])
-                total_cap = int(volume['CAPACITY']) * sector_size
-                used_cap = int(volume['ALLOCCAPACITY']) * sector_size
-
-                v = {
-                    'name': volume['NAME'],
-                    'storage_id': self.storage_id,
-                    'description': 'Huawei OceanStor volume',
-                    'status': status,
-                    'original_id': volume['ID'],
-                    'original_pool_id': orig_pool_id,
-                    'wwn': volume['WWN'],
-                    'provisioning_policy': prov_policy,
-                    'total_capacity': total_cap,
-                    'used_capacity': used_cap,
-                    'free_capacity': None,
-                    'compressed': compressed,
-                    'deduplicated': deduplicated,
-                }
+                volume_list.append(self._get_volume(
+                    volume, pool_index.get(volume['PARENTNAME'])))
+
+            return volume_list
+
+        except Exception as err:
+            LOG.error(
+                "Failed to get list volumes from OceanStor: {}".format(err))
+            raise exception.StorageBackendException(
+                reason='Failed to get list volumes from OceanStor')
 
-                volume_list.append(v)
+    def iter_volumes(self, context, page_size):
+        try:
+            pool_index = self._get_pool_index()
+            page_size = min(page_size, consts.QUERY_PAGE_SIZE)
+            for volumes in self.client.iter_volumes(page_size):
+                yield [self._get_volume(volume,
+                                        pool_index.get(volume['PARENTNAME']))
+                       for volume in volumes]
+
+        except Exception as err:
+            LOG.error(
+                "Failed to get list volumes from OceanStor: {}".format(err))
+            raise exception.StorageBackendException(
+                reason='Failed to get list volumes from OceanStor')
+
+    def list_volumes_in_pools(self, context, pool_ids):
+        try:
+            volume_list = []
+            for pool_id in pool_ids:
+                # The volumes are queried by pool, no need to look it up
+                for volume in self.client.get_volumes_in_pool(pool_id):
+                    volume_list.append(self._get_volume(volume, pool_id))
 
             return volume_list
 
@@ -14,7 +14,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import json
+import threading
+from concurrent import futures
 
 from oslo_log import log as logging
 import requests
@@ -22,6 +25,7 @@ import six
 
 from delfin import exception
 from delfin.i18n import _
+from delfin.drivers import request_limiter
 from delfin.drivers.huawei.oceanstor import consts
 
 LOG = logging.getLogger(__name__)
@@ -34,6 +38,8 @@ class RestClient(object):
 
         host = kwargs.get('host', 'localhost')
         port = kwargs.get('port', '8088')
+        self.host = host
+        self.port = port
         # Lists of addresses to try, for authorization
         self.san_address = [
             'https://' + host + ':' + port + '/deviceManager/rest/']
@@ -42,32 +48,43 @@ class RestClient(object):
         self.session = None
         self.url = None
         self.device_id = None
+        # Pages may be got concurrently, only one of their requests logs
+        # in again when the session is lost
+        self._login_lock = threading.Lock()
+        self._logins = 0
 
     def init_http_head(self):
-        self.url = None
-        self.session = requests.Session()
-        self.session.headers.update({
+        session = requests.Session()
+        # Shared by all the clients of the storage
+        request_limiter.limit_session(session, self.host, self.port)
+        session.headers.update({
             "Connection": "keep-alive",
             "Content-Type": "application/json"})
-        self.session.verify = False
-        self.session.trust_env = False
+        session.verify = False
+        session.trust_env = False
+        return session
 
     def do_call(self, url, data, method,
-                calltimeout=consts.SOCKET_TIMEOUT, log_filter_flag=False):
+                calltimeout=consts.SOCKET_TIMEOUT, log_filter_flag=False,
+                session=None):
         """Send requests to Huawei storage server.
 
         Send HTTPS call, get response in JSON.
         Convert response into Python Object and return it.
+        The request is sent on session with an absolute url if given, else
+        on the session logged in.
         """
-        if self.url:
-            url = self.url + url
+        if session is None:
+            session = self.session
+            if self.url:
+                url = self.url + url
 
         kwargs = {'timeout': calltimeout}
         if data:
             kwargs['data'] = json.dumps(data)
 
         if method in ('POST', 'PUT', 'GET', 'DELETE'):
-            func = getattr(self.session, method.lower())
+            func = getattr(session, method.lower())
         else:
             msg = _("Request method %s is invalid.") % method
             LOG.error(msg)
@@ -101,17 +118,21 @@ class RestClient(object):
         return res_json
 
     def login(self):
-        """Login Huawei storage array."""
+        """Login Huawei storage array.
+
+        The new session is only used once logged in, requests in flight
+        keep the session they were sent on.
+        """
         device_id = None
         for item_url in self.san_address:
             url = item_url + "xx/sessions"
             data = {"username": self.san_user,
                     "password": self.san_password,
                     "scope": "0"}
-            self.init_http_head()
+            session = self.init_http_head()
             result = self.do_call(url, data, 'POST',
                                   calltimeout=consts.LOGIN_SOCKET_TIMEOUT,
-                                  log_filter_flag=True)
+                                  log_filter_flag=True, session=session)
 
             if (result['error']['code'] != 0) or ("data" not in result):
                 LOG.error("Login error. URL: %(url)s\n"
@@ -121,9 +142,11 @@ class RestClient(object):
 
             LOG.debug('Login success: %(url)s', {'url': item_url})
             device_id = result['data']['deviceid']
+            session.headers['iBaseToken'] = result['data']['iBaseToken']
+            self.session = session
             self.device_id = device_id
             self.url = item_url + device_id
-            self.session.headers['iBaseToken'] = result['data']['iBaseToken']
+            self._logins += 1
             if (result['data']['accountstate']
                     in (consts.PWD_EXPIRED, consts.PWD_RESET)):
                 self.logout()
@@ -147,13 +170,19 @@ class RestClient(object):
         """
         device_id = None
         old_url = self.url
+        logins = self._logins
         result = self.do_call(url, data, method,
                               log_filter_flag=log_filter_flag)
         error_code = result['error']['code']
         if (error_code == consts.ERROR_CONNECT_TO_SERVER
                 or error_code == consts.ERROR_UNAUTHORIZED_TO_SERVER):
-            LOG.error("Can't open the recent url, relogin.")
-            device_id = self.login()
+            with self._login_lock:
+                if logins == self._logins:
+                    LOG.error("Can't open the recent url, relogin.")
+                    device_id = self.login()
+                else:
+                    # Another request logged in since this one was sent
+                    device_id = self.device_id
 
         if device_id is not None:
             LOG.debug('Replace URL: \n'
@@ -169,26 +198,86 @@ class RestClient(object):
 
     def paginated_call(self, url, data=None, method=None,
                        log_filter_flag=False,
-                       page_size=consts.QUERY_PAGE_SIZE):
+                       page_size=consts.QUERY_PAGE_SIZE, window=1):
         result_list = []
-        start, end = 0, page_size
-        msg = _('Query resource volume error')
+        for page in self.paginated_iter(url, data, method, log_filter_flag,
+                                        page_size, window):
+            result_list.extend(page)
+
+        return result_list
+
+    def paginated_iter(self, url, data=None, method=None,
+                       log_filter_flag=False,
+                       page_size=consts.QUERY_PAGE_SIZE, window=1):
+        """Yield the resources page by page instead of as a whole list.
+
+        With a window above 1, the resources are counted first, then up to
+        window pages are got at the same time. Pages are still yielded in
+        order. Pages after the counted ones are got one after another, in
+        case resources were added meanwhile.
+        """
+        start = 0
+        if window > 1:
+            count = self.get_count(url)
+            page = None
+            for page in self._iter_pages_in_window(url, data, method,
+                                                   log_filter_flag,
+                                                   page_size, window, count):
+                start += page_size
+                if page:
+                    yield page
+            if page is None or len(page) < page_size:
+                return
+
+        end = start + page_size
         while True:
-            url_p = '{0}?range=[{1}-{2}]'.format(url, start, end)
+            result = self._get_page(url, data, method, log_filter_flag,
+                                    start, end)
             start, end = end, end + page_size
-            result = self.call(url_p, data, method, log_filter_flag)
-            self._assert_rest_result(result, msg)
 
             # Empty data if this is first page, OR last page got all data
             if 'data' not in result:
                 break
 
-            result_list.extend(result['data'])
+            yield result['data']
             # Check if this is last page
             if len(result['data']) < page_size:
                 break
 
-        return result_list
+    def _iter_pages_in_window(self, url, data, method, log_filter_flag,
+                              page_size, window, count):
+        # Requests of the workers share the keep-alive session
+        with futures.ThreadPoolExecutor(window) as executor:
+            pending = collections.deque()
+            for start in range(0, count, page_size):
+                pending.append(executor.submit(
+                    self._get_page, url, data, method, log_filter_flag,
+                    start, start + page_size))
+                if len(pending) >= window:
+                    yield pending.popleft().result().get('data', [])
+            while pending:
+                yield pending.popleft().result().get('data', [])
+
+    def _get_page(self, url, data, method, log_filter_flag, start, end):
+        url_p = '{0}{1}range=[{2}-{3}]'.format(
+            url, '&' if '?' in url else '?', start, end)
+        result = self.call(url_p, data, method, log_filter_flag)
+        self._assert_rest_result(result, _('Query resource volume error'))
+        return result
+
+    def get_count(self, url):
+        """Count the resources listed by url, with its filter if any."""
+        path, _sep, query = url.partition('?')
+        url_c = path.rstrip('/') + '/count'
+        if query:
+            url_c += '?' + query
+        result = self.call(url_c, method='GET', log_filter_flag=True)
+
+        msg = _('Count resource error.')
+        self._assert_rest_result(result, msg)
+        self._assert_data_in_result(result, msg)
+
+        return int(result['data']['COUNT'])
 
     def logout(self):
         """Logout the session."""
@@ -232,7 +321,19 @@ class RestClient(object):
 
     def get_all_volumes(self):
         url = "/lun"
-        return self.paginated_call(url, None, "GET", log_filter_flag=True)
+        return self.paginated_call(url, None, "GET", log_filter_flag=True,
+                                   window=consts.QUERY_PAGE_WINDOW)
+
+    def iter_volumes(self, page_size=consts.QUERY_PAGE_SIZE):
+        url = "/lun"
+        return self.paginated_iter(url, None, "GET", log_filter_flag=True,
+                                   page_size=page_size,
+                                   window=consts.QUERY_PAGE_WINDOW)
+
+    def get_volumes_in_pool(self, pool_id):
+        url = "/lun?filter=PARENTID::{0}".format(pool_id)
+        return self.paginated_call(url, None, "GET", log_filter_flag=True,
+                                   window=consts.QUERY_PAGE_WINDOW)
 
     def get_all_pools(self):
         url = "/storagepool"
@@ -0,0 +1,178 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+from requests import adapters
+
+LOG = log.getLogger(__name__)
+
+request_limiter_opts = [
+    cfg.IntOpt('backend_concurrency_initial',
+               default=4,
+               min=1,
+               help='Number of requests sent at the same time to the '
+                    'management interface of a storage before its latency '
+                    'and errors are known.'),
+    cfg.IntOpt('backend_concurrency_min',
+               default=1,
+               min=1,
+               help='Lowest number of requests sent at the same time to a '
+                    'storage.'),
+    cfg.IntOpt('backend_concurrency_max',
+               default=16,
+               min=1,
+               help='Highest number of requests sent at the same time to a '
+                    'storage.'),
+    cfg.FloatOpt('backend_latency_threshold',
+                 default=5.0,
+                 min=0,
+                 help='Seconds after which the answer to a request shows '
+                      'that the storage is overloaded, like an error.'),
+    cfg.FloatOpt('backend_concurrency_decrease',
+                 default=0.5,
+                 min=0.1,
+                 max=0.9,
+                 help='Factor the number of requests sent at the same time '
+                      'to a storage is multiplied by when it is '
+                      'overloaded.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(request_limiter_opts)
+
+# Weight of the latest request in the averages of latency and errors
+_STATS_WEIGHT = 0.1
+
+
+class _Request(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ok = True
+
+    def failed(self):
+        self.ok = False
+
+
+class AIMDLimiter(object):
+    """Limit the requests in flight to a storage with AIMD.
+
+    The limit grows by one request every time a limit of requests
+    succeeded in time (additive increase), and is multiplied by
+    CONF.backend_concurrency_decrease when a request fails or is slower
+    than CONF.backend_latency_threshold (multiplicative decrease). It
+    decreases at most once for the requests which were in flight together,
+    so that a burst of failures only counts once.
+
+    The average latency and error rate of the requests are kept for
+    monitoring.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.limit = float(CONF.backend_concurrency_initial)
+        self.in_flight = 0
+        self.latency = None
+        self.error_rate = 0.0
+        self._decreased_at = None
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def request(self):
+        """Run the block as a request, once the limit allows it."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.in_flight < max(int(self.limit), 1))
+            self.in_flight += 1
+        request = _Request()
+        try:
+            yield request
+        except Exception:
+            request.failed()
+            raise
+        finally:
+            self._done(request)
+
+    def _done(self, request):
+        now = time.monotonic()
+        latency = now - request.started
+        congested = not request.ok or \
+            latency > CONF.backend_latency_threshold
+        with self._condition:
+            self.in_flight -= 1
+            self.latency = latency if self.latency is None else \
+                _STATS_WEIGHT * latency + (1 - _STATS_WEIGHT) * self.latency
+            self.error_rate = _STATS_WEIGHT * (not request.ok) + \
+                (1 - _STATS_WEIGHT) * self.error_rate
+            if not congested:
+                self.limit = min(self.limit + 1 / self.limit,
+                                 CONF.backend_concurrency_max)
+            elif self._decreased_at is None or \
+                    request.started > self._decreased_at:
+                self.limit = max(
+                    self.limit * CONF.backend_concurrency_decrease,
+                    CONF.backend_concurrency_min)
+                self._decreased_at = now
+                LOG.info('Limit the requests to {0} to {1}, latency {2:.3f}s, '
+                         'error rate {3:.2f}'.format(self.name,
+                                                     int(self.limit),
+                                                     self.latency,
+                                                     self.error_rate))
+            self._condition.notify_all()
+
+
+class LimitedHTTPAdapter(adapters.HTTPAdapter):
+    """HTTP adapter sending the requests of a session through a limiter.
+
+    Errors of the server and "too many requests" answers count as
+    failures.
+    """
+
+    def __init__(self, limiter, **kwargs):
+        self.limiter = limiter
+        super(LimitedHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        with self.limiter.request() as limited:
+            response = super(LimitedHTTPAdapter, self).send(request, **kwargs)
+            if not kwargs.get('stream'):
+                # Read the body in the request, which frees the connection
+                response.content
+            if response.status_code >= 500 or response.status_code == 429:
+                limited.failed()
+            return response
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host, port):
+    """Return the limiter shared by all the requests to an address."""
+    name = '{0}:{1}'.format(host, port)
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AIMDLimiter(name)
+        return _limiters[name]
+
+
+def limit_session(session, host, port):
+    """Send the HTTPS requests of a requests session through a limiter."""
+    # Keep alive as many connections as requests may be in flight
+    session.mount('https://', LimitedHTTPAdapter(
+        get_limiter(host, port), pool_maxsize=CONF.backend_concurrency_max))
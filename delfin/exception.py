@@ -166,6 +166,10 @@ class VolumeNotFound(NotFound):
     msg_fmt = _("Volume {0} could not be found.")
 
 
+class SyncJobNotFound(NotFound):
+    msg_fmt = _("Sync job {0} could not be found.")
+
+
 class StorageDriverNotFound(NotFound):
     msg_fmt = _("Storage driver '{0}'could not be found.")
 
@@ -182,6 +186,11 @@ class StorageBackendException(DelfinException):
     msg_fmt = _("Exception from Storage Backend: {0}.")
 
 
+class StorageBackendUnavailable(DelfinException):
+    msg_fmt = _("Storage backend of {0} is unavailable until {1}.")
+    code = 503
+
+
 class SSHException(DelfinException):
     msg_fmt = _("Exception in SSH protocol negotiation or logic. {0}")
 
@@ -17,61 +17,520 @@
 
 """
 
+import collections
+import datetime
+import heapq
+import itertools
+import random
+import threading
+
 from oslo_config import cfg
 from oslo_log import log
 from oslo_service import periodic_task
 from oslo_utils import importutils
+from oslo_utils import timeutils
 
 from delfin import coordination
+from delfin import db
+from delfin import exception
 from delfin import manager
+from delfin.common import constants
+from delfin.drivers import circuit_breaker
 from delfin.drivers import manager as driver_manager
-from delfin.exporter import base_exporter
 from delfin.task_manager import rpcapi as task_rpcapi
+from delfin.task_manager.tasks import task
 
 LOG = log.getLogger(__name__)
+
+sync_opts = [
+    cfg.IntOpt('sync_max_workers',
+               default=16,
+               min=1,
+               help='Maximum number of storage resource sync tasks run at '
+                    'the same time by a task manager.'),
+    cfg.IntOpt('sync_max_workers_per_storage',
+               default=2,
+               min=1,
+               help='Maximum number of sync tasks run at the same time for '
+                    'one storage, so that a single storage is not flooded '
+                    'with requests and cannot take all workers.'),
+    cfg.IntOpt('sync_interval',
+               default=0,
+               min=0,
+               help='Seconds between two periodic syncs of the resources of '
+                    'a storage. 0 disables the periodic sync, unless an '
+                    'interval is set by sync_interval_per_resource or '
+                    'sync_interval_per_storage.'),
+    cfg.DictOpt('sync_interval_per_resource',
+                default={},
+                help='Seconds between two periodic syncs of a type of '
+                     'resource, overriding sync_interval. Keys are the '
+                     'names of the sync tasks, for example '
+                     'StorageDeviceTask:600,StorageVolumeTask:3600'),
+    cfg.DictOpt('sync_interval_per_storage',
+                default={},
+                help='Seconds between two periodic syncs of the resources '
+                     'of a storage, overriding the other intervals. Keys '
+                     'are storage ids.'),
+    cfg.FloatOpt('sync_interval_jitter',
+                 default=0.1,
+                 min=0,
+                 max=1,
+                 help='Each interval is randomly lengthened or shortened by '
+                      'up to this fraction of it, so that the syncs of '
+                      'storages which were registered together do not '
+                      'keep happening at the same time.'),
+    cfg.BoolOpt('sync_interval_adaptive',
+                default=False,
+                help='Adapt the interval of the periodic sync of each '
+                     'resource of each storage to the rate its resources '
+                     'change at, so that a sync finds about '
+                     'sync_interval_target_changes changes. The rate is '
+                     'observed from the counts of the sync jobs, the '
+                     'interval is between sync_interval_min and '
+                     'sync_interval_max. Resources whose sync does not '
+                     'count changes, such as the storage device itself or '
+                     'the resources synced in upsert mode, keep their '
+                     'configured interval.'),
+    cfg.IntOpt('sync_interval_min',
+               default=300,
+               min=1,
+               help='Shortest adaptive sync interval, in seconds.'),
+    cfg.IntOpt('sync_interval_max',
+               default=86400,
+               min=1,
+               help='Longest adaptive sync interval, in seconds.'),
+    cfg.IntOpt('sync_interval_target_changes',
+               default=100,
+               min=1,
+               help='Number of changes an adaptive sync interval aims at '
+                    'finding in one sync.'),
+    cfg.FloatOpt('sync_change_rate_weight',
+                 default=0.3,
+                 min=0.01,
+                 max=1,
+                 help='Weight of the latest sync in the exponentially '
+                      'weighted change rate of a resource, the higher, the '
+                      'quicker intervals follow changes of the rate.'),
+    cfg.IntOpt('sync_job_retention',
+               default=7 * 24 * 3600,
+               min=0,
+               help='Seconds the sync jobs which ended are kept in '
+                    'database, they are purged after. It must be longer '
+                    'than sync_interval_max, the adaptive intervals are '
+                    'computed from the jobs kept. 0 keeps them forever.'),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(sync_opts)
 CONF.import_opt('periodic_interval', 'delfin.service')
 
 
+class SyncExecutor(object):
+    """Run sync tasks in a bounded pool of workers.
+
+    At most max_workers tasks run at the same time, and at most
+    max_per_storage of them for the same storage. Queued tasks run in
+    order of priority, lower first, then in order of submission. A task
+    which would exceed the limit of its storage waits aside without
+    blocking the tasks of other storages.
+
+    Workers are threads, which are green threads in the task service.
+    """
+
+    def __init__(self, max_workers, max_per_storage):
+        self.max_workers = max_workers
+        self.max_per_storage = max_per_storage
+        self._condition = threading.Condition()
+        self._ready = []
+        self._waiting = collections.defaultdict(collections.deque)
+        self._running = collections.Counter()
+        self._counter = itertools.count()
+        self._workers = []
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    def submit(self, storage_id, priority, func, *args, **kwargs):
+        with self._condition:
+            heapq.heappush(self._ready, (priority, next(self._counter),
+                                         storage_id, func, args, kwargs))
+            self.queue_depth += 1
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            self._condition.notify()
+        LOG.debug('Sync executor: {0} tasks queued, {1} in flight'
+                  .format(self.queue_depth, self.in_flight))
+
+    def wait(self, timeout=None):
+        """Wait until all the submitted tasks are done."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self.queue_depth and not self.in_flight,
+                timeout)
+
+    def _next(self):
+        with self._condition:
+            while True:
+                self._condition.wait_for(lambda: self._ready)
+                item = heapq.heappop(self._ready)
+                storage_id = item[2]
+                if self._running[storage_id] < self.max_per_storage:
+                    self._running[storage_id] += 1
+                    self.queue_depth -= 1
+                    self.in_flight += 1
+                    return item
+                self._waiting[storage_id].append(item)
+
+    def _done(self, storage_id):
+        with self._condition:
+            self._running[storage_id] -= 1
+            if not self._running[storage_id]:
+                del self._running[storage_id]
+            self.in_flight -= 1
+            waiting = self._waiting.get(storage_id)
+            if waiting:
+                heapq.heappush(self._ready, waiting.popleft())
+                if not waiting:
+                    del self._waiting[storage_id]
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            priority, _, storage_id, func, args, kwargs = self._next()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                LOG.error('Sync task for storage {0} failed: {1}'
+                          .format(storage_id, e))
+            finally:
+                self._done(storage_id)
+
+
+class SyncScheduler(object):
+    """Periodically start the sync of every resource of every storage.
+
+    The first sync of a resource after the scheduler starts is spread at
+    random over its interval, the next ones are due one interval, with
+    jitter, after the previous one was started. A resource whose previous
+    sync is still running is skipped until the next interval.
+
+    With CONF.sync_interval_adaptive, the interval of a resource is
+    adapted to the change rate observed by its sync jobs, see
+    adapt_interval.
+    """
+
+    # Keys of the counts of a sync which are changes
+    CHANGE_COUNTS = ('added', 'updated', 'deleted')
+
+    def __init__(self, task_rpcapi):
+        self.task_rpcapi = task_rpcapi
+        self._next_run = {}
+        # (storage_id, task name) to (change rate, id and start time of the
+        # last sync job the rate was updated with)
+        self._change_rates = {}
+
+    @staticmethod
+    def get_interval(storage_id, task_cls):
+        if storage_id in CONF.sync_interval_per_storage:
+            return int(CONF.sync_interval_per_storage[storage_id])
+        if task_cls.__name__ in CONF.sync_interval_per_resource:
+            return int(CONF.sync_interval_per_resource[task_cls.__name__])
+        return CONF.sync_interval
+
+    def _update_change_rate(self, context, storage_id, task_cls):
+        """Update the change rate of a resource with its last sync jobs.
+
+        The rate is in changes per second, it is None until two successful
+        full sync jobs which count changes are known. Between two full
+        jobs, the changes of every job are counted, the ones of the jobs
+        which only synced some pools too.
+        """
+        key = (storage_id, task_cls.__name__)
+        resource_type = task_cls.resource_type.name.lower()
+        rate, last_job = self._change_rates.get(key, (None, None))
+        if last_job is None:
+            sync_jobs = db.sync_job_get_all(
+                context, limit=1,
+                filters={'storage_id': storage_id,
+                         'resource_type': resource_type,
+                         'status': constants.SyncJobStatus.SUCCEEDED,
+                         'scoped': False})
+        else:
+            sync_jobs = db.sync_jobs_get_succeeded(
+                context, storage_id, resource_type, last_job[1])
+        # Upsert syncs only count deletions, not every change
+        sync_jobs = [sync_job for sync_job in sync_jobs
+                     if sync_job['started_at'] is not None and
+                     all(name in (sync_job['counts'] or {})
+                         for name in self.CHANGE_COUNTS)]
+        full_jobs = [sync_job for sync_job in sync_jobs
+                     if not sync_job['scoped']]
+        if not full_jobs:
+            return rate
+        sync_job = full_jobs[-1]
+
+        if last_job is not None:
+            elapsed = (sync_job['started_at'] - last_job[1]).total_seconds()
+            if elapsed > 0:
+                changes = sum(job['counts'][name] for job in sync_jobs
+                              for name in self.CHANGE_COUNTS
+                              if job['started_at'] <= sync_job['started_at'])
+                weight = CONF.sync_change_rate_weight
+                sample = changes / elapsed
+                rate = sample if rate is None \
+                    else weight * sample + (1 - weight) * rate
+        # The first job only starts the measure, it can be the first sync
+        # of the storage which adds every resource
+        self._change_rates[key] = (rate, (sync_job['id'],
+                                          sync_job['started_at']))
+        return rate
+
+    def adapt_interval(self, context, storage_id, task_cls, interval):
+        """Return the interval adapted to the change rate of a resource."""
+        rate = self._update_change_rate(context, storage_id, task_cls)
+        if rate is None:
+            return interval
+        if rate <= 0:
+            return CONF.sync_interval_max
+        interval = CONF.sync_interval_target_changes / rate
+        return max(CONF.sync_interval_min,
+                   min(CONF.sync_interval_max, interval))
+
+    def _jitter(self, interval):
+        jitter = CONF.sync_interval_jitter
+        return interval * (1 + random.uniform(-jitter, jitter))
+
+    def schedule(self, context):
+        now = timeutils.utcnow_ts(microsecond=True)
+        next_run = {}
+        for storage in db.storage_get_all(context):
+            for task_cls in task.StorageResourceTask.__subclasses__():
+                interval = self.get_interval(storage['id'], task_cls)
+                if interval <= 0:
+                    continue
+                key = (storage['id'], task_cls.__name__)
+                due = self._next_run.get(key)
+                if due is None:
+                    next_run[key] = now + random.uniform(0, interval)
+                elif due > now:
+                    next_run[key] = due
+                else:
+                    if CONF.sync_interval_adaptive:
+                        interval = self.adapt_interval(
+                            context, storage['id'], task_cls, interval)
+                    next_run[key] = now + self._jitter(interval)
+                    self._start(context, storage['id'], task_cls)
+        # Storages which were removed are forgotten
+        self._next_run = next_run
+        self._change_rates = dict(
+            (key, value) for key, value in self._change_rates.items()
+            if key in next_run)
+
+    def _start(self, context, storage_id, task_cls):
+        if not db.storage_update_sync_status(
+                context, storage_id, 1 << task_cls.resource_type,
+                constants.SyncStatus.SYNCING,
+                expected=constants.SyncStatus.SYNCED):
+            LOG.info('Skip the periodic {0} of storage {1}, its previous '
+                     'sync is still running'.format(task_cls.__name__,
+                                                    storage_id))
+            return
+        self.task_rpcapi.sync_storage_resource(
+            context, storage_id, task_cls.__module__ + '.' + task_cls.__name__)
+
+
 class TaskManager(manager.Manager):
     """manage periodical tasks"""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self, service_name=None, *args, **kwargs):
         super(TaskManager, self).__init__(*args, **kwargs)
         self.task_rpcapi = task_rpcapi.TaskAPI()
+        self.sync_executor = SyncExecutor(CONF.sync_max_workers,
+                                          CONF.sync_max_workers_per_storage)
+        self.sync_scheduler = SyncScheduler(self.task_rpcapi)
+        # Jobs of this process, the jobs left by a previous process of
+        # the same host are not renewed and expire
+        self._sync_job_ids = set()
+
+    def init_host(self):
+        try:
+            task_rpcapi.TASK_HOSTS.join(self.host)
+        except Exception as e:
+            LOG.warning('Failed to join the task hosts ring, storages will '
+                        'not be partitioned: {0}'.format(e))
+
+    @periodic_task.periodic_task
+    def _release_drivers(self, context):
+        """Release the drivers of the storages owned by other hosts."""
+        drivers = driver_manager.DriverManager()
+        for storage_id in list(drivers.driver_factory):
+            owner = task_rpcapi.TASK_HOSTS.get_node(storage_id)
+            if owner and owner != self.host:
+                LOG.info('Storage {0} is now owned by {1}, release its '
+                         'driver'.format(storage_id, owner))
+                drivers.remove_driver(storage_id)
+
+    @periodic_task.periodic_task(run_immediately=True)
+    def _schedule_sync(self, context):
+        """Start the periodic syncs which are due.
+
+        Only the node elected as leader schedules, the syncs themselves are
+        run by any node.
+        """
+        try:
+            if not coordination.LOCK_COORDINATOR.elect_leader(
+                    'sync-scheduler'):
+                return
+        except exception.LockCreationFailed:
+            LOG.warning('Coordinator is not started, skip scheduling syncs')
+            return
+        self.sync_scheduler.schedule(context)
+
+    @periodic_task.periodic_task
+    def _check_sync_jobs(self, context):
+        """Renew the leases of the sync jobs of this process.
 
-    @periodic_task.periodic_task(spacing=2, run_immediately=True)
-    @coordination.synchronized('lock-task-example')
-    def _task_example(self, context):
-        """Periodical task, it will use coordination for
-        distribute synchronization.
+        The jobs whose lease expired, of other hosts or of a previous
+        process of this host, are expired, and the sync status of their
+        resource is reset, so that the resource is not left syncing
+        forever. The jobs which ended before the retention are purged.
         """
-        LOG.info("Produce task, say hello ...")
-        self.task_rpcapi.say_hello(context)
+        db.sync_jobs_renew(context, list(self._sync_job_ids),
+                           self._lease_expires_at())
+        for sync_job in db.sync_jobs_expire(context):
+            LOG.warning('Sync job {0} of storage {1} on {2} expired'
+                        .format(sync_job['id'], sync_job['storage_id'],
+                                sync_job['host']))
+            resource_type = constants.ResourceType[
+                sync_job['resource_type'].upper()]
+            db.storage_update_sync_status(
+                context, sync_job['storage_id'], 1 << resource_type,
+                constants.SyncStatus.SYNCED)
+
+        if CONF.sync_job_retention:
+            purged = db.sync_jobs_purge(
+                context, timeutils.utcnow() - datetime.timedelta(
+                    seconds=CONF.sync_job_retention))
+            if purged:
+                LOG.info('Purged {0} sync jobs'.format(purged))
+
+    @staticmethod
+    def _lease_expires_at():
+        return timeutils.utcnow() + datetime.timedelta(
+            seconds=CONF.sync_job_lease)
+
+    def _update_sync_job(self, context, sync_job_id, values):
+        # The sync goes on without its job record if it cannot be written
+        try:
+            db.sync_job_update(context, sync_job_id, values)
+        except Exception as e:
+            LOG.warning('Failed to update sync job {0}: {1}'
+                        .format(sync_job_id, e))
+
+    def _submit_sync(self, context, storage_id, cls, original_pool_ids=None,
+                     sync_job_id=None):
+        device_obj = cls(context, storage_id, original_pool_ids)
+        if sync_job_id is not None:
+            try:
+                if not db.sync_job_claim(context, sync_job_id, self.host,
+                                         self._lease_expires_at()):
+                    # Its sync status was reset, another sync may run
+                    LOG.warning('Skip sync job {0} of storage {1}, it is not '
+                                'queued anymore'.format(sync_job_id,
+                                                        storage_id))
+                    return
+                self._sync_job_ids.add(sync_job_id)
+            except Exception as e:
+                LOG.warning('Failed to claim sync job {0}: {1}'
+                            .format(sync_job_id, e))
+                sync_job_id = None
+        else:
+            try:
+                sync_job = db.sync_job_create(context, {
+                    'storage_id': storage_id,
+                    'resource_type': cls.resource_type.name.lower(),
+                    'status': constants.SyncJobStatus.QUEUED,
+                    'host': self.host,
+                    'scoped': original_pool_ids is not None,
+                    'lease_expires_at': self._lease_expires_at()})
+                sync_job_id = sync_job['id']
+                self._sync_job_ids.add(sync_job_id)
+            except Exception as e:
+                LOG.warning('Failed to create the sync job of {0} for '
+                            'storage {1}: {2}'.format(cls.__name__,
+                                                      storage_id, e))
+        self.sync_executor.submit(storage_id, cls.sync_priority,
+                                  self._run_sync, context, sync_job_id,
+                                  device_obj)
+
+    def _run_sync(self, context, sync_job_id, device_obj):
+        """Run a sync task and record its timings in its job."""
+        if sync_job_id is None:
+            return device_obj.sync()
 
-    def say_hello(self, context, request_spec=None,
-                  filter_properties=None):
         try:
-            LOG.info("Consume say hello task ...")
-            # get resource data, use static data for example here
-            data = {
-                'device_id': '123456',
-                'pool_num': '4',
-            }
-            # report data to northbound platform
-            base_exporter.dispatch_example_data(data)
-
-        except Exception:
-            pass
-
-    def sync_storage_resource(self, context, storage_id, resource_task):
+            return self._run_sync_job(context, sync_job_id, device_obj)
+        finally:
+            self._sync_job_ids.discard(sync_job_id)
+
+    def _run_sync_job(self, context, sync_job_id, device_obj):
+        self._update_sync_job(context, sync_job_id, {
+            'status': constants.SyncJobStatus.RUNNING,
+            'started_at': timeutils.utcnow()})
+        watch = timeutils.StopWatch().start()
+        counts = None
+        try:
+            counts = device_obj.sync()
+            error = device_obj.error
+        except Exception as e:
+            LOG.error('Sync job {0} failed: {1}'.format(sync_job_id, e))
+            error = str(e)
+        duration = watch.elapsed()
+        # What is not spent in driver is mostly spent in database
+        driver_time = device_obj.driver_api.elapsed
+        self._update_sync_job(context, sync_job_id, {
+            'status': (constants.SyncJobStatus.FAILED if error
+                       else constants.SyncJobStatus.SUCCEEDED),
+            'ended_at': timeutils.utcnow(),
+            'duration': duration,
+            'driver_time': driver_time,
+            'db_time': max(duration - driver_time, 0),
+            'counts': counts,
+            'error': error})
+        return counts
+
+    def sync_storage_resource(self, context, storage_id, resource_task,
+                              original_pool_ids=None, sync_job_id=None):
         LOG.debug("Received the sync_storage task: {0} request for storage"
                   " id:{1}".format(resource_task, storage_id))
         cls = importutils.import_class(resource_task)
-        device_obj = cls(context, storage_id)
-        device_obj.sync()
+        self._submit_sync(context, storage_id, cls, original_pool_ids,
+                          sync_job_id)
+
+    def sync_all_storages(self, context):
+        """Mark all idle storages as syncing and dispatch their syncs."""
+        storage_ids = db.storages_update_sync_status(
+            context, (1 << len(constants.ResourceType)) - 1,
+            constants.SyncStatus.SYNCING,
+            expected=constants.SyncStatus.SYNCED)
+        LOG.info('Syncing {0} storages'.format(len(storage_ids)))
+        self.task_rpcapi.sync_storages(context, storage_ids)
+
+    def sync_storages(self, context, storage_ids, sync_job_ids=None):
+        LOG.debug('Received the sync of {0} storages'
+                  .format(len(storage_ids)))
+        sync_job_ids = sync_job_ids or {}
+        for storage_id in storage_ids:
+            for cls in task.StorageResourceTask.__subclasses__():
+                self._submit_sync(
+                    context, storage_id, cls,
+                    sync_job_id=sync_job_ids.get(storage_id, {}).get(
+                        cls.resource_type.name.lower()))
 
     def remove_storage_resource(self, context, storage_id, resource_task):
         cls = importutils.import_class(resource_task)
@@ -83,3 +542,4 @@ class TaskManager(manager.Manager):
                  .format(storage_id))
         drivers = driver_manager.DriverManager()
         drivers.remove_driver(storage_id)
+        circuit_breaker.CIRCUIT_BREAKER.remove(storage_id)
@@ -16,13 +16,41 @@
 Client side of the task manager RPC API.
 """
 
+import collections
+import datetime
+
 import oslo_messaging as messaging
 from oslo_config import cfg
-from oslo_serialization import jsonutils
+from oslo_log import log
+from oslo_utils import importutils
+from oslo_utils import timeutils
 
+from delfin import coordination
+from delfin import db
 from delfin import rpc
+from delfin.common import constants
+from delfin.task_manager.tasks import task
+
+LOG = log.getLogger(__name__)
+
+task_rpcapi_opts = [
+    cfg.IntOpt('sync_job_lease',
+               default=300,
+               min=1,
+               help='Seconds a sync job stays active without its task '
+                    'manager renewing it. The leases are renewed by a '
+                    'periodic task, so it must be several times '
+                    'periodic_interval. A job whose lease expired, because '
+                    'its task manager died or never got it, is marked as '
+                    'expired and its resource can be synced again.'),
+]
 
 CONF = cfg.CONF
+CONF.register_opts(task_rpcapi_opts)
+
+# Hash ring of the hosts running a task manager, the syncs of a storage are
+# sent to its owner so that only one of them connects to the storage
+TASK_HOSTS = coordination.GroupHashRing('task-hosts')
 
 
 class TaskAPI(object):
@@ -31,9 +59,13 @@ class TaskAPI(object):
     API version history:
 
         1.0 - Initial version.
+        1.1 - Add sync_all_storages and sync_storages.
+        1.2 - Add original_pool_ids to sync_storage_resource.
+        1.3 - Add sync_job_id to sync_storage_resource and sync_job_ids to
+              sync_storages.
     """
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self):
         super(TaskAPI, self).__init__()
@@ -41,24 +73,79 @@ class TaskAPI(object):
                                   version=self.RPC_API_VERSION)
         self.client = rpc.get_client(target, version_cap=self.RPC_API_VERSION)
 
-    def say_hello(self, context, request_spec=None,
-                  filter_properties=None):
-        request_spec_p = jsonutils.to_primitive(request_spec)
-        call_context = self.client.prepare(version='1.0')
-        return call_context.cast(context,
-                                 'say_hello',
-                                 request_spec=request_spec_p,
-                                 filter_properties=filter_properties)
+    def _prepare_for_storage(self, storage_id, version='1.0'):
+        # Any task manager will do if the owner is unknown
+        host = TASK_HOSTS.get_node(storage_id)
+        if host:
+            return self.client.prepare(version=version, server=host), host
+        return self.client.prepare(version=version), host
 
-    def sync_storage_resource(self, context, storage_id, resource_task):
-        call_context = self.client.prepare(version='1.0')
+    @staticmethod
+    def _create_sync_job(context, storage_id, task_cls, host,
+                         original_pool_ids=None):
+        """Create the queued job of a sync before it is cast.
+
+        The sync status of the resource is already syncing. If the message
+        is never consumed, e.g. its host died, the lease of the job expires
+        and the sync status is reset like for a job whose task manager
+        died.
+        """
+        try:
+            sync_job = db.sync_job_create(context, {
+                'storage_id': storage_id,
+                'resource_type': task_cls.resource_type.name.lower(),
+                'status': constants.SyncJobStatus.QUEUED,
+                'host': host,
+                'scoped': original_pool_ids is not None,
+                'lease_expires_at': timeutils.utcnow() + datetime.timedelta(
+                    seconds=CONF.sync_job_lease)})
+            return sync_job['id']
+        except Exception as e:
+            LOG.warning('Failed to create the sync job of {0} for storage '
+                        '{1}: {2}'.format(task_cls.__name__, storage_id, e))
+            return None
+
+    def sync_storage_resource(self, context, storage_id, resource_task,
+                              original_pool_ids=None):
+        call_context, host = self._prepare_for_storage(storage_id,
+                                                       version='1.3')
+        task_cls = importutils.import_class(resource_task)
+        sync_job_id = self._create_sync_job(context, storage_id, task_cls,
+                                            host, original_pool_ids)
         return call_context.cast(context,
                                  'sync_storage_resource',
                                  storage_id=storage_id,
-                                 resource_task=resource_task)
+                                 resource_task=resource_task,
+                                 original_pool_ids=original_pool_ids,
+                                 sync_job_id=sync_job_id)
+
+    def sync_all_storages(self, context):
+        call_context = self.client.prepare(version='1.1')
+        return call_context.cast(context, 'sync_all_storages')
+
+    def sync_storages(self, context, storage_ids):
+        """Cast the syncs of storages, batched by owner."""
+        by_host = collections.defaultdict(list)
+        for storage_id in storage_ids:
+            by_host[TASK_HOSTS.get_node(storage_id)].append(storage_id)
+        for host, host_storage_ids in by_host.items():
+            if host:
+                call_context = self.client.prepare(version='1.3', server=host)
+            else:
+                call_context = self.client.prepare(version='1.3')
+            sync_job_ids = dict(
+                (storage_id, dict(
+                    (task_cls.resource_type.name.lower(),
+                     self._create_sync_job(context, storage_id, task_cls,
+                                           host))
+                    for task_cls in task.StorageResourceTask.__subclasses__()))
+                for storage_id in host_storage_ids)
+            call_context.cast(context, 'sync_storages',
+                              storage_ids=host_storage_ids,
+                              sync_job_ids=sync_job_ids)
 
     def remove_storage_resource(self, context, storage_id, resource_task):
-        call_context = self.client.prepare(version='1.0')
+        call_context, _host = self._prepare_for_storage(storage_id)
         return call_context.cast(context,
                                  'remove_storage_resource',
                                  storage_id=storage_id,
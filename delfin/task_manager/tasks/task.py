@@ -12,21 +12,58 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import inspect
+import itertools
+import json
+import time
 
 import decorator
+import eventlet
+from oslo_config import cfg
 from oslo_log import log
 
-from delfin import coordination
 from delfin import db
 from delfin import exception
-from delfin import utils
 from delfin.common import constants
 from delfin.drivers import api as driverapi
 from delfin.i18n import _
 
 LOG = log.getLogger(__name__)
 
+task_opts = [
+    cfg.IntOpt('volume_sync_page_size',
+               default=0,
+               help='Number of volumes to sync in one page. If it is bigger '
+                    'than 0, volumes are fetched from driver and written '
+                    'to database page by page, so that the memory used by '
+                    'a sync is proportional to the page size instead of '
+                    'the number of volumes. 0 means syncing all volumes at '
+                    'once.'),
+    cfg.StrOpt('resource_sync_mode',
+               default='diff',
+               choices=['diff', 'upsert', 'staging'],
+               help='How storage pools and volumes are written back to '
+                    'database. diff: compare them with the fingerprints '
+                    'saved in database and only write the differences. '
+                    'upsert: let the database insert or update them in '
+                    'one pass per chunk, keyed on storage_id and '
+                    'original_id. staging: load them into a temporary '
+                    'table and let the database compute and apply the '
+                    'differences with set based statements, so that no '
+                    'database row is loaded by the task.'),
+    cfg.BoolOpt('volume_shadow_load',
+                default=False,
+                help='Load the volumes of a storage which has none in '
+                     'database yet, typically on its first sync, under a '
+                     'new generation which only becomes visible once all '
+                     'volumes are written, instead of with the sync mode '
+                     'chosen by resource_sync_mode.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(task_opts)
+
 
 def set_synced_after(resource_type):
     @decorator.decorator
@@ -34,19 +71,13 @@ def set_synced_after(resource_type):
         call_args = inspect.getcallargs(func, *args, **kwargs)
         self = call_args['self']
         ret = func(*args, **kwargs)
-        lock = coordination.Lock(self.storage_id)
-        with lock:
-            try:
-                storage = db.storage_get(self.context, self.storage_id)
-            except exception.StorageNotFound:
-                LOG.warn('Storage %s not found when set synced'
-                         % self.storage_id)
-            else:
-                storage[constants.DB.DEVICE_SYNC_STATUS] = utils.set_bit(
-                    storage[constants.DB.DEVICE_SYNC_STATUS],
-                    resource_type,
-                    constants.SyncStatus.SYNCED)
-                db.storage_update(self.context, self.storage_id, storage)
+        # No update also means the storage is deleted, see check_deleted
+        self.storage_deleted = not db.storage_update_sync_status(
+            self.context, self.storage_id, 1 << resource_type,
+            constants.SyncStatus.SYNCED)
+        if self.storage_deleted:
+            LOG.warn('Storage %s not found when set synced'
+                     % self.storage_id)
         return ret
 
     return _set_synced_after
@@ -57,59 +88,268 @@ def check_deleted():
     def _check_deleted(func, *args, **kwargs):
         call_args = inspect.getcallargs(func, *args, **kwargs)
         self = call_args['self']
+        self.storage_deleted = None
         ret = func(*args, **kwargs)
-        # When context.read_deleted = 'yes', db.storage_get would
-        # only get the storage whose 'deleted' tag is not default value
-        self.context.read_deleted = 'yes'
-        try:
-            db.storage_get(self.context, self.storage_id)
-        except exception.StorageNotFound:
+        if self.storage_deleted is None:
+            # When read_deleted = 'yes', db.storage_get would only get
+            # the storage whose 'deleted' tag is not default value
+            ctxt = self.context.elevated(read_deleted='yes')
+            try:
+                db.storage_get(ctxt, self.storage_id)
+            except exception.StorageNotFound:
+                self.storage_deleted = False
+            else:
+                self.storage_deleted = True
+        if self.storage_deleted:
+            self.remove()
+        else:
             LOG.debug('Storage %s not found when checking deleted'
                       % self.storage_id)
-        else:
-            self.remove()
         return ret
 
     return _check_deleted
 
 
+def fingerprint(resource):
+    """Hash of the normalized resource reported by driver.
+
+    The database generated 'id' and 'generation', and the fingerprint itself
+    are excluded, so that the hash only changes when the storage reports
+    something new.
+    """
+    values = {key: value for key, value in resource.items()
+              if key not in ('id', 'fingerprint', 'generation')}
+    content = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class TimedDriverAPI(object):
+    """Proxy of the driver API which adds up the time spent in it.
+
+    The time spent to produce the items of the generators returned by the
+    driver, such as iter_volumes, is included.
+    """
+
+    def __init__(self, driver_api):
+        self._driver_api = driver_api
+        self.elapsed = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver_api, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+            finally:
+                self.elapsed += time.monotonic() - start
+            if inspect.isgenerator(result):
+                return self._timed_iter(result)
+            return result
+
+        return timed
+
+    def _timed_iter(self, iterator):
+        while True:
+            start = time.monotonic()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += time.monotonic() - start
+            yield item
+
+
 class StorageResourceTask(object):
+    # Tasks with a lower priority are run first when sync tasks queue up,
+    # short tasks should have a lower one than long tasks.
+    sync_priority = 1
 
-    def __init__(self, context, storage_id):
+    def __init__(self, context, storage_id, original_pool_ids=None):
         self.storage_id = storage_id
         self.context = context
-        self.driver_api = driverapi.API()
-
-    def _classify_resources(self, storage_resources, db_resources):
+        # Only sync the resources of these pools if it is not None, see
+        # the sync of each task
+        self.original_pool_ids = original_pool_ids
+        self.driver_api = TimedDriverAPI(driverapi.API())
+        # Known after a sync if it is decorated by set_synced_after
+        self.storage_deleted = None
+        # Set by a sync which failed
+        self.error = None
+
+    @staticmethod
+    def _classify_resources(storage_resources, db_resources):
         """
-        :param storage_resources:
-        :param db_resources:
-        :return: it will return three list add_list: the items present in
+        :param storage_resources: resources reported by the storage driver
+        :param db_resources: resources currently saved in database
+        :return: it will return four list add_list: the items present in
         storage but not in current_db. update_list:the items present in
-        storage and in current_db. delete_id_list:the items present not in
-        storage but present in current_db.
+        storage and in current_db whose fingerprint changed.
+        delete_id_list:the items present not in storage but present in
+        current_db. unchanged_list: the items present in storage and in
+        current_db with the same fingerprint, or unknown to the storage
+        driver.
+
+        Resources are matched on 'original_id' through a dict index, so the
+        cost is linear in the number of resources. Duplicated original_ids
+        are resolved as follows: if the driver reports an original_id more
+        than once, only the first occurrence is kept; if the database holds
+        several rows with the same original_id, the first row is reused and
+        the others are put in delete_id_list.
         """
-        original_ids_in_db = [resource['original_id']
-                              for resource in db_resources]
-        delete_id_list = [resource['id'] for resource in db_resources]
+        db_index = {}
+        delete_id_list = []
+        for resource in db_resources:
+            if resource['original_id'] in db_index:
+                delete_id_list.append(resource['id'])
+            else:
+                db_index[resource['original_id']] = resource
+
         add_list = []
         update_list = []
-
+        unchanged_list = []
+        seen = set()
+        duplicates = 0
         for resource in storage_resources:
-            if resource['original_id'] in original_ids_in_db:
-                resource['id'] = db_resources[original_ids_in_db.index(
-                    resource['original_id'])]['id']
-                delete_id_list.remove(resource['id'])
-                update_list.append(resource)
-            else:
+            original_id = resource['original_id']
+            if original_id in seen:
+                duplicates += 1
+                continue
+            seen.add(original_id)
+
+            db_resource = db_index.pop(original_id, None)
+            if resource.get('unknown'):
+                # Its details could not be got, it is left as it is
+                if db_resource is not None:
+                    unchanged_list.append(db_resource)
+                continue
+            if db_resource is None:
                 add_list.append(resource)
+                continue
+
+            resource['id'] = db_resource['id']
+            if resource.get('fingerprint') is not None and \
+                    resource['fingerprint'] == db_resource.get('fingerprint'):
+                unchanged_list.append(resource)
+            else:
+                update_list.append(resource)
+
+        if duplicates:
+            LOG.warning('Ignored {0} resources with duplicated original_id '
+                        'reported by storage'.format(duplicates))
+
+        delete_id_list.extend(resource['id']
+                              for resource in db_index.values())
+        return add_list, update_list, delete_id_list, unchanged_list
+
+    def _sync_resources(self, storage_resources, db_resources,
+                        create_func, update_func, delete_func):
+        """Write the difference between storage and database back to DB.
+
+        :return: a dict with the number of added, updated, unchanged and
+        deleted resources.
+        """
+        for resource in storage_resources:
+            resource['fingerprint'] = fingerprint(resource)
+
+        add_list, update_list, delete_id_list, unchanged_list = \
+            self._classify_resources(storage_resources, db_resources)
+
+        if delete_id_list:
+            delete_func(self.context, delete_id_list)
 
-        return add_list, update_list, delete_id_list
+        if update_list:
+            update_func(self.context, update_list)
+
+        if add_list:
+            create_func(self.context, add_list)
+
+        return {'added': len(add_list),
+                'updated': len(update_list),
+                'unchanged': len(unchanged_list),
+                'deleted': len(delete_id_list)}
+
+    @staticmethod
+    def _unique_resources(storage_resources):
+        """Yield the resources with their fingerprint set.
+
+        Like _classify_resources, only the first of the resources sharing
+        an original_id is kept. Unknown resources are yielded too, callers
+        must not write them.
+        """
+        seen = set()
+        duplicates = 0
+        for resource in storage_resources:
+            if resource['original_id'] in seen:
+                duplicates += 1
+                continue
+            seen.add(resource['original_id'])
+            resource['fingerprint'] = fingerprint(resource)
+            yield resource
+
+        if duplicates:
+            LOG.warning('Ignored {0} resources with duplicated original_id '
+                        'reported by storage'.format(duplicates))
+
+    def _upsert_resources(self, storage_resources, upsert_func):
+        """Insert or update resources without reading them from DB first.
+
+        :return: a dict with the number of upserted resources.
+        """
+        resources = [resource for resource
+                     in self._unique_resources(storage_resources)
+                     if not resource.get('unknown')]
+        if resources:
+            upsert_func(self.context, resources)
+        return {'upserted': len(resources)}
+
+    def _reconcile_resources(self, storage_resources, reconcile_func):
+        """Let the database diff the resources with the ones it holds.
+
+        storage_resources may be any iterable, it is streamed to the
+        database.
+
+        :return: a dict with the number of added, updated, unchanged and
+        deleted resources.
+        """
+        return reconcile_func(self.context, self.storage_id,
+                              self._unique_resources(storage_resources))
+
+    def _delete_absent(self, original_ids, get_fingerprints_func,
+                       delete_func):
+        """Delete the resources in DB whose original_id is not given.
+
+        The resources got by get_fingerprints_func may be streamed, they
+        are deleted chunk by chunk as they come.
+
+        :return: the number of deleted resources.
+        """
+        deleted = 0
+        delete_id_list = []
+        for resource in get_fingerprints_func(self.context, self.storage_id):
+            if resource['original_id'] in original_ids:
+                continue
+            delete_id_list.append(resource['id'])
+            if len(delete_id_list) >= CONF.database.bulk_chunk_size:
+                delete_func(self.context, delete_id_list)
+                deleted += len(delete_id_list)
+                delete_id_list = []
+        if delete_id_list:
+            delete_func(self.context, delete_id_list)
+            deleted += len(delete_id_list)
+        return deleted
 
 
 class StorageDeviceTask(StorageResourceTask):
-    def __init__(self, context, storage_id):
-        super(StorageDeviceTask, self).__init__(context, storage_id)
+    resource_type = constants.ResourceType.STORAGE_DEVICE
+    sync_priority = 0
+
+    def __init__(self, context, storage_id, original_pool_ids=None):
+        super(StorageDeviceTask, self).__init__(context, storage_id,
+                                                original_pool_ids)
 
     @check_deleted()
     @set_synced_after(constants.ResourceType.STORAGE_DEVICE)
@@ -126,10 +366,12 @@ class StorageDeviceTask(StorageResourceTask):
             db.storage_update(self.context, self.storage_id, storage)
         except AttributeError as e:
             LOG.error(e)
+            self.error = str(e)
         except Exception as e:
             msg = _('Failed to update storage entry in DB: {0}'
                     .format(e))
             LOG.error(msg)
+            self.error = msg
         else:
             LOG.info("Syncing storage successful!!!")
 
@@ -145,8 +387,11 @@ class StorageDeviceTask(StorageResourceTask):
 
 
 class StoragePoolTask(StorageResourceTask):
-    def __init__(self, context, storage_id):
-        super(StoragePoolTask, self).__init__(context, storage_id)
+    resource_type = constants.ResourceType.STORAGE_POOL
+
+    def __init__(self, context, storage_id, original_pool_ids=None):
+        super(StoragePoolTask, self).__init__(context, storage_id,
+                                              original_pool_ids)
 
     @check_deleted()
     @set_synced_after(constants.ResourceType.STORAGE_POOL)
@@ -160,29 +405,47 @@ class StoragePoolTask(StorageResourceTask):
             # collect the storage pools list from driver and database
             storage_pools = self.driver_api.list_storage_pools(self.context,
                                                                self.storage_id)
-            db_pools = db.storage_pool_get_all(self.context,
-                                               filters={"storage_id":
-                                                        self.storage_id})
-
-            add_list, update_list, delete_id_list = self._classify_resources(
-                storage_pools, db_pools
-            )
-            if delete_id_list:
-                db.storage_pools_delete(self.context, delete_id_list)
-
-            if update_list:
-                db.storage_pools_update(self.context, update_list)
-
-            if add_list:
-                db.storage_pools_create(self.context, add_list)
+            if self.original_pool_ids is not None:
+                # The other pools are left as they are
+                pool_ids = set(self.original_pool_ids)
+                storage_pools = [pool for pool in storage_pools
+                                 if pool['original_id'] in pool_ids]
+                db_pools = db.storage_pool_get_fingerprints(
+                    self.context, self.storage_id, original_ids=pool_ids)
+                counts = self._sync_resources(storage_pools, db_pools,
+                                              db.storage_pools_create,
+                                              db.storage_pools_update,
+                                              db.storage_pools_delete)
+            elif CONF.resource_sync_mode == 'staging':
+                counts = self._reconcile_resources(
+                    storage_pools, db.storage_pools_reconcile)
+            elif CONF.resource_sync_mode == 'upsert':
+                counts = self._upsert_resources(storage_pools,
+                                                db.storage_pools_upsert)
+                counts['deleted'] = self._delete_absent(
+                    set(pool['original_id'] for pool in storage_pools),
+                    db.storage_pool_get_fingerprints,
+                    db.storage_pools_delete)
+            else:
+                db_pools = db.storage_pool_get_fingerprints(self.context,
+                                                            self.storage_id)
+                counts = self._sync_resources(storage_pools, db_pools,
+                                              db.storage_pools_create,
+                                              db.storage_pools_update,
+                                              db.storage_pools_delete)
+            LOG.info('StoragePoolTask for {0}: {1}'.format(self.storage_id,
+                                                           counts))
         except AttributeError as e:
             LOG.error(e)
+            self.error = str(e)
         except Exception as e:
             msg = _('Failed to sync pools entry in DB: {0}'
                     .format(e))
             LOG.error(msg)
+            self.error = msg
         else:
             LOG.info("Syncing storage pools successful!!!")
+            return counts
 
     def remove(self):
         LOG.info('Remove storage pools for storage id:{0}'.format(
@@ -191,8 +454,12 @@ class StoragePoolTask(StorageResourceTask):
 
 
 class StorageVolumeTask(StorageResourceTask):
-    def __init__(self, context, storage_id):
-        super(StorageVolumeTask, self).__init__(context, storage_id)
+    resource_type = constants.ResourceType.STORAGE_VOLUME
+    sync_priority = 2
+
+    def __init__(self, context, storage_id, original_pool_ids=None):
+        super(StorageVolumeTask, self).__init__(context, storage_id,
+                                                original_pool_ids)
 
     @check_deleted()
     @set_synced_after(constants.ResourceType.STORAGE_VOLUME)
@@ -202,37 +469,161 @@ class StorageVolumeTask(StorageResourceTask):
         """
         LOG.info('Syncing volumes for storage id:{0}'.format(self.storage_id))
         try:
-            # collect the volumes list from driver and database
-            storage_volumes = self.driver_api.list_volumes(self.context,
-                                                           self.storage_id)
-            db_volumes = db.volume_get_all(self.context,
-                                           filters={"storage_id":
-                                                    self.storage_id})
-
-            add_list, update_list, delete_id_list = self._classify_resources(
-                storage_volumes, db_volumes
-            )
-            LOG.info('###StorageVolumeTask for {0}:add={1},delete={2},'
-                     'update={3}'.format(self.storage_id,
-                                         len(add_list),
-                                         len(delete_id_list),
-                                         len(update_list)))
-            if delete_id_list:
-                db.volumes_delete(self.context, delete_id_list)
-
-            if update_list:
-                db.volumes_update(self.context, update_list)
-
-            if add_list:
-                db.volumes_create(self.context, add_list)
+            if self.original_pool_ids is not None:
+                counts = self._sync_in_pools()
+            elif CONF.volume_shadow_load and not db.volume_get_all(
+                    self.context, limit=1,
+                    filters={'storage_id': self.storage_id}):
+                counts = self._load_generation(CONF.volume_sync_page_size)
+            elif CONF.resource_sync_mode == 'staging':
+                counts = self._sync_staged(CONF.volume_sync_page_size)
+            elif CONF.volume_sync_page_size > 0:
+                counts = self._sync_by_page(CONF.volume_sync_page_size)
+            else:
+                counts = self._sync_all()
+            LOG.info('StorageVolumeTask for {0}: {1}'.format(self.storage_id,
+                                                             counts))
         except AttributeError as e:
             LOG.error(e)
+            self.error = str(e)
         except Exception as e:
             msg = _('Failed to sync volumes entry in DB: {0}'
                     .format(e))
             LOG.error(msg)
+            self.error = msg
         else:
             LOG.info("Syncing volumes successful!!!")
+            return counts
+
+    def _sync_in_pools(self):
+        # Only the volumes of the pools are listed, the volumes of the
+        # other pools are left as they are
+        storage_volumes = self.driver_api.list_volumes_in_pools(
+            self.context, self.storage_id, self.original_pool_ids)
+        db_volumes = db.volume_get_fingerprints(
+            self.context, self.storage_id,
+            original_pool_ids=self.original_pool_ids)
+        return self._sync_resources(storage_volumes, db_volumes,
+                                    db.volumes_create, db.volumes_update,
+                                    db.volumes_delete)
+
+    def _sync_all(self):
+        # collect the volumes list from driver and database
+        storage_volumes = self.driver_api.list_volumes(self.context,
+                                                       self.storage_id)
+        if CONF.resource_sync_mode == 'upsert':
+            counts = self._upsert_resources(storage_volumes,
+                                            db.volumes_upsert)
+            counts['deleted'] = self._delete_absent(
+                set(volume['original_id'] for volume in storage_volumes),
+                db.volume_get_fingerprints, db.volumes_delete)
+            return counts
+
+        db_volumes = db.volume_get_fingerprints(self.context,
+                                                self.storage_id)
+        return self._sync_resources(storage_volumes, db_volumes,
+                                    db.volumes_create,
+                                    db.volumes_update,
+                                    db.volumes_delete)
+
+    def _sync_page(self, storage_volumes):
+        if CONF.resource_sync_mode == 'upsert':
+            return self._upsert_resources(storage_volumes, db.volumes_upsert)
+
+        original_ids = [volume['original_id'] for volume in storage_volumes]
+        db_volumes = db.volume_get_fingerprints(self.context,
+                                                self.storage_id,
+                                                original_ids)
+        return self._sync_resources(storage_volumes, db_volumes,
+                                    db.volumes_create,
+                                    db.volumes_update,
+                                    db.volumes_delete)
+
+    def _sync_by_page(self, page_size):
+        """Reconcile and commit volumes one page at a time.
+
+        Only the current page and the original_ids seen so far are kept in
+        memory. Volumes which are not reported by any page are deleted when
+        all pages are synced.
+        """
+        counts = {}
+        seen = set()
+        pages = self.driver_api.iter_volumes(self.context, self.storage_id,
+                                             page_size)
+        for storage_volumes in pages:
+            storage_volumes = [volume for volume in storage_volumes
+                               if volume['original_id'] not in seen]
+            if not storage_volumes:
+                continue
+            seen.update(volume['original_id'] for volume in storage_volumes)
+            for key, value in self._sync_page(storage_volumes).items():
+                counts[key] = counts.get(key, 0) + value
+
+        counts['deleted'] = counts.get('deleted', 0) + self._delete_absent(
+            seen, db.volume_iter_fingerprints, db.volumes_delete)
+        return counts
+
+    def _sync_staged(self, page_size):
+        if page_size > 0:
+            pages = self.driver_api.iter_volumes(self.context,
+                                                 self.storage_id, page_size)
+            storage_volumes = itertools.chain.from_iterable(pages)
+        else:
+            storage_volumes = self.driver_api.list_volumes(self.context,
+                                                           self.storage_id)
+        return self._reconcile_resources(storage_volumes,
+                                         db.volumes_reconcile)
+
+    def _load_generation(self, page_size):
+        """Write all volumes under a new generation, then make it visible.
+
+        Readers see no volume while they are written, and all of them at
+        once after. The volumes of a load which did not complete are
+        deleted in background, or before the next load at the latest.
+        """
+        storage = db.storage_get(self.context, self.storage_id)
+        generation = (storage['volume_generation'] or 0) + 1
+        db.volume_delete_hidden_generations(self.context, self.storage_id)
+
+        if page_size > 0:
+            pages = self.driver_api.iter_volumes(self.context,
+                                                 self.storage_id, page_size)
+            storage_volumes = itertools.chain.from_iterable(pages)
+        else:
+            storage_volumes = self.driver_api.list_volumes(self.context,
+                                                           self.storage_id)
+        # Unknown volumes are added by a later sync
+        storage_volumes = (volume for volume
+                           in self._unique_resources(storage_volumes)
+                           if not volume.get('unknown'))
+
+        added = 0
+        swapped = False
+        try:
+            while True:
+                volumes = list(itertools.islice(
+                    storage_volumes, CONF.database.bulk_chunk_size))
+                if not volumes:
+                    break
+                for volume in volumes:
+                    volume['generation'] = generation
+                db.volumes_create(self.context, volumes)
+                added += len(volumes)
+
+            swapped = db.storage_set_volume_generation(
+                self.context, self.storage_id, generation)
+        finally:
+            if not swapped:
+                # Readers never saw these volumes, drop them in background
+                eventlet.spawn_n(db.volume_delete_hidden_generations,
+                                 self.context, self.storage_id)
+
+        if not swapped:
+            LOG.warning('Volume generation {0} of storage {1} was '
+                        'abandoned'.format(generation, self.storage_id))
+            added = 0
+        return {'added': added, 'updated': 0, 'unchanged': 0,
+                'deleted': 0}
 
     def remove(self):
         LOG.info('Remove volumes for storage id:{0}'.format(self.storage_id))
@@ -0,0 +1,56 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of StorageResourceTask._classify_resources.
+
+Usage::
+
+    python -m delfin.tests.benchmark.bench_classify_resources
+
+Every run keeps 90% of the resources, adds 10% new ones and deletes 10% of
+the old ones, and prints the time cost per resource, which should stay flat
+when the classification scales linearly.
+"""
+
+import sys
+import time
+
+from delfin.common import config  # noqa
+from delfin.task_manager.tasks import task
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+
+def _build(size):
+    keep = size * 9 // 10
+    storage_resources = [{'original_id': 'vol_%d' % i}
+                         for i in range(size - keep, size + size - keep)]
+    db_resources = [{'id': 'id_%d' % i, 'original_id': 'vol_%d' % i}
+                    for i in range(size)]
+    return storage_resources, db_resources
+
+
+def run(sizes=SIZES):
+    print('%10s %12s %14s' % ('resources', 'seconds', 'ns/resource'))
+    for size in sizes:
+        storage_resources, db_resources = _build(size)
+        start = time.perf_counter()
+        task.StorageResourceTask._classify_resources(storage_resources,
+                                                     db_resources)
+        cost = time.perf_counter() - start
+        print('%10d %12.4f %14.1f' % (size, cost, cost * 1e9 / size))
+
+
+if __name__ == '__main__':
+    run([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,70 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the task manager SyncExecutor with the fake driver.
+
+Usage::
+
+    python -m delfin.tests.benchmark.bench_sync_executor \\
+        [--arrays 1000] [--workers 16,64,256] [--per-storage 2]
+
+For every number of workers, the device, pool and volume listing of each
+simulated array is submitted to a SyncExecutor, like the task manager does
+on a sync of all storages, and the number of tasks done per second is
+printed. The fake driver waits 0.1 to 0.5 second per API, so throughput
+should scale with the number of workers until the CPU is saturated.
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import time  # noqa: E402
+
+from delfin.common import config  # noqa
+from delfin.drivers import fake_storage  # noqa: E402
+from delfin.task_manager import manager  # noqa: E402
+
+CONF = config.CONF
+
+
+def run(arrays, workers_list, per_storage):
+    CONF.set_override('fake_volume_range', '1-500', 'fake_driver')
+    CONF.set_override('fake_pool_range', '1-10', 'fake_driver')
+    drivers = [fake_storage.FakeStorageDriver(storage_id='storage_%d' % i)
+               for i in range(arrays)]
+
+    print('%8s %8s %10s %12s' % ('workers', 'tasks', 'seconds', 'tasks/s'))
+    for workers in workers_list:
+        executor = manager.SyncExecutor(workers, per_storage)
+        start = time.time()
+        for driver in drivers:
+            executor.submit(driver.storage_id, 2, driver.list_volumes, None)
+            executor.submit(driver.storage_id, 1,
+                            driver.list_storage_pools, None)
+            executor.submit(driver.storage_id, 0, driver.get_storage, None)
+        executor.wait()
+        cost = time.time() - start
+        print('%8d %8d %10.2f %12.1f' % (workers, arrays * 3, cost,
+                                         arrays * 3 / cost))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--arrays', type=int, default=1000)
+    parser.add_argument('--workers', default='16,64,256')
+    parser.add_argument('--per-storage', type=int, default=2)
+    args = parser.parse_args()
+    run(args.arrays, [int(w) for w in args.workers.split(',')],
+        args.per_storage)
@@ -0,0 +1,154 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the VMAX client volume listing with a fake Unisphere.
+
+Usage::
+
+    python -m delfin.tests.benchmark.bench_vmax_list_volumes \\
+        [--volumes 2000] [--latency 0.05] [--workers 1,4,16,64] \\
+        [--concurrency-max 16] [--bulk] [--page-size 1000]
+
+A local HTTP server answers the Unisphere requests of the listing after
+waiting for --latency seconds, like a loaded array would. For every number
+of workers, the volumes are listed with a VMAX client and the number of
+volumes listed per second is printed. All the volumes are in the same
+storage group, so each volume needs a request and throughput should scale
+with the number of workers until the requests in flight reach
+--concurrency-max. With --bulk, the list query answers with the details of
+the volumes, in pages of --page-size volumes, and no volume needs its own
+request.
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import re  # noqa: E402
+import time  # noqa: E402
+from http import server  # noqa: E402
+from socketserver import ThreadingMixIn  # noqa: E402
+from urllib import parse  # noqa: E402
+
+from delfin.common import config  # noqa
+from delfin.drivers.dell_emc.vmax import client  # noqa: E402
+
+CONF = config.CONF
+
+ARRAY_ID = '000000000001'
+_VOLUME_URI = re.compile(r'/volume/(\w+)$')
+
+
+class FakeUnisphere(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and body of an answer together
+    wbufsize = -1
+    volumes = 0
+    latency = 0
+    bulk = False
+    page_size = 1000
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        path = self.path.split('?')[0]
+        query = parse.parse_qs(parse.urlsplit(self.path).query)
+        match = _VOLUME_URI.search(path)
+        if path.endswith('/volume'):
+            results = self._results(0, self.page_size)
+            body = {'id': 'iterator', 'count': self.volumes,
+                    'maxPageSize': self.page_size,
+                    'resultList': {'result': results}}
+        elif path.endswith('/Iterator/iterator/page'):
+            body = {'result': self._results(int(query['from'][0]) - 1,
+                                            int(query['to'][0]))}
+        elif match:
+            body = self._volume(match.group(1))
+        elif '/storagegroup/' in path:
+            body = {'srp': 'SRP_1', 'compression': False}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _volume(self, volume_id):
+        return {'volumeId': volume_id, 'cap_mb': 1024,
+                'allocated_percent': 10, 'status': 'Ready', 'type': 'TDEV',
+                'wwn': 'wwn' + volume_id, 'num_of_storage_groups': 1,
+                'storageGroupId': ['sg']}
+
+    def _results(self, start, end):
+        ids = ['%05X' % i for i in range(start, min(end, self.volumes))]
+        if self.bulk:
+            return [self._volume(i) for i in ids]
+        return [{'volumeId': i} for i in ids]
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, server.HTTPServer):
+    daemon_threads = True
+
+
+def run(volumes, latency, workers_list, concurrency_max, bulk, page_size):
+    FakeUnisphere.volumes = volumes
+    FakeUnisphere.latency = latency
+    FakeUnisphere.bulk = bulk
+    FakeUnisphere.page_size = page_size
+    httpd = ThreadingServer(('127.0.0.1', 0), FakeUnisphere)
+    eventlet.spawn_n(httpd.serve_forever)
+    host, port = httpd.server_address
+    CONF.set_override('backend_concurrency_initial', concurrency_max)
+    CONF.set_override('backend_concurrency_max', concurrency_max)
+
+    print('%8s %8s %10s %12s' % ('workers', 'volumes', 'seconds',
+                                 'volumes/s'))
+    for workers in workers_list:
+        CONF.set_override('volume_detail_workers', workers, 'vmax_driver')
+        vmax = client.VMAXClient()
+        vmax.init_connection({'host': host, 'port': port,
+                              'username': 'user', 'password': 'password',
+                              'extra_attributes': {'array_id': ARRAY_ID}})
+        # The fake Unisphere is served over HTTP
+        rest_client = vmax.conn.rest_client
+        rest_client.base_url = rest_client.base_url.replace('https://',
+                                                            'http://')
+        rest_client.session.mount('http://', rest_client.session.adapters[
+            'https://'])
+        start = time.time()
+        listed = vmax.list_volumes('storage')
+        cost = time.time() - start
+        print('%8d %8d %10.2f %12.1f' % (workers, len(listed), cost,
+                                         len(listed) / cost))
+    httpd.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--volumes', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', default='1,4,16,64')
+    parser.add_argument('--concurrency-max', type=int, default=16)
+    parser.add_argument('--bulk', action='store_true')
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.volumes, args.latency,
+        [int(w) for w in args.workers.split(',')], args.concurrency_max,
+        args.bulk, args.page_size)
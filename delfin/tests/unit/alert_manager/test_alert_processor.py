@@ -0,0 +1,139 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from delfin import context
+from delfin import db
+from delfin import test
+from delfin.alert_manager import alert_processor
+from delfin.common import constants
+
+
+def _alert_model(component_type, component_name):
+    return {'alarm_id': '1050',
+            'location': 'Component type: ' + component_type +
+                        ',Component name: ' + component_name}
+
+
+class TestAlertResync(test.TestCase):
+
+    def setUp(self):
+        super(TestAlertResync, self).setUp()
+        self.context = context.get_admin_context()
+        self.storage = db.storage_create(self.context, {'name': 'storage'})
+        db.storage_pools_create(self.context, [
+            {'storage_id': self.storage['id'], 'original_id': 'pool_%d' % i}
+            for i in range(2)])
+        db.volumes_create(self.context, [
+            {'storage_id': self.storage['id'], 'original_id': 'vol_%d' % i,
+             'original_pool_id': 'pool_%d' % i} for i in range(2)])
+        self.resync = alert_processor.AlertResync()
+        self.resync._task_rpcapi = mock.Mock()
+        self.mock_timer = self.mock_object(alert_processor.threading,
+                                           'Timer')
+
+    @mock.patch('delfin.drivers.api.API.parse_alert')
+    def test_process_alert_info(self, mock_parse_alert):
+        mock_parse_alert.return_value = _alert_model('Device', 'vol_0')
+        mock_add = self.mock_object(alert_processor.ALERT_RESYNC, 'add')
+
+        alert_processor.AlertProcessor().process_alert_info(
+            {'storage_id': self.storage['id']})
+
+        mock_add.assert_called_once_with(mock.ANY, self.storage['id'],
+                                         mock_parse_alert.return_value)
+
+    def test_resync_is_debounced(self):
+        for name in ('vol_0', 'vol_1', 'vol_0'):
+            self.resync.add(self.context, self.storage['id'],
+                            _alert_model('Device', name))
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Fan', 'fan_0'))
+
+        self.assertEqual(1, self.mock_timer.call_count)
+        self.mock_timer.assert_called_once_with(30, self.resync._resync,
+                                                mock.ANY)
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+
+        self.resync.task_rpcapi.sync_storage_resource.assert_called_once_with(
+            self.context, self.storage['id'],
+            'delfin.task_manager.tasks.task.StorageVolumeTask',
+            original_pool_ids=['pool_0', 'pool_1'])
+        self.assertEqual(0b100, db.storage_get(
+            self.context, self.storage['id'])['sync_status'])
+
+    def test_resync_all_when_resource_is_unknown(self):
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Thin Device Data Pool', 'pool_1'))
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Thin Device Data Pool', 'unknown'))
+
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+
+        self.resync.task_rpcapi.sync_storage_resource.assert_called_once_with(
+            self.context, self.storage['id'],
+            'delfin.task_manager.tasks.task.StoragePoolTask',
+            original_pool_ids=None)
+
+    def test_resync_is_retried_while_syncing(self):
+        db.storage_update_sync_status(
+            self.context, self.storage['id'], 0b001,
+            constants.SyncStatus.SYNCING)
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Symmetrix', 'array'))
+
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+        self.assertFalse(self.resync.task_rpcapi.sync_storage_resource.called)
+        self.assertEqual(2, self.mock_timer.call_count)
+
+        db.storage_delete(self.context, self.storage['id'])
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+        self.assertFalse(self.resync.task_rpcapi.sync_storage_resource.called)
+        self.assertEqual({}, self.resync._pending)
+
+    def test_resync_is_retried_when_not_sent(self):
+        sync = self.resync.task_rpcapi.sync_storage_resource
+        sync.side_effect = Exception('failed')
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Device', 'vol_0'))
+
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+
+        # The resource is not left syncing, and its pools are resynced later
+        self.assertEqual(0, db.storage_get(
+            self.context, self.storage['id'])['sync_status'])
+        self.assertEqual(2, self.mock_timer.call_count)
+        sync.side_effect = None
+        self.resync._resync(*self.mock_timer.call_args[0][2])
+        sync.assert_called_with(
+            self.context, self.storage['id'],
+            'delfin.task_manager.tasks.task.StorageVolumeTask',
+            original_pool_ids=['pool_0'])
+        self.assertEqual({}, self.resync._pending)
+
+    def test_resync_is_given_up(self):
+        self.override_config('alert_resync_max_attempts', 3)
+        db.storage_update_sync_status(
+            self.context, self.storage['id'], 0b001,
+            constants.SyncStatus.SYNCING)
+        self.resync.add(self.context, self.storage['id'],
+                        _alert_model('Symmetrix', 'array'))
+
+        for _ in range(3):
+            self.resync._resync(*self.mock_timer.call_args[0][2])
+
+        self.assertEqual(3, self.mock_timer.call_count)
+        self.assertFalse(self.resync.task_rpcapi.sync_storage_resource.called)
+        self.assertEqual({}, self.resync._pending)
@@ -16,6 +16,7 @@ from unittest import mock
 
 from delfin.common import constants
 
+from delfin import context
 from delfin import db
 from delfin import exception
 from delfin import test
@@ -267,3 +268,46 @@ class TestStorageController(test.TestCase):
         self.assertRaises(exception.StorageAlreadyExists,
                           self.controller.create,
                           req, body=body)
+
+    def test_sync_selected_resources(self):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1'})
+        pool = db.storage_pool_create(ctxt, {'storage_id': storage['id'],
+                                             'original_id': 'pool_1'})
+        req = fakes.HTTPRequest.blank('/storages/%s/sync' % storage['id'])
+
+        self.controller.sync(req, storage['id'], body={
+            'resource_types': ['storage_volume'],
+            'storage_pool_ids': [pool['id']]})
+
+        self.task_rpcapi.sync_storage_resource.assert_called_once_with(
+            req.environ['delfin.context'], storage['id'],
+            'delfin.task_manager.tasks.task.StorageVolumeTask',
+            original_pool_ids=['pool_1'])
+        self.assertEqual(0b100, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+
+        # The volumes are still syncing, but the storage can be synced
+        self.assertRaises(exception.InvalidInput, self.controller.sync,
+                          req, storage['id'],
+                          body={'resource_types': ['storage_volume']})
+        self.task_rpcapi.reset_mock()
+        self.controller.sync(req, storage['id'], body={
+            'resource_types': ['storage_device']})
+        self.assertEqual(0b101, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+
+        # Only the pools and volumes are synced for pools by default
+        db.storage_update_sync_status(ctxt, storage['id'], 0b111,
+                                      constants.SyncStatus.SYNCED)
+        self.task_rpcapi.reset_mock()
+        self.controller.sync(req, storage['id'], body={
+            'storage_pool_ids': [pool['id']]})
+        self.assertEqual(['StoragePoolTask', 'StorageVolumeTask'], sorted(
+            c[0][2].rsplit('.', 1)[1] for c in
+            self.task_rpcapi.sync_storage_resource.call_args_list))
+
+        other = db.storage_create(ctxt, {'name': 'storage_2'})
+        self.assertRaises(exception.InvalidInput, self.controller.sync,
+                          req, other['id'],
+                          body={'storage_pool_ids': [pool['id']]})
@@ -0,0 +1,57 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from delfin import context
+from delfin import db
+from delfin import exception
+from delfin import test
+from delfin.api.v1.sync_jobs import SyncJobController
+from delfin.common import constants
+from delfin.tests.unit.api import fakes
+
+
+class TestSyncJobController(test.TestCase):
+
+    def setUp(self):
+        super(TestSyncJobController, self).setUp()
+        self.controller = SyncJobController()
+
+    def test_index(self):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1'})
+        for resource_type in ('storage_pool', 'storage_volume'):
+            db.sync_job_create(ctxt, {
+                'storage_id': storage['id'], 'resource_type': resource_type,
+                'status': constants.SyncJobStatus.SUCCEEDED})
+        db.sync_job_create(ctxt, {'storage_id': 'other_storage',
+                                  'resource_type': 'storage_pool'})
+
+        req = fakes.HTTPRequest.blank(
+            '/storages/%s/sync-jobs?resource_type=storage_volume'
+            % storage['id'])
+        res_dict = self.controller.index(req, storage['id'])
+
+        sync_job, = res_dict['sync_jobs']
+        self.assertEqual(storage['id'], sync_job['storage_id'])
+        self.assertEqual('storage_volume', sync_job['resource_type'])
+
+        req = fakes.HTTPRequest.blank('/storages/%s/sync-jobs'
+                                      % storage['id'])
+        res_dict = self.controller.index(req, storage['id'])
+        self.assertEqual(2, len(res_dict['sync_jobs']))
+
+    def test_index_with_invalid_id(self):
+        req = fakes.HTTPRequest.blank('/storages/fake_id/sync-jobs')
+        self.assertRaises(exception.StorageNotFound,
+                          self.controller.index, req, 'fake_id')
@@ -1,7 +1,14 @@
+import datetime
+import re
 from unittest import mock
 
+from oslo_utils import timeutils
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+
 from delfin import context, exception
 from delfin import test
+from delfin.common import constants
 from delfin.db import api as db_api
 from delfin.db.sqlalchemy import api, models
 
@@ -285,3 +292,334 @@ class TestSIMDBAPI(test.TestCase):
             = fake_alert_source
         result = db_api.alert_source_create(ctxt, fake_alert_source)
         assert len(result) == 0
+
+    def test_volumes_create_in_chunks(self):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        volumes = [{'storage_id': 'fake_storage', 'original_id': str(i),
+                    'name': 'vol_%d' % i} for i in range(5)]
+        volumes[4]['compressed'] = True
+
+        result = db_api.volumes_create(ctxt, volumes)
+
+        self.assertEqual(5, len(result))
+        db_volumes = db_api.volume_get_all(
+            ctxt, filters={'storage_id': 'fake_storage'})
+        self.assertEqual(sorted(v['id'] for v in volumes),
+                         sorted(v['id'] for v in db_volumes))
+        for volume in db_volumes:
+            self.assertIsNotNone(volume['created_at'])
+
+    def test_volume_iter_fingerprints(self):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        volumes = db_api.volumes_create(
+            ctxt, [{'storage_id': 'fake_storage', 'original_id': str(i),
+                    'name': 'vol_%d' % i} for i in range(5)])
+        db_api.volumes_create(ctxt, [{'storage_id': 'other_storage',
+                                      'original_id': '0'}])
+
+        fingerprints = db_api.volume_iter_fingerprints(ctxt, 'fake_storage')
+        first = next(fingerprints)
+        # Volumes are loaded chunk by chunk, and may be deleted between
+        db_api.volumes_delete(ctxt, [first['id']])
+        fingerprints = [first] + list(fingerprints)
+
+        self.assertEqual(sorted(v['id'] for v in volumes),
+                         [f['id'] for f in fingerprints])
+
+    @mock.patch.object(api, 'LOG')
+    def test_volumes_update_and_delete_in_chunks(self, mock_log):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        volumes = db_api.volumes_create(
+            ctxt, [{'storage_id': 'fake_storage', 'original_id': str(i),
+                    'name': 'vol_%d' % i} for i in range(5)])
+
+        updates = [{'id': v['id'], 'name': 'new_' + v['original_id']}
+                   for v in volumes]
+        updates[0]['status'] = 'error'
+        updates.append({'id': 'not_exist', 'name': 'fake'})
+        db_api.volumes_update(ctxt, updates)
+        mock_log.error.assert_called_once_with(
+            '1 of 6 volumes could not be found to update.')
+
+        db_volumes = db_api.volume_get_all(
+            ctxt, filters={'storage_id': 'fake_storage'})
+        self.assertEqual(['new_%d' % i for i in range(5)],
+                         sorted(v['name'] for v in db_volumes))
+        for volume in db_volumes:
+            self.assertIsNotNone(volume['updated_at'])
+
+        mock_log.reset_mock()
+        db_api.volumes_delete(ctxt, [v['id'] for v in volumes[:3]] +
+                              ['not_exist'])
+        mock_log.error.assert_called_once_with(
+            '1 of 4 volumes could not be found to delete.')
+        db_volumes = db_api.volume_get_all(
+            ctxt, filters={'storage_id': 'fake_storage'})
+        self.assertEqual(['3', '4'],
+                         sorted(v['original_id'] for v in db_volumes))
+
+    def test_volumes_upsert(self):
+        db_api.volumes_upsert(
+            ctxt, [{'storage_id': 'fake_storage', 'original_id': str(i),
+                    'name': 'vol_%d' % i, 'fingerprint': str(i)}
+                   for i in range(3)])
+        ids = {v['original_id']: v['id'] for v in db_api.volume_get_all(
+            ctxt, filters={'storage_id': 'fake_storage'})}
+
+        db_api.volumes_upsert(
+            ctxt, [{'storage_id': 'fake_storage', 'original_id': '1',
+                    'name': 'changed', 'fingerprint': 'changed'},
+                   {'storage_id': 'fake_storage', 'original_id': '3',
+                    'name': 'vol_3', 'fingerprint': '3'}])
+
+        db_volumes = db_api.volume_get_all(
+            ctxt, filters={'storage_id': 'fake_storage'})
+        self.assertEqual({'0': 'vol_0', '1': 'changed', '2': 'vol_2',
+                          '3': 'vol_3'},
+                         {v['original_id']: v['name'] for v in db_volumes})
+        for volume in db_volumes:
+            if volume['original_id'] in ids:
+                self.assertEqual(ids[volume['original_id']], volume['id'])
+
+    def test_upsert_statement_mysql(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        statement = api._upsert_statement(
+            models.Volume.__table__, 'mysql',
+            ('created_at', 'fingerprint', 'id', 'name', 'original_id',
+             'storage_id'))
+
+        compiled = statement.compile(dialect=mysql.dialect())
+
+        sql = str(compiled)
+        self.assertIn('ON DUPLICATE KEY UPDATE updated_at = '
+                      'IF(volumes.fingerprint <=> VALUES(fingerprint), '
+                      'volumes.updated_at, %s), name = VALUES(name), '
+                      'fingerprint = VALUES(fingerprint)', sql)
+        # Keys and creation time are never updated
+        update = sql.split('ON DUPLICATE KEY UPDATE')[1]
+        for key in ('created_at', 'storage_id', 'original_id', 'id ='):
+            self.assertNotIn(key, update)
+        self.assertIn(timeutils.utcnow(), compiled.params.values())
+
+    def test_upsert_statement_postgresql(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        statement = api._upsert_statement(
+            models.Volume.__table__, 'postgresql',
+            ('created_at', 'fingerprint', 'id', 'name', 'original_id',
+             'storage_id'))
+
+        compiled = statement.compile(dialect=postgresql.dialect())
+
+        sql = str(compiled)
+        self.assertIn('ON CONFLICT (storage_id, original_id) DO UPDATE SET ',
+                      sql)
+        update = sql.split('DO UPDATE SET')[1]
+        self.assertIn('name = excluded.name', update)
+        self.assertIn('fingerprint = excluded.fingerprint', update)
+        self.assertIn('WHERE volumes.fingerprint IS DISTINCT FROM '
+                      'excluded.fingerprint', update)
+        for key in ('created_at', 'storage_id', 'original_id', 'id ='):
+            self.assertNotIn(key, update)
+        # updated_at is only set when the fingerprint changed
+        self.assertRegex(update, r'updated_at = %\((\w+)\)s')
+        param = re.search(r'updated_at = %\((\w+)\)s', update).group(1)
+        self.assertEqual(timeutils.utcnow(), compiled.params[param])
+
+    def test_upsert_statement_other_dialect(self):
+        self.assertIsNone(api._upsert_statement(
+            models.Volume.__table__, 'oracle', ('id', 'original_id')))
+
+    def test_volumes_reconcile(self):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        db_api.volumes_create(
+            ctxt, [{'storage_id': storage_id, 'original_id': str(i),
+                    'name': 'vol_%d' % i, 'fingerprint': str(i)}
+                   for i in range(3) for storage_id in ('s1', 's2')])
+        ids = {v['original_id']: v['id'] for v in db_api.volume_get_all(
+            ctxt, filters={'storage_id': 's1'})}
+
+        counts = db_api.volumes_reconcile(
+            ctxt, 's1',
+            iter([{'original_id': '0', 'name': 'vol_0', 'fingerprint': '0'},
+                  {'original_id': '1', 'name': 'changed',
+                   'fingerprint': 'changed'},
+                  {'original_id': '3', 'name': 'vol_3',
+                   'fingerprint': '3'}]))
+
+        self.assertEqual({'added': 1, 'updated': 1, 'unchanged': 1,
+                          'deleted': 1}, counts)
+        db_volumes = db_api.volume_get_all(ctxt, filters={'storage_id': 's1'})
+        self.assertEqual({'0': 'vol_0', '1': 'changed', '3': 'vol_3'},
+                         {v['original_id']: v['name'] for v in db_volumes})
+        for volume in db_volumes:
+            if volume['original_id'] in ids:
+                self.assertEqual(ids[volume['original_id']], volume['id'])
+        self.assertEqual(3, len(db_api.volume_get_all(
+            ctxt, filters={'storage_id': 's2'})))
+
+    def test_volumes_reconcile_transactions(self):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        engine = api.get_engine()
+        connections = []
+
+        def connect():
+            connection = engine.connect()
+            connections.append(connection)
+            return connection
+
+        def volumes():
+            for i in range(5):
+                # The driver is never queried within a transaction
+                self.assertFalse(connections[0].in_transaction())
+                yield {'original_id': str(i), 'fingerprint': str(i)}
+
+        with mock.patch.object(api, 'get_engine') as mock_get_engine:
+            mock_get_engine.return_value.connect.side_effect = connect
+            counts = db_api.volumes_reconcile(ctxt, 's1', volumes())
+
+        self.assertEqual(5, counts['added'])
+        self.assertTrue(connections[0].closed)
+        self.assertEqual(5, len(db_api.volume_get_all(
+            ctxt, filters={'storage_id': 's1'})))
+
+    def test_volume_generations(self):
+        storage = db_api.storage_create(ctxt, {'name': 'fake_storage'})
+        db_api.volumes_create(
+            ctxt, [{'storage_id': storage['id'], 'original_id': str(i),
+                    'generation': 1} for i in range(3)])
+        filters = {'storage_id': storage['id']}
+        self.assertEqual([], db_api.volume_get_all(ctxt, filters=filters))
+
+        self.assertFalse(db_api.storage_set_volume_generation(
+            ctxt, storage['id'], 2))
+        self.assertTrue(db_api.storage_set_volume_generation(
+            ctxt, storage['id'], 1))
+        self.assertEqual(3, len(db_api.volume_get_all(ctxt,
+                                                      filters=filters)))
+
+        db_api.volumes_create(ctxt, [{'storage_id': storage['id'],
+                                      'original_id': 'hidden',
+                                      'generation': 2}])
+        # Hidden volumes are not compared with the storage either
+        self.assertEqual(['0', '1', '2'], sorted(
+            v['original_id'] for v in db_api.volume_get_fingerprints(
+                ctxt, storage['id'])))
+        self.assertEqual(['0', '1', '2'], sorted(
+            v['original_id'] for v in db_api.volume_iter_fingerprints(
+                ctxt, storage['id'])))
+        hidden = db_api.volume_get_all(ctxt, filters={'original_id':
+                                                      'hidden'})
+        self.assertEqual([], hidden)
+        self.assertEqual(1, db_api.volume_delete_hidden_generations(
+            ctxt, storage['id']))
+        self.assertEqual(3, len(db_api.volume_get_all(ctxt,
+                                                      filters=filters)))
+
+    def test_storage_update_sync_status(self):
+        storage = db_api.storage_create(ctxt, {'name': 'fake_storage'})
+        self.assertTrue(db_api.storage_update_sync_status(
+            ctxt, storage['id'], 0b111, constants.SyncStatus.SYNCING,
+            expected=constants.SyncStatus.SYNCED))
+        self.assertFalse(db_api.storage_update_sync_status(
+            ctxt, storage['id'], 0b111, constants.SyncStatus.SYNCING,
+            expected=constants.SyncStatus.SYNCED))
+        self.assertTrue(db_api.storage_update_sync_status(
+            ctxt, storage['id'], 0b010, constants.SyncStatus.SYNCED))
+        self.assertEqual(0b101, db_api.storage_get(
+            ctxt, storage['id'])['sync_status'])
+
+        db_api.storage_delete(ctxt, storage['id'])
+        self.assertFalse(db_api.storage_update_sync_status(
+            ctxt, storage['id'], 0b001, constants.SyncStatus.SYNCED))
+
+    def test_storages_update_sync_status(self):
+        self.override_config('bulk_chunk_size', 2, group='database')
+        storages = [db_api.storage_create(ctxt, {'name': 'storage_%d' % i})
+                    for i in range(4)]
+        db_api.storage_update_sync_status(ctxt, storages[0]['id'], 0b100,
+                                          constants.SyncStatus.SYNCING)
+        db_api.storage_delete(ctxt, storages[1]['id'])
+
+        storage_ids = db_api.storages_update_sync_status(
+            ctxt, 0b111, constants.SyncStatus.SYNCING,
+            expected=constants.SyncStatus.SYNCED)
+
+        self.assertEqual(sorted([storages[2]['id'], storages[3]['id']]),
+                         sorted(storage_ids))
+        self.assertEqual([0b100, 0b111, 0b111],
+                         [db_api.storage_get(ctxt, storage['id'])
+                          ['sync_status'] for storage in
+                          (storages[0], storages[2], storages[3])])
+
+    def test_sync_jobs(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        now = timeutils.utcnow()
+        lease = datetime.timedelta(seconds=10)
+        sync_jobs = [db_api.sync_job_create(ctxt, {
+            'storage_id': 'storage_1', 'resource_type': 'storage_pool',
+            'status': status, 'host': host,
+            'lease_expires_at': now + lease})
+            for status, host in ((constants.SyncJobStatus.QUEUED, 'host_a'),
+                                 (constants.SyncJobStatus.RUNNING, 'host_b'),
+                                 (constants.SyncJobStatus.SUCCEEDED,
+                                  'host_b'))]
+        db_api.sync_job_update(ctxt, sync_jobs[1]['id'],
+                               {'counts': {'added': 1}})
+        self.assertEqual({'added': 1}, db_api.sync_job_get(
+            ctxt, sync_jobs[1]['id'])['counts'])
+        self.assertRaises(exception.SyncJobNotFound,
+                          db_api.sync_job_update, ctxt, 'fake_id', {})
+        self.assertEqual(3, len(db_api.sync_job_get_all(
+            ctxt, filters={'storage_id': 'storage_1'})))
+
+        timeutils.advance_time_seconds(20)
+        self.assertEqual(1, db_api.sync_jobs_renew(
+            ctxt, [sync_jobs[0]['id'], sync_jobs[2]['id']],
+            timeutils.utcnow() + lease))
+        expired = db_api.sync_jobs_expire(ctxt)
+
+        self.assertEqual([sync_jobs[1]['id']], [job['id'] for job in expired])
+        self.assertEqual([constants.SyncJobStatus.QUEUED,
+                          constants.SyncJobStatus.EXPIRED,
+                          constants.SyncJobStatus.SUCCEEDED],
+                         [db_api.sync_job_get(ctxt, job['id'])['status']
+                          for job in sync_jobs])
+        self.assertEqual([], db_api.sync_jobs_expire(ctxt))
+
+    def test_sync_job_claim(self):
+        sync_job = db_api.sync_job_create(ctxt, {
+            'storage_id': 'storage_1', 'resource_type': 'storage_pool',
+            'status': constants.SyncJobStatus.QUEUED, 'host': 'host_a'})
+        lease_expires_at = timeutils.utcnow()
+
+        self.assertTrue(db_api.sync_job_claim(ctxt, sync_job['id'], 'host_b',
+                                              lease_expires_at))
+        self.assertEqual('host_b',
+                         db_api.sync_job_get(ctxt, sync_job['id'])['host'])
+
+        db_api.sync_job_update(ctxt, sync_job['id'],
+                               {'status': constants.SyncJobStatus.EXPIRED})
+        self.assertFalse(db_api.sync_job_claim(ctxt, sync_job['id'],
+                                               'host_a', lease_expires_at))
+
+    def test_sync_jobs_purge(self):
+        now = timeutils.utcnow()
+        old = now - datetime.timedelta(days=10)
+        sync_jobs = [db_api.sync_job_create(ctxt, {
+            'storage_id': 'storage_1', 'resource_type': 'storage_pool',
+            'status': status, 'ended_at': ended_at})
+            for status, ended_at in (
+                (constants.SyncJobStatus.SUCCEEDED, old),
+                (constants.SyncJobStatus.EXPIRED, old),
+                (constants.SyncJobStatus.SUCCEEDED, now),
+                (constants.SyncJobStatus.RUNNING, None))]
+
+        self.assertEqual(2, db_api.sync_jobs_purge(
+            ctxt, now - datetime.timedelta(days=1)))
+
+        self.assertEqual(sorted([sync_jobs[2]['id'], sync_jobs[3]['id']]),
+                         sorted(job['id']
+                                for job in db_api.sync_job_get_all(ctxt)))
@@ -0,0 +1,214 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlalchemy
+
+import datetime
+
+from delfin import context
+from delfin import exception
+from delfin import test
+from delfin.common import constants
+from delfin.db import api as db_api
+from delfin.db.sqlalchemy import api
+from delfin.db.sqlalchemy import models
+
+ctxt = context.get_admin_context()
+
+
+class TestQueryPlan(test.TestCase):
+    """Check that the queries of the DB API are served by indexes.
+
+    Every DB API function which gets, updates or deletes rows by a filter
+    is checked, with each filter it is called with.
+    """
+
+    def setUp(self):
+        super(TestQueryPlan, self).setUp()
+        self.engine = api.get_engine()
+        self.statements = []
+        sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                                self._record)
+        self.addCleanup(sqlalchemy.event.remove, self.engine,
+                        'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if statement.startswith(('SELECT', 'UPDATE', 'DELETE')):
+            self.statements.append((statement, parameters))
+
+    def _assert_use_index(self, table, func, *args, **kwargs):
+        self.statements = []
+        try:
+            func(ctxt, *args, **kwargs)
+        except exception.NotFound:
+            pass
+        statements = [(statement, parameters)
+                      for statement, parameters in self.statements
+                      if 'FROM %s' % table in statement or
+                      statement.startswith('UPDATE %s' % table)]
+        self.assertTrue(statements)
+
+        sqlalchemy.event.remove(self.engine, 'before_cursor_execute',
+                                self._record)
+        try:
+            for statement, parameters in statements:
+                plan = [row[-1] for row in self.engine.execute(
+                    'EXPLAIN QUERY PLAN ' + statement, parameters)]
+                details = [detail for detail in plan
+                           if ' %s ' % table in detail + ' ']
+                self.assertTrue(details, plan)
+                for detail in details:
+                    self.assertIn('USING', detail,
+                                  '%s: %s' % (func.__name__, plan))
+        finally:
+            sqlalchemy.event.listen(self.engine, 'before_cursor_execute',
+                                    self._record)
+
+    def test_access_info_queries(self):
+        self._assert_use_index('access_info', db_api.access_info_get,
+                               'fake_storage')
+        self._assert_use_index('access_info', db_api.access_info_update,
+                               'fake_storage', {'host': '127.0.0.1'})
+        self._assert_use_index('access_info', db_api.access_info_delete,
+                               'fake_storage')
+
+    def test_storage_queries(self):
+        self._assert_use_index('storages', db_api.storage_get_all)
+        self._assert_use_index('storages', db_api.storage_get_all,
+                               filters={'serial_number': 'fake_sn'})
+        self._assert_use_index('storages', db_api.storage_get_all,
+                               marker='fake_storage', limit=1)
+        self._assert_use_index('storages', db_api.storage_get,
+                               'fake_storage')
+        self._assert_use_index('storages', db_api.storage_update,
+                               'fake_storage', {'name': 'fake_name'})
+        self._assert_use_index('storages', db_api.storage_delete,
+                               'fake_storage')
+        self._assert_use_index('storages', db_api.storage_update_sync_status,
+                               'fake_storage', 0b001,
+                               constants.SyncStatus.SYNCING,
+                               expected=constants.SyncStatus.SYNCED)
+        self._assert_use_index('storages',
+                               db_api.storage_set_volume_generation,
+                               'fake_storage', 1)
+
+    def test_volume_queries(self):
+        self._assert_use_index('volumes', db_api.volume_get_all,
+                               filters={'storage_id': 'fake_storage'})
+        self._assert_use_index('volumes', db_api.volume_get_all,
+                               filters={'wwn': 'fake_wwn'})
+        self._assert_use_index('volumes', db_api.volume_get_all, limit=1,
+                               filters={'storage_id': 'fake_storage',
+                                        'original_id': 'vol_1'})
+        self._assert_use_index('volumes', db_api.volume_get, 'fake_volume')
+        self._assert_use_index('volumes', db_api.volume_get_fingerprints,
+                               'fake_storage')
+        self._assert_use_index('volumes', db_api.volume_get_fingerprints,
+                               'fake_storage', ['vol_1', 'vol_2'])
+        self._assert_use_index('volumes', db_api.volume_get_fingerprints,
+                               'fake_storage',
+                               original_pool_ids=['pool_1'])
+        self._assert_use_index(
+            'volumes', lambda *args: list(
+                db_api.volume_iter_fingerprints(*args)), 'fake_storage')
+        self._assert_use_index('volumes', db_api.volumes_delete,
+                               ['fake_volume'])
+        self._assert_use_index('volumes', db_api.volume_update,
+                               'fake_volume', {'name': 'fake_name'})
+        self._assert_use_index('volumes', db_api.volume_delete_by_storage,
+                               'fake_storage')
+        self._assert_use_index('volumes',
+                               db_api.volume_delete_hidden_generations,
+                               'fake_storage')
+
+    def test_storage_pool_queries(self):
+        self._assert_use_index('storage_pools', db_api.storage_pool_get_all,
+                               filters={'storage_id': 'fake_storage'})
+        self._assert_use_index('storage_pools', db_api.storage_pool_get,
+                               'fake_pool')
+        self._assert_use_index('storage_pools',
+                               db_api.storage_pool_get_fingerprints,
+                               'fake_storage')
+        self._assert_use_index('storage_pools',
+                               db_api.storage_pool_get_fingerprints,
+                               'fake_storage', ['pool_1'])
+        self._assert_use_index('storage_pools', db_api.storage_pools_delete,
+                               ['fake_pool'])
+        self._assert_use_index('storage_pools',
+                               db_api.storage_pool_update, 'fake_pool',
+                               {'name': 'fake_name'})
+        self._assert_use_index('storage_pools',
+                               db_api.storage_pool_delete_by_storage,
+                               'fake_storage')
+
+    def test_alert_source_queries(self):
+        self._assert_use_index('alert_source', db_api.alert_source_get_all,
+                               filters={'host': '127.0.0.1'})
+        self._assert_use_index('alert_source', db_api.alert_source_get,
+                               'fake_storage')
+        self._assert_use_index('alert_source', db_api.alert_source_update,
+                               'fake_storage', {'host': '127.0.0.1'})
+        self._assert_use_index('alert_source', db_api.alert_source_delete,
+                               'fake_storage')
+
+    def test_sync_job_queries(self):
+        now = datetime.datetime(2020, 1, 1)
+        self._assert_use_index('sync_jobs', db_api.sync_job_get_all,
+                               filters={'storage_id': 'fake_storage'})
+        self._assert_use_index('sync_jobs', db_api.sync_job_get_all, limit=1,
+                               filters={'storage_id': 'fake_storage',
+                                        'resource_type': 'storage_volume',
+                                        'status': 'succeeded',
+                                        'scoped': False})
+        self._assert_use_index('sync_jobs', db_api.sync_job_get,
+                               'fake_sync_job')
+        self._assert_use_index('sync_jobs', db_api.sync_job_update,
+                               'fake_sync_job', {'status': 'running'})
+        self._assert_use_index('sync_jobs', db_api.sync_job_claim,
+                               'fake_sync_job', 'host', now)
+        self._assert_use_index('sync_jobs', db_api.sync_jobs_get_succeeded,
+                               'fake_storage', 'storage_volume', now)
+        self._assert_use_index('sync_jobs', db_api.sync_jobs_renew,
+                               ['fake_sync_job'], now)
+        self._assert_use_index('sync_jobs', db_api.sync_jobs_expire)
+        self._assert_use_index('sync_jobs', db_api.sync_jobs_purge, now)
+
+
+class TestUpgradeSchema(test.TestCase):
+
+    def test_upgrade_schema(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        engine.execute('CREATE TABLE volumes (id VARCHAR(36) PRIMARY KEY, '
+                       'storage_id VARCHAR(36), original_id VARCHAR(255))')
+        engine.execute("INSERT INTO volumes VALUES ('1', 's', 'a'), "
+                       "('2', 's', 'a'), ('3', 's', 'b')")
+        metadata = sqlalchemy.MetaData()
+        models.Volume.__table__.tometadata(metadata)
+
+        api._upgrade_schema(engine, metadata)
+
+        inspector = sqlalchemy.inspect(engine)
+        columns = [c['name'] for c in inspector.get_columns('volumes')]
+        self.assertIn('fingerprint', columns)
+        self.assertIn('wwn', columns)
+        indexes = [i['name'] for i in inspector.get_indexes('volumes')]
+        self.assertIn('volumes_wwn_idx', indexes)
+        self.assertIn('uniq_volumes0storage_id0original_id', indexes)
+        self.assertEqual(
+            [('1',), ('3',)],
+            engine.execute('SELECT id FROM volumes ORDER BY id').fetchall())
+
+        # Upgrading an up to date schema does nothing
+        api._upgrade_schema(engine, metadata)
@@ -0,0 +1,230 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import mock
+
+import PyU4V
+
+from delfin import exception
+from delfin import test
+from delfin.common import constants
+from delfin.drivers.dell_emc.vmax import client
+
+VOLUME = {
+    'volumeId': '00001',
+    'cap_mb': 100,
+    'allocated_percent': 25,
+    'status': 'Ready',
+    'type': 'TDEV',
+    'wwn': 'wwn',
+    'num_of_storage_groups': 1,
+    'storageGroupId': ['sg'],
+}
+
+
+class TestLookupCache(test.TestCase):
+
+    def test_get(self):
+        get = mock.Mock(side_effect=lambda key: key.upper())
+        cache = client.LookupCache(get)
+
+        self.assertEqual('A', cache.get('a'))
+        self.assertEqual('A', cache.get('a'))
+        self.assertEqual('B', cache.get('b'))
+        self.assertEqual([mock.call('a'), mock.call('b')],
+                         get.call_args_list)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    def test_get_failure(self):
+        get = mock.Mock(side_effect=exception.StorageBackendException('down'))
+        cache = client.LookupCache(get)
+
+        self.assertRaises(exception.StorageBackendException, cache.get, 'a')
+        self.assertRaises(exception.StorageBackendException, cache.get, 'a')
+        get.assert_called_once_with('a')
+
+    def test_get_concurrently(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def get(key):
+            started.set()
+            release.wait(5)
+            return key.upper()
+        cache = client.LookupCache(mock.Mock(side_effect=get))
+        results = []
+
+        def lookup():
+            results.append(cache.get('a'))
+        owner = threading.Thread(target=lookup)
+        owner.start()
+        started.wait(5)
+        waiter = threading.Thread(target=lookup)
+        waiter.start()
+        release.set()
+        owner.join(5)
+        waiter.join(5)
+
+        self.assertEqual(['A', 'A'], results)
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(1, cache.hits)
+
+
+class TestVMAXClient(test.TestCase):
+
+    def setUp(self):
+        super(TestVMAXClient, self).setUp()
+        self.client = client.VMAXClient()
+        self.client.conn = mock.Mock()
+        provisioning = self.client.conn.provisioning
+        provisioning.get_storage_group.return_value = {
+            'srp': 'SRP_1', 'compression': True}
+
+    def tearDown(self):
+        self.client.conn = None
+        super(TestVMAXClient, self).tearDown()
+
+    def _get_volume(self, volume):
+        return dict(VOLUME, volumeId=volume)
+
+    def _list(self, results, max_page_size=1000):
+        self.client.conn.provisioning.get_resource.return_value = {
+            'id': 'iterator',
+            'count': len(results),
+            'maxPageSize': max_page_size,
+            'resultList': {'result': results[:max_page_size]},
+        }
+
+        def get_page(iterator_id, start, end):
+            self.assertEqual('iterator', iterator_id)
+            return results[start - 1:end]
+        self.client.conn.common.get_iterator_page_list.side_effect = get_page
+
+    def test_list_volumes(self):
+        provisioning = self.client.conn.provisioning
+        self._list([{'volumeId': '00001'}, {'volumeId': '00002'}])
+        provisioning.get_volume.side_effect = self._get_volume
+
+        volumes = self.client.list_volumes('storage')
+
+        self.assertEqual(['00001', '00002'],
+                         [v['original_id'] for v in volumes])
+        self.assertEqual({
+            'name': '00001',
+            'storage_id': 'storage',
+            'description': "Dell EMC VMAX 'thin device' volume",
+            'status': constants.VolumeStatus.AVAILABLE,
+            'original_id': '00001',
+            'wwn': 'wwn',
+            'provisioning_policy': constants.ProvisioningPolicy.THIN,
+            'total_capacity': 100 * 1024 * 1024,
+            'used_capacity': 25 * 1024 * 1024,
+            'free_capacity': 75 * 1024 * 1024,
+            'original_pool_id': 'SRP_1',
+            'compressed': True,
+        }, volumes[0])
+        # Both volumes are in the same storage group
+        provisioning.get_storage_group.assert_called_once_with('sg')
+
+    def test_list_volumes_concurrently(self):
+        self.override_config('volume_detail_workers', 4, 'vmax_driver')
+        provisioning = self.client.conn.provisioning
+        self._list([{'volumeId': '0000%d' % i} for i in range(8)])
+        barrier = threading.Barrier(4, timeout=5)
+
+        def get_volume(volume):
+            # Only passes when 4 volumes are got at the same time
+            barrier.wait()
+            return self._get_volume(volume)
+        provisioning.get_volume.side_effect = get_volume
+
+        volumes = self.client.list_volumes('storage')
+
+        self.assertEqual(['0000%d' % i for i in range(8)],
+                         [v['original_id'] for v in volumes])
+
+    def test_list_volumes_failures(self):
+        provisioning = self.client.conn.provisioning
+        self._list([{'volumeId': '00001'}, {'volumeId': '00002'},
+                    {'volumeId': '00003'}])
+
+        def get_volume(volume):
+            if volume == '00001':
+                raise exception.StorageBackendException('failed')
+            if volume == '00003':
+                raise PyU4V.utils.exception.ResourceNotFoundException()
+            return self._get_volume(volume)
+        provisioning.get_volume.side_effect = get_volume
+
+        # The failed volume is listed as unknown, so that it is not taken
+        # as deleted, the volume not found anymore is deleted
+        volumes = self.client.list_volumes('storage')
+        self.assertEqual(['00002', '00001'],
+                         [v['original_id'] for v in volumes])
+        self.assertEqual({'storage_id': 'storage', 'original_id': '00001',
+                          'unknown': True}, volumes[1])
+        self.assertEqual(3, provisioning.get_volume.call_count)
+
+        # Nothing is known of the volumes when all of them failed
+        provisioning.get_volume.side_effect = self._get_volume
+        provisioning.get_storage_group.side_effect = \
+            exception.StorageBackendException('failed')
+        self.assertRaises(exception.StorageBackendException,
+                          self.client.list_volumes, 'storage')
+
+        provisioning.get_resource.side_effect = \
+            exception.StorageBackendException('failed')
+        self.assertRaises(exception.StorageBackendException,
+                          self.client.list_volumes, 'storage')
+
+    def test_list_no_volumes(self):
+        self._list([])
+        self.assertEqual([], self.client.list_volumes('storage'))
+
+    def test_iter_volumes(self):
+        provisioning = self.client.conn.provisioning
+        self._list([{'volumeId': '0000%d' % i} for i in range(7)],
+                   max_page_size=3)
+        provisioning.get_volume.side_effect = self._get_volume
+
+        pages = list(self.client.iter_volumes('storage', 2))
+
+        self.assertEqual([['00000', '00001'], ['00002'], ['00003', '00004'],
+                          ['00005', '00006']],
+                         [[v['original_id'] for v in page] for page in pages])
+        self.assertEqual(
+            [mock.call('iterator', 4, 5), mock.call('iterator', 6, 7)],
+            self.client.conn.common.get_iterator_page_list.call_args_list)
+
+        self.client.conn.common.get_iterator_page_list.side_effect = \
+            exception.StorageBackendException('failed')
+        self.assertRaises(exception.StorageBackendException, list,
+                          self.client.iter_volumes('storage', 2))
+
+    def test_iter_volumes_with_details(self):
+        provisioning = self.client.conn.provisioning
+        self._list([VOLUME, {'volumeId': '00002'},
+                    dict(VOLUME, volumeId='00003', num_of_storage_groups=0,
+                         storageGroupId=[])])
+        provisioning.get_volume.side_effect = self._get_volume
+
+        volumes = list(self.client.iter_volumes('storage'))[0]
+
+        # Only the volume without details is got
+        self.assertEqual(['00001', '00002', '00003'],
+                         [v['original_id'] for v in volumes])
+        provisioning.get_volume.assert_called_once_with('00002')
+        self.assertNotIn('original_pool_id', volumes[2])
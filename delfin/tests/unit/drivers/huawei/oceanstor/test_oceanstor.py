@@ -0,0 +1,108 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from delfin import test
+from delfin.drivers.huawei.oceanstor import oceanstor
+
+POOLS = [
+    {'ID': '0', 'NAME': 'pool_0', 'RUNNINGSTATUS': '27',
+     'USERTOTALCAPACITY': '100', 'USERCONSUMEDCAPACITY': '10',
+     'USERFREECAPACITY': '90'},
+    {'ID': '1', 'NAME': 'pool_1', 'RUNNINGSTATUS': '27',
+     'USERTOTALCAPACITY': '100', 'USERCONSUMEDCAPACITY': '10',
+     'USERFREECAPACITY': '90'},
+]
+
+
+def fake_volume(volume_id, pool_name):
+    return {'ID': volume_id, 'NAME': 'volume_' + volume_id,
+            'PARENTNAME': pool_name, 'ENABLECOMPRESSION': 'false',
+            'ENABLEDEDUP': 'false', 'RUNNINGSTATUS': '27', 'ALLOCTYPE': '1',
+            'SECTORSIZE': '512', 'CAPACITY': '100', 'ALLOCCAPACITY': '10',
+            'WWN': 'wwn_' + volume_id}
+
+
+class TestOceanStorDriver(test.TestCase):
+
+    def setUp(self):
+        super(TestOceanStorDriver, self).setUp()
+        self.mock_object(oceanstor.rest_client, 'RestClient')
+        self.driver = oceanstor.OceanStorDriver(storage_id='storage')
+        self.client = self.driver.client
+        self.client.get_all_pools.return_value = POOLS
+        volumes = [fake_volume('0', 'pool_1'), fake_volume('1', 'pool_0'),
+                   fake_volume('2', 'pool_1')]
+        self.client.get_all_volumes.return_value = volumes
+        self.client.iter_volumes.side_effect = lambda page_size: iter(
+            [volumes[:page_size], volumes[page_size:]])
+
+    def test_list_volumes(self):
+        volumes = self.driver.list_volumes(None)
+
+        self.assertEqual(['1', '0', '1'],
+                         [v['original_pool_id'] for v in volumes])
+
+    def test_pools_shared_with_volumes(self):
+        self.driver.list_storage_pools(None)
+        self.driver.list_volumes(None)
+        pages = list(self.driver.iter_volumes(None, 2))
+        self.assertEqual(['1', '0', '1'],
+                         [v['original_pool_id'] for page in pages
+                          for v in page])
+        self.client.get_all_pools.assert_called_once_with()
+
+        # Pools are always listed again by list_storage_pools
+        self.driver.list_storage_pools(None)
+        self.assertEqual(2, self.client.get_all_pools.call_count)
+
+    @mock.patch('time.monotonic')
+    def test_pools_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        self.driver.list_volumes(None)
+        mock_monotonic.return_value = 1000 + 299
+        self.driver.list_volumes(None)
+        self.client.get_all_pools.assert_called_once_with()
+
+        mock_monotonic.return_value = 1000 + 300
+        self.driver.list_volumes(None)
+        self.assertEqual(2, self.client.get_all_pools.call_count)
+
+    def test_pools_refreshed_on_miss(self):
+        self.driver.list_storage_pools(None)
+        # A pool was created since the pools were listed
+        self.client.get_all_pools.return_value = POOLS + [
+            {'ID': '2', 'NAME': 'pool_2'}]
+        self.client.get_all_volumes.return_value = [
+            fake_volume('0', 'pool_2'), fake_volume('1', 'unknown'),
+            fake_volume('2', 'other')]
+
+        volumes = self.driver.list_volumes(None)
+
+        self.assertEqual(['2', '', ''],
+                         [v['original_pool_id'] for v in volumes])
+        # Only once for the listing
+        self.assertEqual(2, self.client.get_all_pools.call_count)
+
+    def test_list_volumes_in_pools(self):
+        self.client.get_volumes_in_pool.side_effect = lambda pool_id: [
+            fake_volume('v' + pool_id, 'renamed')]
+
+        volumes = self.driver.list_volumes_in_pools(None, ['0', '1'])
+
+        self.assertEqual([('v0', '0'), ('v1', '1')],
+                         [(v['original_id'], v['original_pool_id'])
+                          for v in volumes])
+        self.assertFalse(self.client.get_all_pools.called)
@@ -0,0 +1,157 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import threading
+
+from delfin import exception
+from delfin import test
+from delfin.drivers.huawei.oceanstor import consts
+from delfin.drivers.huawei.oceanstor import rest_client
+
+_RANGE = re.compile(r'range=\[(\d+)-(\d+)\]')
+
+
+class TestRestClient(test.TestCase):
+
+    def setUp(self):
+        super(TestRestClient, self).setUp()
+        self.client = rest_client.RestClient(host='host', port='8088')
+        self.resources = [{'ID': str(i)} for i in range(10)]
+        self.urls = []
+        self.mock_object(self.client, 'call', self._call)
+
+    def _call(self, url, data=None, method=None, log_filter_flag=False):
+        self.urls.append(url)
+        if '/count' in url:
+            return {'error': {'code': 0},
+                    'data': {'COUNT': str(len(self.resources))}}
+        start, end = (int(i) for i in _RANGE.search(url).groups())
+        page = self.resources[start:end]
+        result = {'error': {'code': 0}}
+        if page:
+            result['data'] = page
+        return result
+
+    def test_paginated_iter(self):
+        pages = list(self.client.paginated_iter('/lun', page_size=3))
+
+        self.assertEqual(self.resources, sum(pages, []))
+        self.assertEqual(['/lun?range=[0-3]', '/lun?range=[3-6]',
+                          '/lun?range=[6-9]', '/lun?range=[9-12]'],
+                         self.urls)
+
+    def test_paginated_iter_in_window(self):
+        pages = list(self.client.paginated_iter(
+            '/lun?filter=PARENTID::0', page_size=3, window=2))
+
+        self.assertEqual([self.resources[0:3], self.resources[3:6],
+                          self.resources[6:9], self.resources[9:]], pages)
+        self.assertEqual('/lun/count?filter=PARENTID::0', self.urls[0])
+        self.assertEqual(5, len(self.urls))
+
+    def test_paginated_iter_in_window_full_last_page(self):
+        self.resources = self.resources[:9]
+        counted = len(self.resources)
+        call = self._call
+
+        def add_resource(url, *args, **kwargs):
+            # A resource is added after they were counted
+            if len(self.urls) == counted // 3 + 1:
+                self.resources.append({'ID': 'added'})
+            return call(url, *args, **kwargs)
+        self.client.call = add_resource
+
+        result = self.client.paginated_call('/lun', page_size=3, window=2)
+
+        self.assertEqual(self.resources, result)
+        self.assertEqual('/lun?range=[9-12]', self.urls[-1])
+
+    def test_paginated_iter_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        call = self._call
+
+        def wait_call(url, *args, **kwargs):
+            if '/count' not in url:
+                # Only passes when 2 pages are got at the same time
+                barrier.wait()
+            return call(url, *args, **kwargs)
+        self.client.call = wait_call
+        self.resources = self.resources[:5]
+
+        result = self.client.paginated_call('/lun', page_size=3, window=2)
+
+        self.assertEqual(self.resources, result)
+
+    def test_paginated_iter_error(self):
+        self.client.call = lambda *args, **kwargs: {
+            'error': {'code': 1, 'description': 'error'}}
+
+        self.assertRaises(exception.StorageBackendException,
+                          self.client.paginated_call, '/lun', window=2)
+
+
+class TestRestClientLogin(test.TestCase):
+
+    def setUp(self):
+        super(TestRestClientLogin, self).setUp()
+        self.client = rest_client.RestClient(host='host', port='8088')
+        self.client.url = 'https://host:8088/deviceManager/rest/device_0'
+        self.client.device_id = 'device_0'
+        self.token = 'expired'
+        self.logins = 0
+        self.mock_object(self.client, 'do_call', self._do_call)
+        self.mock_object(self.client, 'login', self._login)
+
+    def _do_call(self, url, data, method, log_filter_flag=False):
+        if self.token == 'expired':
+            return {'error': {'code': consts.ERROR_UNAUTHORIZED_TO_SERVER}}
+        return {'error': {'code': 0}, 'data': self.token}
+
+    def _login(self):
+        self.logins += 1
+        self.token = 'token_%d' % self.logins
+        self.client._logins += 1
+        return self.client.device_id
+
+    def test_call_logs_in_again(self):
+        result = self.client.call('/lun', method='GET')
+
+        self.assertEqual('token_1', result['data'])
+        self.assertEqual(1, self.logins)
+
+    def test_call_logs_in_once_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+        do_call = self._do_call
+
+        def wait_do_call(*args, **kwargs):
+            result = do_call(*args, **kwargs)
+            if result['error']['code']:
+                # All the requests fail before one of them logs in
+                barrier.wait()
+            return result
+        self.client.do_call = wait_do_call
+        results = []
+
+        def call():
+            results.append(self.client.call('/lun', method='GET'))
+        threads = [threading.Thread(target=call) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(['token_1'] * 4,
+                         [result['data'] for result in results])
+        self.assertEqual(1, self.logins)
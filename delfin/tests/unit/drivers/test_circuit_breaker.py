@@ -0,0 +1,97 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from oslo_utils import timeutils
+
+from delfin import context
+from delfin import db
+from delfin import exception
+from delfin import test
+from delfin.common import constants
+from delfin.drivers import circuit_breaker
+
+
+class TestCircuitBreaker(test.TestCase):
+
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        self.override_config('backend_failure_threshold', 2)
+        self.override_config('backend_retry_interval', 10)
+        self.override_config('backend_retry_interval_max', 15)
+        self.override_config('backend_retry_jitter', 0)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.context = context.get_admin_context()
+        self.storage = db.storage_create(self.context, {'name': 'storage'})
+        self.breaker = circuit_breaker.CircuitBreaker()
+
+    def _call(self, error=None):
+        with self.breaker.guard(self.context, self.storage['id']):
+            if error:
+                raise error
+
+    def _fail(self):
+        self.assertRaises(exception.StorageBackendException, self._call,
+                          exception.StorageBackendException('down'))
+
+    def _circuit(self):
+        storage = db.storage_get(self.context, self.storage['id'])
+        return (storage['circuit_state'], storage['circuit_failures'],
+                storage['circuit_retry_at'])
+
+    def test_open_after_failures(self):
+        self._call()
+        self.assertEqual((constants.CircuitState.CLOSED, 0, None),
+                         self._circuit())
+
+        self._fail()
+        # Not a failure of the backend
+        self.assertRaises(exception.StorageNotFound, self._call,
+                          exception.StorageNotFound('fake_id'))
+        self.assertEqual((constants.CircuitState.CLOSED, 1, None),
+                         self._circuit())
+        self._fail()
+        retry_at = timeutils.utcnow() + datetime.timedelta(seconds=10)
+        self.assertEqual((constants.CircuitState.OPEN, 2, retry_at),
+                         self._circuit())
+        self.assertRaises(exception.StorageBackendUnavailable, self._call)
+
+    def test_half_open_probe(self):
+        self._fail()
+        self._fail()
+
+        timeutils.advance_time_seconds(10)
+        # Only one call probes the backend
+        with self.breaker.guard(self.context, self.storage['id']):
+            self.assertRaises(exception.StorageBackendUnavailable,
+                              self._call)
+        self.assertEqual((constants.CircuitState.CLOSED, 0, None),
+                         self._circuit())
+
+        self._fail()
+        self._fail()
+        timeutils.advance_time_seconds(10)
+        self._fail()
+        # The retry interval doubles, up to its max
+        retry_at = timeutils.utcnow() + datetime.timedelta(seconds=15)
+        self.assertEqual((constants.CircuitState.OPEN, 3, retry_at),
+                         self._circuit())
+        timeutils.advance_time_seconds(14)
+        self.assertRaises(exception.StorageBackendUnavailable, self._call)
+        timeutils.advance_time_seconds(1)
+        self._call()
+        self.assertEqual((constants.CircuitState.CLOSED, 0, None),
+                         self._circuit())
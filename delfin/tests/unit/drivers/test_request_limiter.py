@@ -0,0 +1,113 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from unittest import mock
+
+import requests
+from requests import adapters
+
+from delfin import test
+from delfin.drivers import request_limiter
+
+
+class TestAIMDLimiter(test.TestCase):
+
+    def setUp(self):
+        super(TestAIMDLimiter, self).setUp()
+        self.override_config('backend_concurrency_initial', 2)
+        self.override_config('backend_concurrency_max', 3)
+        self.limiter = request_limiter.AIMDLimiter('array:8443')
+
+    def _request(self, ok=True):
+        with self.limiter.request() as request:
+            if not ok:
+                request.failed()
+
+    def test_additive_increase(self):
+        self._request()
+        self.assertEqual(2.5, self.limiter.limit)
+        for _ in range(10):
+            self._request()
+        self.assertEqual(3, self.limiter.limit)
+        self.assertEqual(0, self.limiter.error_rate)
+        self.assertIsNotNone(self.limiter.latency)
+
+    def test_multiplicative_decrease(self):
+        self._request(ok=False)
+        self.assertEqual(1, self.limiter.limit)
+        self._request(ok=False)
+        self.assertEqual(1, self.limiter.limit)
+        self.assertGreater(self.limiter.error_rate, 0)
+
+    def test_slow_requests_decrease(self):
+        self.override_config('backend_latency_threshold', 0)
+        self._request()
+        self.assertEqual(1, self.limiter.limit)
+        self.assertEqual(0, self.limiter.error_rate)
+
+    def test_decrease_once_for_requests_in_flight(self):
+        with self.limiter.request() as first:
+            with self.limiter.request() as second:
+                first.failed()
+                second.failed()
+        self.assertEqual(1, self.limiter.limit)
+
+    def test_exceptions_are_failures(self):
+        def request():
+            with self.limiter.request():
+                raise ValueError()
+
+        self.assertRaises(ValueError, request)
+        self.assertEqual(1, self.limiter.limit)
+        self.assertEqual(0, self.limiter.in_flight)
+
+    def test_requests_wait_for_the_limit(self):
+        self.override_config('backend_concurrency_initial', 1)
+        self.override_config('backend_concurrency_max', 1)
+        limiter = request_limiter.AIMDLimiter('array:8443')
+        in_flight = []
+
+        def request():
+            with limiter.request():
+                in_flight.append(limiter.in_flight)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=request) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1, 1, 1], in_flight)
+
+
+class TestLimitedHTTPAdapter(test.TestCase):
+
+    @mock.patch.object(adapters.HTTPAdapter, 'send')
+    def test_server_errors_are_failures(self, mock_send):
+        session = requests.Session()
+        request_limiter.limit_session(session, 'array', '8443')
+        limiter = request_limiter.get_limiter('array', '8443')
+        self.assertIs(limiter, session.get_adapter('https://array').limiter)
+
+        mock_send.return_value = mock.Mock(status_code=503)
+        with mock.patch.object(limiter, '_done') as mock_done:
+            session.get_adapter('https://array').send(mock.Mock())
+        self.assertFalse(mock_done.call_args[0][0].ok)
+
+        mock_send.return_value = mock.Mock(status_code=404)
+        with mock.patch.object(limiter, '_done') as mock_done:
+            session.get_adapter('https://array').send(mock.Mock())
+        self.assertTrue(mock_done.call_args[0][0].ok)
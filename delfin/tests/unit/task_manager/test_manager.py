@@ -0,0 +1,503 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import random
+import threading
+from unittest import mock
+
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from delfin import context
+from delfin import coordination
+from delfin import db
+from delfin import test
+from delfin.common import constants
+from delfin.drivers import manager as driver_manager
+from delfin.task_manager import manager
+from delfin.task_manager import rpcapi
+from delfin.task_manager.tasks import task
+
+CONF = cfg.CONF
+
+
+class TestSyncExecutor(test.TestCase):
+
+    def test_run_by_priority(self):
+        executor = manager.SyncExecutor(1, 1)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def block():
+            started.set()
+            release.wait()
+
+        executor.submit('storage_a', 0, block)
+        started.wait()
+        executor.submit('storage_b', 2, order.append, 'volumes')
+        executor.submit('storage_c', 1, order.append, 'pools')
+        executor.submit('storage_d', 0, order.append, 'device')
+        self.assertEqual(3, executor.queue_depth)
+        self.assertEqual(1, executor.in_flight)
+
+        release.set()
+        self.assertTrue(executor.wait(10))
+        self.assertEqual(['device', 'pools', 'volumes'], order)
+        self.assertEqual(0, executor.queue_depth)
+        self.assertEqual(0, executor.in_flight)
+
+    def test_limit_per_storage(self):
+        executor = manager.SyncExecutor(4, 1)
+        release = threading.Event()
+        done = []
+
+        def block(name):
+            release.wait()
+            done.append(name)
+
+        executor.submit('storage_a', 0, block, 'a1')
+        executor.submit('storage_a', 0, block, 'a2')
+        executor.submit('storage_b', 1, done.append, 'b')
+        executor.submit('storage_b', 1, lambda: 1 / 0)
+        executor.submit('storage_b', 1, done.append, 'b')
+
+        # The tasks of storage_b are not held back by storage_a
+        self.assertTrue(self._wait_for(lambda: done == ['b', 'b']))
+        self.assertEqual(1, executor.in_flight)
+        self.assertEqual(1, executor.queue_depth)
+
+        release.set()
+        self.assertTrue(executor.wait(10))
+        self.assertEqual(['b', 'b', 'a1', 'a2'], done)
+
+    @staticmethod
+    def _wait_for(predicate):
+        event = threading.Event()
+        for _ in range(100):
+            if predicate():
+                return True
+            event.wait(0.05)
+        return False
+
+
+class TestSyncScheduler(test.TestCase):
+
+    def setUp(self):
+        super(TestSyncScheduler, self).setUp()
+        self.override_config('sync_interval', 60)
+        self.override_config('sync_interval_jitter', 0)
+        self.mock_object(random, 'uniform',
+                         mock.Mock(side_effect=lambda a, b: (a + b) / 2))
+        self.context = context.get_admin_context()
+        self.task_rpcapi = mock.Mock()
+        self.scheduler = manager.SyncScheduler(self.task_rpcapi)
+
+    def _scheduled(self):
+        return sorted((c[0][1], c[0][2].rpartition('.')[2])
+                      for c in self.task_rpcapi.sync_storage_resource.
+                      call_args_list)
+
+    def test_schedule(self):
+        storage = db.storage_create(self.context, {'name': 'fake_storage'})
+        # The first syncs are spread over the interval
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.scheduler.schedule(self.context)
+        self.assertEqual([], self._scheduled())
+
+        timeutils.advance_time_seconds(30)
+        self.scheduler.schedule(self.context)
+        self.assertEqual([(storage['id'], 'StorageDeviceTask'),
+                          (storage['id'], 'StoragePoolTask'),
+                          (storage['id'], 'StorageVolumeTask')],
+                         self._scheduled())
+        self.assertEqual(0b111, db.storage_get(
+            self.context, storage['id'])['sync_status'])
+
+        # Only the syncs which are over are started again
+        db.storage_update_sync_status(self.context, storage['id'], 0b011,
+                                      constants.SyncStatus.SYNCED)
+        self.task_rpcapi.reset_mock()
+        timeutils.advance_time_seconds(59)
+        self.scheduler.schedule(self.context)
+        self.assertEqual([], self._scheduled())
+        timeutils.advance_time_seconds(1)
+        self.scheduler.schedule(self.context)
+        self.assertEqual([(storage['id'], 'StorageDeviceTask'),
+                          (storage['id'], 'StoragePoolTask')],
+                         self._scheduled())
+
+    def test_schedule_with_intervals(self):
+        storage_1 = db.storage_create(self.context, {'name': 'storage_1'})
+        storage_2 = db.storage_create(self.context, {'name': 'storage_2'})
+        self.override_config('sync_interval_per_resource',
+                             {'StorageVolumeTask': '0'})
+        self.override_config('sync_interval_per_storage',
+                             {storage_2['id']: '0'})
+
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.scheduler.schedule(self.context)
+        timeutils.advance_time_seconds(30)
+        self.scheduler.schedule(self.context)
+
+        self.assertEqual([(storage_1['id'], 'StorageDeviceTask'),
+                          (storage_1['id'], 'StoragePoolTask')],
+                         self._scheduled())
+
+    def test_adapt_interval(self):
+        storage = db.storage_create(self.context, {'name': 'fake_storage'})
+        task_cls = task.StorageVolumeTask
+        start = datetime.datetime(2020, 1, 1)
+
+        def sync_job(seconds, counts):
+            db.sync_job_create(self.context, {
+                'storage_id': storage['id'],
+                'resource_type': 'storage_volume',
+                'status': constants.SyncJobStatus.SUCCEEDED,
+                'started_at': start + datetime.timedelta(seconds=seconds),
+                'created_at': start + datetime.timedelta(seconds=seconds),
+                'counts': counts})
+
+        def adapt_interval():
+            return self.scheduler.adapt_interval(self.context, storage['id'],
+                                                 task_cls, 60)
+
+        # The interval is kept until a rate is known
+        self.assertEqual(60, adapt_interval())
+        sync_job(0, {'added': 1000, 'updated': 0, 'deleted': 0})
+        self.assertEqual(60, adapt_interval())
+
+        # 10 changes in 100 seconds, 100 changes in 1000 seconds
+        sync_job(100, {'added': 5, 'updated': 5, 'deleted': 0})
+        self.assertEqual(1000, adapt_interval())
+        self.assertEqual(1000, adapt_interval())
+
+        # Syncs which do not count changes are ignored
+        sync_job(200, {'upserted': 100})
+        self.assertEqual(1000, adapt_interval())
+        sync_job(300, {'upserted': 5000, 'deleted': 0})
+        self.assertEqual(1000, adapt_interval())
+
+        # 0 changes, the rate is weighted
+        sync_job(1100, {'added': 0, 'updated': 0, 'deleted': 0})
+        self.assertAlmostEqual(100 / 0.07, adapt_interval())
+
+        # The interval is bounded
+        sync_job(1200, {'added': 0, 'updated': 1000, 'deleted': 0})
+        self.assertEqual(300, adapt_interval())
+        self.scheduler._change_rates[(storage['id'], 'StorageVolumeTask')] \
+            = (0, None)
+        self.assertEqual(86400, adapt_interval())
+
+    def test_adapt_interval_counts_every_job(self):
+        storage = db.storage_create(self.context, {'name': 'fake_storage'})
+        start = datetime.datetime(2020, 1, 1)
+
+        def sync_job(seconds, changes, scoped=False):
+            db.sync_job_create(self.context, {
+                'storage_id': storage['id'],
+                'resource_type': 'storage_volume',
+                'status': constants.SyncJobStatus.SUCCEEDED,
+                'started_at': start + datetime.timedelta(seconds=seconds),
+                'created_at': start + datetime.timedelta(seconds=seconds),
+                'scoped': scoped,
+                'counts': {'added': changes, 'updated': 0, 'deleted': 0}})
+
+        def adapt_interval():
+            return self.scheduler.adapt_interval(
+                self.context, storage['id'], task.StorageVolumeTask, 60)
+
+        sync_job(0, 1000)
+        self.assertEqual(60, adapt_interval())
+        # A scoped job does not end the measure
+        sync_job(100, 10, scoped=True)
+        self.assertEqual(60, adapt_interval())
+
+        # The jobs run between two schedules are all counted: 40 changes
+        # in 400 seconds, 100 changes in 1000 seconds
+        sync_job(200, 10)
+        sync_job(300, 10, scoped=True)
+        sync_job(400, 10)
+        self.assertEqual(1000, adapt_interval())
+
+    @mock.patch.object(manager.SyncScheduler, 'schedule')
+    @mock.patch.object(coordination.LOCK_COORDINATOR, 'elect_leader')
+    def test_only_leader_schedules(self, mock_elect_leader, mock_schedule):
+        task_manager = manager.TaskManager()
+
+        mock_elect_leader.return_value = False
+        task_manager._schedule_sync(self.context)
+        self.assertFalse(mock_schedule.called)
+
+        mock_elect_leader.return_value = True
+        task_manager._schedule_sync(self.context)
+        mock_schedule.assert_called_once_with(self.context)
+
+
+class TestTaskManager(test.TestCase):
+
+    @mock.patch.object(rpcapi.TASK_HOSTS, 'get_node')
+    def test_release_drivers(self, mock_get_node):
+        task_manager = manager.TaskManager(host='host_a')
+        drivers = driver_manager.DriverManager()
+        self.mock_object(drivers, 'driver_factory',
+                         {'storage_1': mock.Mock(), 'storage_2': mock.Mock(),
+                          'storage_3': mock.Mock()})
+        mock_get_node.side_effect = {'storage_1': 'host_a',
+                                     'storage_2': 'host_b',
+                                     'storage_3': None}.get
+
+        task_manager._release_drivers(context.get_admin_context())
+
+        self.assertEqual(['storage_1', 'storage_3'],
+                         sorted(drivers.driver_factory))
+
+    @mock.patch.object(rpcapi.TASK_HOSTS, 'get_node')
+    def test_sync_is_sent_to_owner(self, mock_get_node):
+        task_api = rpcapi.TaskAPI()
+        self.mock_object(task_api, 'client')
+        ctxt = context.get_admin_context()
+        resource_task = 'delfin.task_manager.tasks.task.StoragePoolTask'
+
+        mock_get_node.return_value = 'host_b'
+        task_api.sync_storage_resource(ctxt, 'storage_1', resource_task)
+        task_api.client.prepare.assert_called_once_with(version='1.3',
+                                                        server='host_b')
+        # The job is queued before the sync is cast
+        sync_job, = db.sync_job_get_all(ctxt)
+        self.assertEqual('storage_pool', sync_job['resource_type'])
+        self.assertEqual('host_b', sync_job['host'])
+        self.assertEqual(constants.SyncJobStatus.QUEUED, sync_job['status'])
+        task_api.client.prepare.return_value.cast.assert_called_once_with(
+            ctxt, 'sync_storage_resource', storage_id='storage_1',
+            resource_task=resource_task, original_pool_ids=None,
+            sync_job_id=sync_job['id'])
+
+        task_api.client.reset_mock()
+        mock_get_node.return_value = None
+        task_api.sync_storage_resource(ctxt, 'storage_1', resource_task)
+        task_api.client.prepare.assert_called_once_with(version='1.3')
+
+    @mock.patch.object(rpcapi.TASK_HOSTS, 'get_node')
+    def test_sync_storages_are_batched_by_owner(self, mock_get_node):
+        task_api = rpcapi.TaskAPI()
+        self.mock_object(task_api, 'client')
+        ctxt = context.get_admin_context()
+        mock_get_node.side_effect = {'storage_1': 'host_a',
+                                     'storage_2': 'host_b',
+                                     'storage_3': 'host_a'}.get
+
+        task_api.sync_storages(ctxt, ['storage_1', 'storage_2', 'storage_3'])
+
+        self.assertEqual([mock.call(version='1.3', server='host_a'),
+                          mock.call(version='1.3', server='host_b')],
+                         task_api.client.prepare.call_args_list)
+        casts = task_api.client.prepare.return_value.cast.call_args_list
+        self.assertEqual([['storage_1', 'storage_3'], ['storage_2']],
+                         [c[1]['storage_ids'] for c in casts])
+        sync_job_ids = casts[1][1]['sync_job_ids']['storage_2']
+        self.assertEqual({'storage_device', 'storage_pool',
+                          'storage_volume'}, set(sync_job_ids))
+        sync_job = db.sync_job_get(ctxt, sync_job_ids['storage_volume'])
+        self.assertEqual('host_b', sync_job['host'])
+
+    @mock.patch.object(manager.SyncExecutor, 'submit')
+    @mock.patch.object(rpcapi.TASK_HOSTS, 'get_node')
+    def test_sync_not_consumed(self, mock_get_node, mock_submit):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1',
+                                           'sync_status': 0b010})
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        task_api = rpcapi.TaskAPI()
+        self.mock_object(task_api, 'client')
+        # The owner died, the sync is never consumed
+        mock_get_node.return_value = 'dead_host'
+        task_api.sync_storage_resource(
+            ctxt, storage['id'],
+            'delfin.task_manager.tasks.task.StoragePoolTask')
+        sync_job_id = task_api.client.prepare.return_value.cast \
+            .call_args[1]['sync_job_id']
+        task_manager = manager.TaskManager(host='host_a')
+
+        timeutils.advance_time_seconds(CONF.sync_job_lease + 1)
+        task_manager._check_sync_jobs(ctxt)
+
+        self.assertEqual(constants.SyncJobStatus.EXPIRED,
+                         db.sync_job_get(ctxt, sync_job_id)['status'])
+        self.assertEqual(0, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+
+        # A late message of the expired job is not run
+        task_manager.sync_storage_resource(
+            ctxt, storage['id'],
+            'delfin.task_manager.tasks.task.StoragePoolTask',
+            sync_job_id=sync_job_id)
+        self.assertFalse(mock_submit.called)
+
+    @mock.patch.object(manager.SyncExecutor, 'submit')
+    def test_sync_job_is_claimed(self, mock_submit):
+        ctxt = context.get_admin_context()
+        sync_job = db.sync_job_create(ctxt, {
+            'storage_id': 'storage_1', 'resource_type': 'storage_pool',
+            'status': constants.SyncJobStatus.QUEUED, 'host': None})
+        task_manager = manager.TaskManager(host='host_a')
+
+        task_manager.sync_storages(
+            ctxt, ['storage_1'],
+            sync_job_ids={'storage_1': {'storage_pool': sync_job['id']}})
+
+        self.assertEqual('host_a',
+                         db.sync_job_get(ctxt, sync_job['id'])['host'])
+        self.assertIn(sync_job['id'], task_manager._sync_job_ids)
+        # The other resources get their own job
+        self.assertEqual(3, len(db.sync_job_get_all(ctxt)))
+        self.assertEqual(3, mock_submit.call_count)
+
+    @mock.patch.object(manager.SyncExecutor, 'submit')
+    @mock.patch.object(rpcapi.TaskAPI, 'sync_storages')
+    def test_sync_all_storages(self, mock_sync_storages, mock_submit):
+        ctxt = context.get_admin_context()
+        storage_1 = db.storage_create(ctxt, {'name': 'storage_1'})
+        storage_2 = db.storage_create(ctxt, {'name': 'storage_2',
+                                             'sync_status': 0b010})
+        task_manager = manager.TaskManager()
+
+        task_manager.sync_all_storages(ctxt)
+
+        mock_sync_storages.assert_called_once_with(ctxt, [storage_1['id']])
+        self.assertEqual(0b111, db.storage_get(ctxt, storage_1['id'])
+                         ['sync_status'])
+        self.assertEqual(0b010, db.storage_get(ctxt, storage_2['id'])
+                         ['sync_status'])
+
+        task_manager.sync_storages(ctxt, [storage_1['id']])
+        self.assertEqual([0, 1, 2], sorted(c[0][1] for c in
+                                           mock_submit.call_args_list))
+
+    @mock.patch.object(manager.SyncExecutor, 'submit')
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_job(self, mock_list_volumes, mock_submit):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1'})
+        mock_list_volumes.return_value = [
+            {'storage_id': storage['id'], 'original_id': 'vol_0'}]
+        task_manager = manager.TaskManager(host='host_a')
+
+        task_manager.sync_storage_resource(
+            ctxt, storage['id'],
+            'delfin.task_manager.tasks.task.StorageVolumeTask')
+        sync_job, = db.sync_job_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual('storage_volume', sync_job['resource_type'])
+        self.assertEqual(constants.SyncJobStatus.QUEUED, sync_job['status'])
+        self.assertEqual('host_a', sync_job['host'])
+        self.assertEqual({sync_job['id']}, task_manager._sync_job_ids)
+
+        func, args = mock_submit.call_args[0][2], mock_submit.call_args[0][3:]
+        func(*args)
+        self.assertEqual(set(), task_manager._sync_job_ids)
+
+        sync_job = db.sync_job_get(ctxt, sync_job['id'])
+        self.assertEqual(constants.SyncJobStatus.SUCCEEDED,
+                         sync_job['status'])
+        self.assertEqual({'added': 1, 'updated': 0, 'unchanged': 0,
+                          'deleted': 0}, sync_job['counts'])
+        self.assertIsNotNone(sync_job['started_at'])
+        self.assertIsNotNone(sync_job['ended_at'])
+        self.assertAlmostEqual(sync_job['duration'],
+                               sync_job['driver_time'] + sync_job['db_time'])
+        self.assertIsNone(sync_job['error'])
+
+    def test_check_sync_jobs(self):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1',
+                                           'sync_status': 0b110})
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        now = timeutils.utcnow()
+        lease = datetime.timedelta(seconds=10)
+        own = db.sync_job_create(ctxt, {
+            'storage_id': storage['id'], 'resource_type': 'storage_pool',
+            'status': constants.SyncJobStatus.RUNNING, 'host': 'host_a',
+            'lease_expires_at': now + lease})
+        stale = db.sync_job_create(ctxt, {
+            'storage_id': storage['id'], 'resource_type': 'storage_volume',
+            'status': constants.SyncJobStatus.RUNNING, 'host': 'host_b',
+            'lease_expires_at': now + lease})
+        task_manager = manager.TaskManager(host='host_a')
+        task_manager._sync_job_ids.add(own['id'])
+
+        timeutils.advance_time_seconds(20)
+        task_manager._check_sync_jobs(ctxt)
+
+        self.assertEqual(constants.SyncJobStatus.RUNNING,
+                         db.sync_job_get(ctxt, own['id'])['status'])
+        self.assertEqual(constants.SyncJobStatus.EXPIRED,
+                         db.sync_job_get(ctxt, stale['id'])['status'])
+        self.assertEqual(0b010, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+
+    def test_check_sync_jobs_after_restart(self):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'storage_1',
+                                           'sync_status': 0b010})
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        left = db.sync_job_create(ctxt, {
+            'storage_id': storage['id'], 'resource_type': 'storage_pool',
+            'status': constants.SyncJobStatus.RUNNING, 'host': 'host_a',
+            'lease_expires_at': timeutils.utcnow() +
+            datetime.timedelta(seconds=10)})
+        # Restarted with the same host, the job of the previous process
+        # is not renewed
+        task_manager = manager.TaskManager(host='host_a')
+
+        task_manager._check_sync_jobs(ctxt)
+        timeutils.advance_time_seconds(20)
+        task_manager._check_sync_jobs(ctxt)
+
+        self.assertEqual(constants.SyncJobStatus.EXPIRED,
+                         db.sync_job_get(ctxt, left['id'])['status'])
+        self.assertEqual(0, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+
+    def test_check_sync_jobs_purges(self):
+        self.override_config('sync_job_retention', 3600)
+        ctxt = context.get_admin_context()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        sync_jobs = [db.sync_job_create(ctxt, {
+            'storage_id': 'storage_1', 'resource_type': 'storage_pool',
+            'status': constants.SyncJobStatus.SUCCEEDED,
+            'ended_at': timeutils.utcnow()}) for _ in range(2)]
+        task_manager = manager.TaskManager(host='host_a')
+
+        timeutils.advance_time_seconds(1800)
+        db.sync_job_update(ctxt, sync_jobs[1]['id'],
+                           {'ended_at': timeutils.utcnow()})
+        timeutils.advance_time_seconds(1801)
+        task_manager._check_sync_jobs(ctxt)
+
+        self.assertEqual([sync_jobs[1]['id']],
+                         [job['id'] for job in db.sync_job_get_all(ctxt)])
+
+        # 0 keeps them forever
+        self.override_config('sync_job_retention', 0)
+        timeutils.advance_time_seconds(3600)
+        task_manager._check_sync_jobs(ctxt)
+        self.assertEqual(1, len(db.sync_job_get_all(ctxt)))
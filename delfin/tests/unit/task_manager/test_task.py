@@ -0,0 +1,318 @@
+# Copyright 2020 The SODA Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from delfin import context
+from delfin import db
+from delfin import test
+from delfin.task_manager.tasks import task
+
+
+class TestStorageResourceTask(test.TestCase):
+
+    def test_classify_resources(self):
+        storage_resources = [{'original_id': 'a'}, {'original_id': 'b'},
+                             {'original_id': 'c'}]
+        db_resources = [{'id': 'id_b', 'original_id': 'b'},
+                        {'id': 'id_d', 'original_id': 'd'},
+                        {'id': 'id_a', 'original_id': 'a'}]
+
+        add_list, update_list, delete_id_list, unchanged_list = \
+            task.StorageResourceTask._classify_resources(storage_resources,
+                                                         db_resources)
+
+        self.assertEqual([{'original_id': 'c'}], add_list)
+        self.assertEqual([{'id': 'id_a', 'original_id': 'a'},
+                          {'id': 'id_b', 'original_id': 'b'}], update_list)
+        self.assertEqual(['id_d'], delete_id_list)
+        self.assertEqual([], unchanged_list)
+
+    def test_classify_unknown_resources(self):
+        storage_resources = [{'original_id': 'a', 'unknown': True},
+                             {'original_id': 'b', 'unknown': True}]
+        db_resources = [{'id': 'id_a', 'original_id': 'a'}]
+
+        add_list, update_list, delete_id_list, unchanged_list = \
+            task.StorageResourceTask._classify_resources(storage_resources,
+                                                         db_resources)
+
+        self.assertEqual([], add_list)
+        self.assertEqual([], update_list)
+        self.assertEqual([], delete_id_list)
+        self.assertEqual(['id_a'], [r['id'] for r in unchanged_list])
+
+    def test_classify_resources_with_duplicated_original_id(self):
+        storage_resources = [{'original_id': 'a', 'name': 'first'},
+                             {'original_id': 'a', 'name': 'second'}]
+        db_resources = [{'id': 'id_a1', 'original_id': 'a'},
+                        {'id': 'id_a2', 'original_id': 'a'}]
+
+        add_list, update_list, delete_id_list, unchanged_list = \
+            task.StorageResourceTask._classify_resources(storage_resources,
+                                                         db_resources)
+
+        self.assertEqual([], add_list)
+        self.assertEqual([{'id': 'id_a1', 'original_id': 'a',
+                           'name': 'first'}], update_list)
+        self.assertEqual(['id_a2'], delete_id_list)
+
+    def test_classify_resources_with_fingerprint(self):
+        storage_resources = [{'original_id': 'a', 'fingerprint': 'f1'},
+                             {'original_id': 'b', 'fingerprint': 'f2'}]
+        db_resources = [{'id': 'id_a', 'original_id': 'a',
+                         'fingerprint': 'f1'},
+                        {'id': 'id_b', 'original_id': 'b',
+                         'fingerprint': 'old'}]
+
+        add_list, update_list, delete_id_list, unchanged_list = \
+            task.StorageResourceTask._classify_resources(storage_resources,
+                                                         db_resources)
+
+        self.assertEqual([], add_list)
+        self.assertEqual(['id_b'], [r['id'] for r in update_list])
+        self.assertEqual([], delete_id_list)
+        self.assertEqual(['id_a'], [r['id'] for r in unchanged_list])
+
+    def test_fingerprint(self):
+        resource = {'original_id': 'a', 'name': 'vol', 'total_capacity': 1}
+        same = {'total_capacity': 1, 'name': 'vol', 'original_id': 'a',
+                'id': 'id_a'}
+        changed = {'original_id': 'a', 'name': 'vol', 'total_capacity': 2}
+
+        self.assertEqual(task.fingerprint(resource), task.fingerprint(same))
+        self.assertNotEqual(task.fingerprint(resource),
+                            task.fingerprint(changed))
+
+
+class TestStorageVolumeTask(test.TestCase):
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_only_writes_changes(self, mock_list_volumes):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        volumes = [{'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+                    'name': 'vol_%d' % i, 'total_capacity': i}
+                   for i in range(3)]
+        mock_list_volumes.return_value = volumes
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        counts = volume_task.sync()
+        self.assertEqual({'added': 3, 'updated': 0, 'unchanged': 0,
+                          'deleted': 0}, counts)
+
+        volumes = [dict(v) for v in volumes[1:]]
+        volumes[0]['total_capacity'] = 100
+        mock_list_volumes.return_value = volumes
+        counts = volume_task.sync()
+        self.assertEqual({'added': 0, 'updated': 1, 'unchanged': 1,
+                          'deleted': 1}, counts)
+
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual({'vol_1': 100, 'vol_2': 2},
+                         {v['original_id']: v['total_capacity']
+                          for v in db_volumes})
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.iter_volumes')
+    def test_sync_by_page(self, mock_iter_volumes):
+        self.override_config('volume_sync_page_size', 2)
+        self.override_config('bulk_chunk_size', 2, group='database')
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        db.volumes_create(ctxt, [{'storage_id': storage['id'],
+                                  'original_id': 'stale_%d' % i}
+                                 for i in range(3)])
+        volumes = [{'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+                    'name': 'vol_%d' % i} for i in range(5)]
+        mock_iter_volumes.return_value = iter(
+            [volumes[0:2], volumes[2:4], volumes[4:]])
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        with mock.patch.object(db, 'volume_get_fingerprints',
+                               side_effect=db.volume_get_fingerprints) \
+                as mock_get:
+            counts = volume_task.sync()
+        # Absent volumes are found without loading all volumes at once
+        for call in mock_get.call_args_list:
+            self.assertLessEqual(len(call[0][2]), 2)
+
+        mock_iter_volumes.assert_called_once_with(ctxt, storage['id'], 2)
+        self.assertEqual({'added': 5, 'updated': 0, 'unchanged': 0,
+                          'deleted': 3}, counts)
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual(['vol_%d' % i for i in range(5)],
+                         sorted(v['original_id'] for v in db_volumes))
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_in_upsert_mode(self, mock_list_volumes):
+        self.override_config('resource_sync_mode', 'upsert')
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        db.volumes_create(ctxt, [{'storage_id': storage['id'],
+                                  'original_id': 'stale'}])
+        mock_list_volumes.return_value = [
+            {'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+             'name': 'vol_%d' % i} for i in range(3)]
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        counts = volume_task.sync()
+
+        self.assertEqual({'upserted': 3, 'deleted': 1}, counts)
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual(['vol_0', 'vol_1', 'vol_2'],
+                         sorted(v['original_id'] for v in db_volumes))
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.iter_volumes')
+    def test_sync_in_staging_mode(self, mock_iter_volumes):
+        self.override_config('resource_sync_mode', 'staging')
+        self.override_config('volume_sync_page_size', 2)
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        db.volumes_create(ctxt, [{'storage_id': storage['id'],
+                                  'original_id': 'stale'}])
+        volumes = [{'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+                    'name': 'vol_%d' % i} for i in range(3)]
+        mock_iter_volumes.return_value = iter([volumes[0:2], volumes[1:]])
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        counts = volume_task.sync()
+
+        self.assertEqual({'added': 3, 'updated': 0, 'unchanged': 0,
+                          'deleted': 1}, counts)
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual(['vol_0', 'vol_1', 'vol_2'],
+                         sorted(v['original_id'] for v in db_volumes))
+        for volume in db_volumes:
+            self.assertIsNotNone(volume['fingerprint'])
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.iter_volumes')
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_keeps_unknown_volumes(self, mock_list_volumes,
+                                        mock_iter_volumes):
+        ctxt = context.get_admin_context()
+        for mode, page_size in (('diff', 0), ('diff', 2), ('upsert', 0),
+                                ('upsert', 2), ('staging', 2)):
+            self.override_config('resource_sync_mode', mode)
+            self.override_config('volume_sync_page_size', page_size)
+            storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+            db.volumes_create(ctxt, [
+                {'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+                 'name': 'old'} for i in range(2)])
+            # The details of vol_0 and of the new vol_2 could not be got
+            volumes = [{'storage_id': storage['id'], 'original_id': 'vol_1',
+                        'name': 'new'},
+                       {'storage_id': storage['id'], 'original_id': 'vol_0',
+                        'unknown': True},
+                       {'storage_id': storage['id'], 'original_id': 'vol_2',
+                        'unknown': True}]
+            mock_list_volumes.return_value = volumes
+            mock_iter_volumes.return_value = iter([volumes[:1],
+                                                   volumes[1:]])
+
+            task.StorageVolumeTask(ctxt, storage['id']).sync()
+
+            db_volumes = db.volume_get_all(
+                ctxt, filters={'storage_id': storage['id']})
+            self.assertEqual({'vol_0': 'old', 'vol_1': 'new'},
+                             {v['original_id']: v['name']
+                              for v in db_volumes}, mode)
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_with_shadow_load(self, mock_list_volumes, mock_spawn_n):
+        self.override_config('volume_shadow_load', True)
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        # Left by a load which did not complete
+        db.volumes_create(ctxt, [{'storage_id': storage['id'],
+                                  'original_id': 'vol_0', 'generation': 1}])
+        volumes = [{'storage_id': storage['id'], 'original_id': 'vol_%d' % i,
+                    'name': 'vol_%d' % i} for i in range(3)]
+        mock_list_volumes.return_value = volumes
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        counts = volume_task.sync()
+
+        self.assertEqual({'added': 3, 'updated': 0, 'unchanged': 0,
+                          'deleted': 0}, counts)
+        self.assertFalse(mock_spawn_n.called)
+        self.assertEqual(1, db.storage_get(ctxt, storage['id'])
+                         ['volume_generation'])
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual(['vol_0', 'vol_1', 'vol_2'],
+                         sorted(v['original_id'] for v in db_volumes))
+
+        # Volumes are synced as usual once the storage has some
+        mock_list_volumes.return_value = [dict(v) for v in volumes]
+        counts = volume_task.sync()
+        self.assertEqual({'added': 0, 'updated': 0, 'unchanged': 3,
+                          'deleted': 0}, counts)
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove')
+    @mock.patch('delfin.drivers.api.API.list_volumes')
+    def test_sync_sets_synced(self, mock_list_volumes, mock_remove):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage',
+                                           'sync_status': 0b111})
+        mock_list_volumes.return_value = []
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'])
+
+        volume_task.sync()
+
+        self.assertEqual(0b011, db.storage_get(ctxt, storage['id'])
+                         ['sync_status'])
+        self.assertFalse(mock_remove.called)
+
+        db.storage_delete(ctxt, storage['id'])
+        volume_task.sync()
+
+        mock_remove.assert_called_once_with()
+        self.assertEqual('no', ctxt.read_deleted)
+
+    @mock.patch.object(task.StorageVolumeTask, 'remove', mock.Mock())
+    @mock.patch('delfin.drivers.api.API.list_volumes_in_pools')
+    def test_sync_in_pools(self, mock_list_volumes_in_pools):
+        ctxt = context.get_admin_context()
+        storage = db.storage_create(ctxt, {'name': 'fake_storage'})
+        db.volumes_create(ctxt, [
+            {'storage_id': storage['id'], 'original_id': 'stale',
+             'original_pool_id': 'pool_1'},
+            {'storage_id': storage['id'], 'original_id': 'other',
+             'original_pool_id': 'pool_2'}])
+        mock_list_volumes_in_pools.return_value = [
+            {'storage_id': storage['id'], 'original_id': 'vol_0',
+             'original_pool_id': 'pool_1'}]
+        volume_task = task.StorageVolumeTask(ctxt, storage['id'], ['pool_1'])
+
+        counts = volume_task.sync()
+
+        mock_list_volumes_in_pools.assert_called_once_with(
+            ctxt, storage['id'], ['pool_1'])
+        self.assertEqual({'added': 1, 'updated': 0, 'unchanged': 0,
+                          'deleted': 1}, counts)
+        db_volumes = db.volume_get_all(
+            ctxt, filters={'storage_id': storage['id']})
+        self.assertEqual(['other', 'vol_0'],
+                         sorted(v['original_id'] for v in db_volumes))
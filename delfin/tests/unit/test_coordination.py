@@ -14,6 +14,7 @@
 #    under the License.
 
 import ddt
+import tooz
 from unittest import mock
 from tooz import coordination as tooz_coordination
 from tooz import locking as tooz_locking
@@ -92,6 +93,54 @@ class CoordinatorTestCase(test.TestCase):
             self.assertRaises(Locked, agent2.get_lock(lock_string).acquire)
         self.assertNotIn(expected_lock, MockToozLock.active_locks)
 
+    def test_coordinator_elect_leader(self):
+        crd = self.get_coordinator.return_value
+        crd.get_lock.side_effect = lambda n: MockToozLock(n)
+
+        agent1 = coordination.Coordinator()
+        agent1.start()
+        agent2 = coordination.Coordinator()
+        agent2.start()
+
+        self.assertTrue(agent1.elect_leader('election'))
+        self.assertFalse(agent2.elect_leader('election'))
+        self.assertTrue(agent1.elect_leader('election'))
+        self.assertTrue(agent2.elect_leader('other_election'))
+        MockToozLock.active_locks.clear()
+
+    def test_coordinator_leader_lost(self):
+        crd = self.get_coordinator.return_value
+        lock = mock.Mock()
+        lock.acquire.return_value = True
+        lock.is_still_owner.return_value = True
+        other_lock = mock.Mock()
+        other_lock.acquire.return_value = False
+        crd.get_lock.side_effect = [lock, other_lock]
+        agent = coordination.Coordinator()
+        agent.start()
+
+        self.assertTrue(agent.elect_leader('election'))
+        self.assertTrue(agent.elect_leader('election'))
+        self.assertEqual(1, lock.is_still_owner.call_count)
+
+        # The lock expired and another node acquired it
+        lock.is_still_owner.return_value = False
+        self.assertFalse(agent.elect_leader('election'))
+        lock.release.assert_called_once_with()
+        other_lock.acquire.assert_called_once_with(blocking=False)
+
+    def test_coordinator_leader_not_checked(self):
+        crd = self.get_coordinator.return_value
+        lock = crd.get_lock.return_value
+        lock.acquire.return_value = True
+        lock.is_still_owner.side_effect = tooz.NotImplemented
+        agent = coordination.Coordinator()
+        agent.start()
+
+        self.assertTrue(agent.elect_leader('election'))
+        self.assertTrue(agent.elect_leader('election'))
+        lock.acquire.assert_called_once_with(blocking=False)
+
     def test_coordinator_offline(self):
         crd = self.get_coordinator.return_value
         crd.start.side_effect = tooz_coordination.ToozConnectionError('err')
@@ -101,6 +150,43 @@ class CoordinatorTestCase(test.TestCase):
         self.assertFalse(agent.started)
 
 
+class GroupHashRingTestCase(test.TestCase):
+
+    def setUp(self):
+        super(GroupHashRingTestCase, self).setUp()
+        self.coordinator = mock.Mock()
+        self.ring = coordination.GroupHashRing('group', self.coordinator)
+
+    def _set_hosts(self, *hosts):
+        self.coordinator.get_members.return_value = dict(
+            (('member_' + host).encode(), host.encode()) for host in hosts)
+
+    def test_get_node(self):
+        self.override_config('ring_refresh_interval', 0, group='coordination')
+        self._set_hosts('host_a', 'host_b', 'host_c')
+        keys = ['storage_%d' % i for i in range(100)]
+
+        owners = dict((key, self.ring.get_node(key)) for key in keys)
+        self.assertEqual({'host_a', 'host_b', 'host_c'}, set(owners.values()))
+
+        # Only the storages of the host which left are moved
+        self._set_hosts('host_a', 'host_c')
+        for key in keys:
+            if owners[key] == 'host_b':
+                self.assertIn(self.ring.get_node(key), ('host_a', 'host_c'))
+            else:
+                self.assertEqual(owners[key], self.ring.get_node(key))
+
+    def test_get_node_without_members(self):
+        self.coordinator.get_members.side_effect = Exception('offline')
+        self.assertIsNone(self.ring.get_node('storage'))
+
+    def test_join(self):
+        self.ring.join('host_a')
+        self.coordinator.join_group.assert_called_once_with('group',
+                                                            b'host_a')
+
+
 @mock.patch.object(coordination.LOCK_COORDINATOR, 'get_lock')
 class CoordinationTestCase(test.TestCase):
     def test_lock(self, get_lock):